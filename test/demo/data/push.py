@@ -49,26 +49,6 @@ csvdir = os.path.dirname(__file__)
 filedir = os.path.join(os.path.dirname(__file__), 'files')
 formdir = os.path.join(csvdir, os.path.pardir, 'forms', 'out')
 
-# check intentions
-if not yn('upload data from csv files to Aggregate server?'):
-    sys.exit(0)
-
-# ask aggregate address, username, password
-server = ask('Aggregate server url', 'http://localhost:8080/ODKAggregate')
-username = ask('username', '')
-password = ask('password', '')
-
-# create client instance & connect to server
-url = urllib.parse.urlparse(server)
-port = url.port or (url.scheme == 'https' and 443 or 80)
-hostname = url.netloc
-if ':' in url.netloc:
-    hostname = url.netloc[:url.netloc.index(':')]
-    port = int(url.netloc[url.netloc.index(':')+1:])
-client = aggregate.AggregateClient(hostname, port, url.path, scheme=url.scheme)
-client.connect(username or None, password or None)
-
-
 def filedict_rek(header, dirpath, filedict, fieldpath=[]):
     ''' recurse through folder structure and add files to ``filedict``,
         indexed by [basename][subdir] '''
@@ -90,63 +70,104 @@ def filedict_rek(header, dirpath, filedict, fieldpath=[]):
             filedict.setdefault(base, {})[fieldpathstr] = path
 
 
-# iterate through all .csv files in local dir or the ones specified
-if len(sys.argv) > 1:
-    csvpaths = sys.argv[1:]
-else:
-    csvpaths = glob.glob(os.path.join(csvdir, '*.csv'))
-
-for csvpath in csvpaths:
-
-    formid = os.path.splitext(os.path.basename(csvpath))[0]
-    xmlpath = os.path.join(formdir, formid + '.xml')
-    formfiledir = os.path.join(filedir, formid)
-
-    if not os.path.isfile(xmlpath):
-        print('skipping file "%s" because XForm "%s" not found' % (
-            csvpath, xmlpath))
-        continue
-
-    # load corresponding .xml form
-    with io.open(xmlpath) as fd:
-        form_xml = fd.read()
-        form = aggregate.XForm(form_xml)
-
-    with io.open(csvpath) as csvfd:
-
-        reader = csv.reader(csvfd)
-        header = next(reader)
-
-        # compare .csv header fields with .xml form specification
-        idxs = {}
-        for i, name in enumerate(header):
-            if name in form.paths:
-                idxs[name] = i
-            else:
-                print('field "%s" not found in form "%s" -> IGNORING' % (
-                           name, formid))
-                sys.exit(-1)
-
-        # create file dict
-        filedict = {}
-        if os.path.isdir(formfiledir):
-            filedict_rek(header, formfiledir, filedict)
-
-        # send form for every row
-        for row in reader:
-            form = aggregate.XForm(form_xml)
-            # fill in values rom csv
-            for name in idxs:
-                form[name] = row[idxs[name]]
-            # add files if found
-            if row[0] in filedict:
-                for name, path in filedict[row[0]].items():
-                    form.set_file(name, path)
-
-            try:
-                client.post_multipart(form.get_items())
-                print('successfully posted form %s, "%s"' % (formid, row[0]))
-            except aggregate.AggregateFormNotFoundException:
-                print('could not find form %s on server' % formid)
-                break
+def main():
+
+    # check intentions
+    if not yn('upload data from csv files to Aggregate server?'):
+        sys.exit(0)
+
+    # ask aggregate address, username, password
+    server = ask('Aggregate server url', 'http://localhost:8080/ODKAggregate')
+    username = ask('username', '')
+    password = ask('password', '')
+
+    # create client instance & connect to server
+    url = urllib.parse.urlparse(server)
+    port = url.port or (url.scheme == 'https' and 443 or 80)
+    hostname = url.netloc
+    if ':' in url.netloc:
+        hostname = url.netloc[:url.netloc.index(':')]
+        port = int(url.netloc[url.netloc.index(':')+1:])
+    client = aggregate.AggregateClient(hostname, port, url.path, scheme=url.scheme)
+    client.connect(username or None, password or None)
+
+    # use the XForms as currently published on the server if possible
+    forms = aggregate.FormCache(os.path.join(csvdir, 'forms_cache'))
+    try:
+        server_forms = client.fetch_forms(forms)
+    except aggregate.AggregateException as e:
+        print('could not download forms from server (%s) -> using local forms' % e)
+        server_forms = {}
+
+    # iterate through all .csv files in local dir or the ones specified
+    if len(sys.argv) > 1:
+        csvpaths = sys.argv[1:]
+    else:
+        csvpaths = glob.glob(os.path.join(csvdir, '*.csv'))
+
+    for csvpath in csvpaths:
+
+        formid = os.path.splitext(os.path.basename(csvpath))[0]
+        xmlpath = os.path.join(formdir, formid + '.xml')
+        formfiledir = os.path.join(filedir, formid)
+
+        # load corresponding .xml form (downloaded or local)
+        if formid in server_forms:
+            xform_template = forms.template(formid)
+        elif os.path.isfile(xmlpath):
+            with io.open(xmlpath) as fd:
+                xform_template = aggregate.XFormTemplate(fd.read())
+        else:
+            print('skipping file "%s" because XForm "%s" not found' % (
+                csvpath, xmlpath))
+            continue
 
+        with io.open(csvpath) as csvfd:
+
+            reader = csv.reader(csvfd)
+            header = next(reader)
+
+            # compare .csv header fields with .xml form specification
+            idxs = {}
+            for i, name in enumerate(header):
+                path = xform_template.find_path(name)
+                if path is not None:
+                    idxs[path] = i
+                else:
+                    print('field "%s" not found in form "%s" -> IGNORING' % (
+                               name, formid))
+                    sys.exit(-1)
+
+            # create file dict
+            filedict = {}
+            if os.path.isdir(formfiledir):
+                filedict_rek(header, formfiledir, filedict)
+
+            # records with values from csv and files if found
+            def records():
+                for row in reader:
+                    yield row[0], {
+                        'values': {name: row[idx] for name, idx in idxs.items()},
+                        'files': filedict.get(row[0], {}),
+                    }, None
+
+            # fill in and encode forms on all CPU cores, send form for every row
+            with aggregate.EncodingPool(xform_template) as encoder:
+                for rowid, result in encoder.encode(records()):
+                    if isinstance(result, Exception):
+                        print('could not fill in form %s, "%s" : %s' % (
+                            formid, rowid, result))
+                        continue
+                    instance_id, body = result
+
+                    try:
+                        client.post_multipart(body)
+                        print('successfully posted form %s, "%s"' % (formid, rowid))
+                    except aggregate.AggregateFormNotFoundException:
+                        print('could not find form %s on server' % formid)
+                        break
+
+
+# (worker processes of EncodingPool import this file : no side effects)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''tests of AsyncAggregateClient (tools/odk_pusher/aggregate.py)'''
+
+import unittest, asyncio, os, sys, tempfile, shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import (AsyncAggregateClient, MultipartBody, AttachmentFile,
+        AggregateException, FormCache)
+from bench import StandinServer
+
+
+class FlakyConnection:
+    '''stands in for an idle keep-alive AsyncConnection that the server
+    closed : the first request fails while the body is written'''
+
+    def __init__(self):
+        self.requests = 1
+        self.is_open = True
+        self.sent = 0
+
+    async def request(self, method, uri, body, headers, timing=None,
+            timeouts=None, deadline=None):
+        self.sent += 1
+        if self.sent == 1:
+            raise BrokenPipeError('broken pipe')
+        self.requests += 1
+        return 201, 'Created', {}, b''
+
+    def close(self):
+        self.is_open = False
+
+
+class TestAsyncAggregateClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = StandinServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def client(self):
+        return AsyncAggregateClient(self.server.server_address[0],
+                self.server.server_address[1], self.server.uri, scheme='http')
+
+    def test_retry_failed_write_on_reused_connection(self):
+        client = self.client()
+        conn = FlakyConnection()
+        async def run():
+            client.slots = asyncio.Semaphore(1)
+            client.idle = [conn]
+            await client.post_multipart([('xml_submission_file',
+                    'submission.xml', '<data/>', 'text/xml')])
+        asyncio.run(run())
+        self.assertEqual(conn.sent, 2)
+
+    def test_no_retry_on_new_connection(self):
+        client = self.client()
+        conn = FlakyConnection()
+        conn.requests = 0
+        async def run():
+            client.slots = asyncio.Semaphore(1)
+            client.idle = [conn]
+            await client.post_multipart([('xml_submission_file',
+                    'submission.xml', '<data/>', 'text/xml')])
+        self.assertRaises(BrokenPipeError, asyncio.run, run())
+        self.assertEqual(conn.sent, 1)
+
+    def test_body_iterated_off_loop(self):
+        path = os.path.join(self.tmp, 'image.jpg')
+        with open(path, 'wb') as fd:
+            fd.write(os.urandom(3 * MultipartBody.chunk_size + 17))
+        body = MultipartBody([
+                ('xml_submission_file', 'submission.xml', '<data/>', 'text/xml'),
+                ('image.jpg', 'image.jpg', AttachmentFile(path), 'image/jpeg'),
+            ])
+        async def collect():
+            return b''.join([chunk async for chunk in body])
+        self.assertEqual(asyncio.run(collect()), bytes(body))
+
+    def test_post_attachment(self):
+        path = os.path.join(self.tmp, 'image.jpg')
+        with open(path, 'wb') as fd:
+            fd.write(os.urandom(200 * 1024))
+        client = self.client()
+        async def run():
+            await client.connect()
+            for i in range(3):
+                await client.post_multipart([
+                        ('xml_submission_file', 'submission.xml', '<data/>',
+                            'text/xml'),
+                        ('image.jpg', 'image.jpg', AttachmentFile(path),
+                            'image/jpeg'),
+                    ])
+            await client.close()
+        asyncio.run(run())
+        self.assertEqual(self.server.submissions, 3)
+
+    def test_is_connected(self):
+        client = self.client()
+        self.assertFalse(client.is_connected())
+        async def run():
+            await client.connect()
+            self.assertTrue(client.is_connected())
+            await client.close()
+        asyncio.run(run())
+        self.assertFalse(client.is_connected())
+        self.assertRaises(AggregateException, client.fetch_forms,
+                FormCache(self.tmp))
+
+
+if __name__ == '__main__':
+    unittest.main()
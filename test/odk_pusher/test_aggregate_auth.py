@@ -0,0 +1,85 @@
+'''tests of digest authentication with stale nonces (aggregate.py)'''
+
+import unittest, os, sys, asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import (DAA, AggregateClient, PooledAggregateClient,
+        AsyncAggregateClient, AggregateException)
+from bench import StandinServer
+
+
+ITEMS = [('xml_submission_file', 'submission.xml', '<data/>', 'text/xml')]
+CHALLENGE = 'Digest realm="ODK Aggregate", qop="auth", nonce="%s"'
+
+
+class TestDAA(unittest.TestCase):
+
+    def test_update(self):
+        daa = DAA(CHALLENGE % 'n1', 'user1', 'password1')
+        self.assertIn('nonce="n1"', daa.get_authentication('POST', '/x'))
+        self.assertIn('nc="00000002"', daa.get_authentication('POST', '/x'))
+        # same nonce again : credentials were rejected
+        self.assertFalse(daa.update(CHALLENGE % 'n1'))
+        # same nonce flagged as stale, or new nonce : retry
+        self.assertTrue(daa.update(CHALLENGE % 'n1' + ', stale="true"'))
+        self.assertTrue(daa.update(CHALLENGE % 'n2'))
+        auth = daa.get_authentication('POST', '/x')
+        self.assertIn('nonce="n2"', auth)
+        self.assertIn('nc="00000001"', auth)
+
+
+class TestStaleNonce(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer(users={'user1': 'password1'}).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def args(self):
+        return (self.server.server_address[0], self.server.server_address[1],
+                self.server.uri)
+
+    def check_stale(self, client):
+        client.connect('user1', 'password1')
+        client.post_multipart(ITEMS)
+        self.assertEqual(self.server.challenges, 1)
+        self.server.renew_nonce()
+        client.post_multipart(ITEMS)
+        client.post_multipart(ITEMS)
+        # one stale challenge, then the new nonce is used preemptively
+        self.assertEqual(self.server.challenges, 2)
+        self.assertEqual(self.server.submissions, 3)
+        client.close()
+
+    def test_sync(self):
+        self.check_stale(AggregateClient(*self.args(), scheme='http'))
+
+    def test_pooled(self):
+        self.check_stale(PooledAggregateClient(*self.args(), scheme='http'))
+
+    def test_async(self):
+        client = AsyncAggregateClient(*self.args(), scheme='http')
+        async def run():
+            await client.connect('user1', 'password1')
+            await client.post_multipart(ITEMS)
+            self.server.renew_nonce()
+            await client.post_multipart(ITEMS)
+            await client.post_multipart(ITEMS)
+            await client.close()
+        asyncio.run(run())
+        self.assertEqual(self.server.challenges, 2)
+        self.assertEqual(self.server.submissions, 3)
+
+    def test_wrong_password(self):
+        client = AggregateClient(*self.args(), scheme='http')
+        self.assertRaises(AggregateException,
+                client.connect, 'user1', 'wrong')
+        # second challenge with the same nonce : no endless retries
+        self.assertEqual(self.server.challenges, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+'''tests of Balancer and BalancedAggregateClient (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys, time, threading, asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import (Balancer, BalancedAggregateClient,
+        AsyncBalancedAggregateClient, AggregateClient, AggregateException,
+        AggregateStatusException, AggregateFormNotFoundException,
+        PooledAggregateClient, ClientOptions)
+from bench import StandinServer
+
+
+ITEMS = [('xml_submission_file', 'submission.xml', '<data/>', 'text/xml')]
+
+
+class FakeClient:
+    """Client whose posts raise the exceptions in ``errors`` (in turn)"""
+
+    size_budget = None
+
+    def __init__(self, url, errors=()):
+        self.url = url
+        self.errors = list(errors)
+        self.posted = 0
+
+    def is_connected(self):
+        return True
+
+    def connect(self, user=None, password=None):
+        pass
+
+    def post_multipart(self, items):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.posted += 1
+
+    async def post_submission(self, items):
+        self.post_multipart(items)
+        return 0
+
+
+class TestBalancer(unittest.TestCase):
+
+    def balancer(self, n=2, **kwargs):
+        return Balancer([FakeClient('http://e%d' % i) for i in range(n)],
+                **kwargs)
+
+    def test_outstanding(self):
+        balancer = self.balancer(3)
+        endpoints = [balancer.acquire()[0] for i in range(3)]
+        # every endpoint gets one submission in turn
+        self.assertEqual(endpoints, balancer.endpoints)
+        balancer.release(endpoints[1], 0.1)
+        self.assertIs(balancer.acquire()[0], endpoints[1])
+        self.assertEqual(balancer.acquire([endpoints[0]])[0].outstanding, 2)
+        self.assertEqual(balancer.acquire(balancer.endpoints), (None, False))
+
+    def test_latency(self):
+        balancer = self.balancer(policy='latency')
+        fast, slow = balancer.endpoints
+        balancer.release(balancer.acquire()[0], 0.01)
+        balancer.release(balancer.acquire()[0], 1.)
+        for i in range(5):
+            endpoint, probe = balancer.acquire()
+            self.assertIs(endpoint, fast)
+            balancer.release(endpoint, 0.01)
+
+    def test_eject_after_failures(self):
+        balancer = self.balancer(max_failures=2, eject_time=60)
+        bad, good = balancer.endpoints
+        for i in range(2):
+            endpoint, probe = balancer.acquire([good])
+            balancer.release(endpoint, error=OSError('refused'))
+        self.assertIsNotNone(bad.ejected_until)
+        self.assertEqual(balancer.healthy, [good])
+        for i in range(3):
+            self.assertEqual(balancer.acquire(), (good, False))
+        self.assertEqual(bad.outstanding, 0)
+
+    def test_probe(self):
+        balancer = self.balancer(max_failures=1, eject_time=0.05)
+        bad, good = balancer.endpoints
+        balancer.eject(bad, OSError('refused'))
+        self.assertEqual((bad.failed, bad.ejections), (1, 1))
+        time.sleep(0.06)
+        # due for probing : exactly one submission probes the endpoint
+        self.assertEqual(balancer.acquire(), (bad, True))
+        self.assertTrue(bad.probing)
+        self.assertEqual(balancer.acquire(), (good, False))
+        # failed probe : ejected for twice as long
+        balancer.release(bad, error=OSError('refused'))
+        self.assertFalse(bad.probing)
+        self.assertGreater(bad.ejected_until - time.monotonic(), 0.06)
+        bad.ejected_until = time.monotonic()
+        self.assertEqual(balancer.acquire(), (bad, True))
+        balancer.release(bad, 0.01)
+        self.assertIsNone(bad.ejected_until)
+        self.assertEqual(bad.ejections, 0)
+
+    def test_all_ejected(self):
+        balancer = self.balancer(eject_time=60)
+        first, second = balancer.endpoints
+        balancer.eject(first, OSError())
+        balancer.eject(second, OSError())
+        # endpoint ejected first is probed instead of failing
+        self.assertEqual(balancer.acquire(), (first, True))
+        self.assertEqual(balancer.acquire(), (second, True))
+        self.assertEqual(balancer.acquire(), (None, False))
+
+    def test_eject_concurrently(self):
+        balancer = self.balancer(eject_time=60)
+        endpoint = balancer.endpoints[0]
+        def work():
+            for i in range(200):
+                acquired, probe = balancer.acquire()
+                balancer.release(acquired, 0.001)
+                balancer.eject(endpoint, OSError())
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([e.outstanding for e in balancer.endpoints], [0, 0])
+        self.assertFalse(any(e.probing for e in balancer.endpoints))
+
+
+class TestBalancedAggregateClient(unittest.TestCase):
+
+    def test_transient_errors(self):
+        clients = [FakeClient('http://e0', [ConnectionResetError(),
+                AggregateStatusException('', 503)]), FakeClient('http://e1')]
+        client = BalancedAggregateClient(clients)
+        client.post_multipart(ITEMS)
+        client.post_multipart(ITEMS)
+        # posted again on the other endpoint
+        self.assertEqual([c.posted for c in clients], [0, 2])
+        self.assertEqual([e.failed for e in client.balancer.endpoints], [2, 0])
+
+    def test_other_errors(self):
+        clients = [FakeClient('http://e0', [AggregateStatusException('', 400),
+                AggregateFormNotFoundException('form'),
+                AggregateException('other')]), FakeClient('http://e1')]
+        client = BalancedAggregateClient(clients, max_failures=1)
+        for error in (AggregateStatusException, AggregateFormNotFoundException,
+                AggregateException):
+            self.assertRaises(error, client.post_multipart, ITEMS)
+            # skip second endpoint : next submission goes to the first one
+            client.balancer.release(client.balancer.acquire()[0])
+        endpoint = client.balancer.endpoints[0]
+        # not counted against the endpoint nor posted again on another one
+        self.assertEqual((endpoint.failed, endpoint.outstanding), (0, 0))
+        self.assertIsNone(endpoint.ejected_until)
+        self.assertEqual(clients[1].posted, 0)
+
+    def test_async_errors(self):
+        clients = [FakeClient('http://e0', [AggregateStatusException('', 400)]),
+                FakeClient('http://e1', [OSError('reset')])]
+        client = AsyncBalancedAggregateClient(clients)
+        self.assertRaises(AggregateStatusException, asyncio.run,
+                client.post_multipart(ITEMS))
+        asyncio.run(client.post_multipart(ITEMS))
+        self.assertEqual([c.posted for c in clients], [1, 0])
+        self.assertEqual([e.failed for e in client.balancer.endpoints], [0, 1])
+        self.assertEqual([e.outstanding for e in client.balancer.endpoints],
+                [0, 0])
+
+    def test_failover(self):
+        servers = [StandinServer().start() for i in range(2)]
+        try:
+            clients = [AggregateClient(server.server_address[0],
+                    server.server_address[1], server.uri, scheme='http')
+                    for server in servers]
+            client = BalancedAggregateClient(clients, max_failures=1,
+                    eject_time=60)
+            client.connect()
+            servers[0].stop()
+            for i in range(4):
+                client.post_multipart(ITEMS)
+            self.assertEqual(servers[1].submissions, 4)
+            self.assertEqual(client.balancer.healthy,
+                    client.balancer.endpoints[1:])
+            client.close()
+        finally:
+            for server in servers:
+                server.stop()
+
+
+class TestClientOptions(unittest.TestCase):
+
+    def test_defaults(self):
+        data = dict(other=1)
+        options = ClientOptions(data)
+        self.assertEqual(data, dict(other=1))
+        self.assertEqual((options.outbox, options.max_size, options.timeouts,
+                options.replicas), (None, None, None, []))
+        client = options.create_client('http', 'localhost', 80, '/a')
+        self.assertIsInstance(client, PooledAggregateClient)
+
+    def test_replicas(self):
+        data = dict(max_size='1000', timeouts=dict(connect=5),
+                odk=dict(replicas=['https://b.org/a', 'http://c.org:81/a'],
+                    balance='latency', forms_dir='forms', username='u'))
+        options = ClientOptions(data, data['odk'])
+        self.assertEqual(data, dict(odk=dict(username='u')))
+        self.assertEqual(options.replicas, [('https', 'b.org', 443, '/a'),
+                ('http', 'c.org', 81, '/a')])
+        self.assertEqual(options.timeouts.connect, 5)
+        client = options.create_client('http', 'a.org', 80, '/a',
+                max_connections=2)
+        self.assertIsInstance(client, BalancedAggregateClient)
+        self.assertEqual(client.balancer.policy, 'latency')
+        self.assertEqual([c.submission_url for c in client.clients], [
+                'http://a.org:80/a/submission',
+                'https://b.org:443/a/submission',
+                'http://c.org:81/a/submission'])
+        self.assertEqual(client.size_budget, 1000)
+
+    def test_invalid(self):
+        for data in (dict(max_size='x'), dict(timeouts=dict(foo=1)),
+                dict(replicas=['b.org']), dict(balance='random')):
+            self.assertRaises(ValueError, ClientOptions, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
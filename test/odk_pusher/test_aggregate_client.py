@@ -0,0 +1,76 @@
+'''tests of AggregateClient (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import AggregateClient, AggregateStatusException, Timeouts
+from bench import StandinServer
+
+
+ITEMS = [('xml_submission_file', 'submission.xml', '<data/>', 'text/xml')]
+
+
+class TestAggregateClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer(users={'user1': 'password1'}).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, **kwargs):
+        return AggregateClient(self.server.server_address[0],
+                self.server.server_address[1], self.server.uri, scheme='http',
+                **kwargs)
+
+    def spy_posts(self, client):
+        """Returns list receiving the items of every request posted"""
+        posted = []
+        post_part = client.post_part
+        def spy(items, deadline=None):
+            posted.append(items)
+            return post_part(items, deadline)
+        client.post_part = spy
+        return posted
+
+    def test_is_connected_after_server_down(self):
+        client = self.client()
+        self.assertFalse(client.is_connected())
+        client.connect('user1', 'password1')
+        client.post_multipart(ITEMS)
+        self.assertTrue(client.is_connected())
+
+        address = self.server.server_address
+        self.server.stop()
+        self.assertRaises(OSError, client.post_multipart, ITEMS)
+        self.assertFalse(client.is_connected())
+
+        self.server = StandinServer(address[0], address[1],
+                users={'user1': 'password1'}).start()
+        client.connect('user1', 'password1')
+        self.assertTrue(client.is_connected())
+        client.post_multipart(ITEMS)
+        self.assertEqual(self.server.submissions, 1)
+        client.close()
+        self.assertFalse(client.is_connected())
+
+    def test_retries(self):
+        client = self.client(timeouts=Timeouts(retries=2))
+        client.connect('user1', 'password1')
+        posted = self.spy_posts(client)
+        # rejected by the server : not retried
+        self.server.max_content_length = 100
+        self.assertRaises(AggregateStatusException, client.post_multipart,
+                [('xml_submission_file', 'submission.xml',
+                    '<data>%s</data>' % ('x' * 200), 'text/xml')])
+        self.assertEqual(len(posted), 1)
+        # server cannot be reached : retried
+        self.server.stop()
+        self.assertRaises(OSError, client.post_multipart, ITEMS)
+        self.assertEqual(len(posted), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
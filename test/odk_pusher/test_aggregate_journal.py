@@ -0,0 +1,121 @@
+'''tests of Journal and BulkPoster (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys, tempfile, shutil, json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import (Journal, BulkPoster, AsyncAggregateClient,
+        XFormTemplate)
+from bench import StandinServer
+
+
+XFORM = '''<?xml version="1.0"?>
+<h:html xmlns="http://www.w3.org/2002/xforms" xmlns:h="http://www.w3.org/1999/xhtml">
+  <h:head>
+    <h:title>journal test</h:title>
+    <model>
+      <instance>
+        <data id="journal_test">
+          <name/>
+          <meta><instanceID/></meta>
+        </data>
+      </instance>
+      <bind nodeset="/data/name" type="string"/>
+      <bind calculate="concat('uuid:', uuid())" nodeset="/data/meta/instanceID" readonly="true()" type="string"/>
+    </model>
+  </h:head>
+  <h:body/>
+</h:html>
+'''
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'journal.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_lines(self, lines):
+        with open(self.path, 'w', encoding='utf8') as fd:
+            fd.write(''.join(lines))
+
+    def test_resume(self):
+        self.write_lines([
+                'P\tuuid:1\t"a"\n',
+                'D\tuuid:1\t"a"\n',
+                'P\tuuid:2\t"b"\n',
+                'P\tuuid:3\t3\n',
+                # torn line written while crashing
+                'D\tuuid:3\t"c',
+            ])
+        journal = Journal(self.path)
+        self.assertEqual(journal.done, {'a'})
+        self.assertEqual(journal.pending, {'b': 'uuid:2', 3: 'uuid:3'})
+        journal.close()
+
+    def test_commit_survives_reopen(self):
+        journal = Journal(self.path)
+        journal.begin('a', 'uuid:1')
+        journal.begin('b', 'uuid:2')
+        journal.commit('a', 'uuid:1')
+        journal.close()
+        journal = Journal(self.path)
+        self.assertEqual(journal.done, {'a'})
+        self.assertEqual(journal.pending, {'b': 'uuid:2'})
+        journal.close()
+
+
+class TestBulkPoster(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'journal.txt')
+        self.server = StandinServer().start()
+        self.template = XFormTemplate(XFORM)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def run_poster(self, rows):
+        forms = {}
+        def fill(row):
+            form = self.template.new()
+            form['name'] = row
+            forms[row] = form
+            return form
+        client = AsyncAggregateClient(self.server.server_address[0],
+                self.server.server_address[1], self.server.uri, scheme='http')
+        poster = BulkPoster(client, fill, Journal(self.path))
+        failed = poster.run([(row, row) for row in rows])
+        return poster, forms, failed
+
+    def test_resume_skips_done_and_reuses_instance_id(self):
+        with open(self.path, 'w', encoding='utf8') as fd:
+            fd.write('P\tuuid:a\t"a"\nD\tuuid:a\t"a"\nP\tuuid:b\t"b"\n')
+        poster, forms, failed = self.run_poster(['a', 'b', 'c'])
+        self.assertEqual(failed, 0)
+        self.assertEqual((poster.posted, poster.skipped), (2, 1))
+        self.assertEqual(self.server.submissions, 2)
+        self.assertNotIn('a', forms)
+        # pending row posted again with the same instanceID
+        self.assertEqual(forms['b']['meta/instanceID'], 'uuid:b')
+        self.assertNotEqual(forms['c']['meta/instanceID'], 'uuid:b')
+
+        journal = Journal(self.path)
+        self.assertEqual(journal.done, {'a', 'b', 'c'})
+        self.assertEqual(journal.pending, {})
+        journal.close()
+
+        # second run posts nothing
+        poster, forms, failed = self.run_poster(['a', 'b', 'c'])
+        self.assertEqual((poster.posted, poster.skipped), (0, 3))
+        self.assertEqual(self.server.submissions, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+'''tests of Outbox and OutboxDrainer (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys, tempfile, shutil, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import (Outbox, OutboxDrainer, PooledAggregateClient,
+        AggregateStatusException, AggregateTimeoutException, is_transient)
+from bench import StandinServer
+
+
+def items(text='<data/>'):
+    return [('xml_submission_file', 'submission.xml', text, 'text/xml')]
+
+
+class ScriptedClient:
+    """Client whose posts raise the exceptions in ``errors`` (in turn)"""
+
+    def __init__(self, errors=(), connect_errors=()):
+        self.errors = list(errors)
+        self.connect_errors = list(connect_errors)
+        self.connected = False
+        self.bodies = []
+
+    def is_connected(self):
+        return self.connected
+
+    def connect(self, user=None, password=None):
+        if self.connect_errors:
+            raise self.connect_errors.pop(0)
+        self.connected = True
+
+    def post_multipart(self, body):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.bodies.append(b''.join(body))
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def files(self):
+        return sorted(fname for fname in os.listdir(self.tmp)
+                if fname != 'failed')
+
+    def test_sync_renames(self):
+        outbox = Outbox(self.tmp)
+        entry = outbox.append('row1', items(), 'uuid:1')
+        # not handed out before it is synced
+        self.assertEqual(self.files(), [entry.name + '.body.tmp',
+                entry.name + '.json.tmp'])
+        self.assertIsNone(outbox.first(timeout=0))
+        outbox.sync()
+        self.assertEqual(self.files(), [entry.name + '.body',
+                entry.name + '.json'])
+        self.assertIs(outbox.first(timeout=0), entry)
+        self.assertEqual(len(outbox), 1)
+        self.assertIn(b'<data/>', b''.join(entry.body))
+
+    def test_sync_every(self):
+        outbox = Outbox(self.tmp)
+        outbox.sync_every = 2
+        outbox.append('row1', items(), 'uuid:1')
+        self.assertEqual(len(outbox), 0)
+        outbox.append('row2', items(), 'uuid:2')
+        self.assertEqual(len(outbox), 2)
+
+    def test_reopen(self):
+        outbox = Outbox(self.tmp)
+        first = outbox.append('row1', items(), 'uuid:1')
+        outbox.append('row2', items(), 'uuid:2')
+        outbox.sync()
+        outbox.append('row3', items(), 'uuid:3')
+
+        # crash : unsynced submission is discarded (row3 was not marked done)
+        outbox = Outbox(self.tmp)
+        self.assertEqual([entry.key for entry in outbox.entries.values()],
+                ['row1', 'row2'])
+        self.assertFalse([fname for fname in self.files()
+                if fname.endswith('.tmp')])
+        entry = outbox.first(timeout=0)
+        self.assertEqual((entry.name, entry.instance_id),
+                (first.name, 'uuid:1'))
+        # sequence numbers of synced submissions are not reused
+        self.assertEqual(outbox.seq, 2)
+
+    def test_crash_while_removing(self):
+        outbox = Outbox(self.tmp)
+        entry = outbox.append('row1', items(), 'uuid:1')
+        outbox.sync()
+        # remove() deletes .body first
+        os.remove(entry.path('.body'))
+        outbox = Outbox(self.tmp)
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(self.files(), [])
+
+    def test_remove_and_fail(self):
+        outbox = Outbox(self.tmp)
+        first = outbox.append('row1', items(), 'uuid:1')
+        second = outbox.append('row2', items(), 'uuid:2')
+        outbox.sync()
+        outbox.remove(first)
+        outbox.fail(second)
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(self.files(), [])
+        self.assertEqual(sorted(os.listdir(outbox.failed_directory)),
+                [second.name + '.body', second.name + '.json'])
+        self.assertEqual(len(Outbox(self.tmp)), 0)
+
+    def test_requeue_failed(self):
+        outbox = Outbox(self.tmp)
+        entries = [outbox.append('row%d' % i, items(), 'uuid:%d' % i)
+                for i in range(3)]
+        outbox.sync()
+        outbox.fail(entries[0])
+        outbox.fail(entries[2])
+        self.assertEqual(outbox.requeue_failed(), 2)
+        self.assertEqual(os.listdir(outbox.failed_directory), [])
+        self.assertEqual(list(outbox.entries), [entry.name for entry in entries])
+        self.assertEqual(outbox.first().key, 'row0')
+        self.assertEqual(len(Outbox(self.tmp)), 3)
+        self.assertEqual(outbox.requeue_failed(), 0)
+
+
+class TestOutboxDrainer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.outbox = Outbox(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def drain(self, client, n, **kwargs):
+        for i in range(n):
+            self.outbox.append('row%d' % i, items(), 'uuid:%d' % i)
+        self.outbox.sync()
+        drainer = OutboxDrainer(self.outbox, client, retry_interval=0.01,
+                **kwargs)
+        drainer.start()
+        t0 = time.time()
+        while len(self.outbox) and time.time() - t0 < 10:
+            time.sleep(0.01)
+        drainer.stop()
+        drainer.join()
+        self.assertEqual(len(self.outbox), 0)
+        return drainer
+
+    def failed(self):
+        return sorted(fname[:-5] for fname in os.listdir(
+                self.outbox.failed_directory) if fname.endswith('.json'))
+
+    def test_is_transient(self):
+        self.assertTrue(is_transient(ConnectionResetError()))
+        self.assertTrue(is_transient(AggregateTimeoutException('wait')))
+        self.assertTrue(is_transient(AggregateStatusException('', 503)))
+        self.assertTrue(is_transient(AggregateStatusException('', 429)))
+        self.assertFalse(is_transient(AggregateStatusException('', 400)))
+        self.assertFalse(is_transient(ValueError()))
+
+    def test_retries_transient(self):
+        client = ScriptedClient([ConnectionResetError(),
+                AggregateStatusException('', 503)],
+                connect_errors=[ConnectionRefusedError()] * 5)
+        drainer = self.drain(client, 2, max_attempts=3)
+        self.assertEqual((drainer.posted, drainer.failed), (2, 0))
+        self.assertEqual(len(client.bodies), 2)
+
+    def test_rejected(self):
+        client = ScriptedClient([AggregateStatusException('', 400)])
+        drainer = self.drain(client, 2)
+        self.assertEqual((drainer.posted, drainer.failed), (1, 1))
+        self.assertEqual(len(self.failed()), 1)
+        self.assertTrue(self.failed()[0].endswith('uuid_0'))
+
+    def test_retries_forever(self):
+        # by default, a long outage does not move submissions to failed/
+        client = ScriptedClient([AggregateStatusException('', 503)] * 30)
+        drainer = self.drain(client, 2, max_retry_interval=0.01)
+        self.assertEqual((drainer.posted, drainer.failed), (2, 0))
+        self.assertEqual(self.failed(), [])
+
+    def test_max_attempts(self):
+        client = ScriptedClient([AggregateStatusException('', 500)] * 3)
+        drainer = self.drain(client, 2, max_attempts=2)
+        # first entry failed twice, second entry once before it was posted
+        self.assertEqual((drainer.posted, drainer.failed), (1, 1))
+        self.assertTrue(self.failed()[0].endswith('uuid_0'))
+
+    def test_server(self):
+        server = StandinServer(max_content_length=2000).start()
+        try:
+            client = PooledAggregateClient(server.server_address[0],
+                    server.server_address[1], server.uri, scheme='http')
+            self.outbox.append('large', items('<data>%s</data>' %
+                    ('x' * 5000)), 'uuid:large')
+            drainer = self.drain(client, 2)
+            client.close()
+        finally:
+            server.stop()
+        # status 413 : moved to failed/ instead of blocking the outbox
+        self.assertEqual((drainer.posted, drainer.failed), (2, 1))
+        self.assertEqual(server.submissions, 2)
+        self.assertTrue(self.failed()[0].endswith('uuid_large'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+'''tests of PooledAggregateClient (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import PooledAggregateClient, Timeouts
+from bench import StandinServer
+
+
+ITEMS = [('xml_submission_file', 'submission.xml', '<data/>', 'text/xml')]
+
+
+class TestPooledAggregateClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer(users={'user1': 'password1'}).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, **kwargs):
+        return PooledAggregateClient(self.server.server_address[0],
+                self.server.server_address[1], self.server.uri,
+                scheme='http', **kwargs)
+
+    def test_concurrent_posts(self):
+        client = self.client(max_connections=4)
+        client.connect('user1', 'password1')
+        threads = [threading.Thread(target=lambda: [
+                client.post_multipart(ITEMS) for i in range(5)])
+                for j in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.submissions, 20)
+        # nonce is shared : only the first connection was challenged
+        self.assertEqual(self.server.challenges, 1)
+        client.close()
+
+    def test_is_connected_after_server_down(self):
+        client = self.client()
+        self.assertFalse(client.is_connected())
+        client.connect('user1', 'password1')
+        client.post_multipart(ITEMS)
+        self.assertTrue(client.is_connected())
+
+        address = self.server.server_address
+        self.server.stop()
+        self.assertRaises(OSError, client.post_multipart, ITEMS)
+        self.assertFalse(client.is_connected())
+        self.assertRaises(OSError, client.connect, 'user1', 'password1')
+
+        self.server = StandinServer(address[0], address[1],
+                users={'user1': 'password1'}).start()
+        client.connect('user1', 'password1')
+        client.post_multipart(ITEMS)
+        self.assertTrue(client.is_connected())
+        client.close()
+        self.assertFalse(client.is_connected())
+
+    def test_reconnect_after_server_down(self):
+        client = self.client()
+        client.connect('user1', 'password1')
+        daa = client.shared_daa
+        address = self.server.server_address
+        self.server.stop()
+        self.assertRaises(OSError, client.post_multipart, ITEMS)
+        self.assertFalse(client.is_connected())
+
+        self.server = StandinServer(address[0], address[1],
+                users={'user1': 'password1'}).start()
+        seen = []
+        check = client.check_authenticated_status
+        def spy(status, user):
+            # other threads keep using the shared DAA meanwhile
+            seen.append(client.shared_daa)
+            return check(status, user)
+        client.check_authenticated_status = spy
+        # new connection authenticates without connect()
+        client.post_multipart(ITEMS)
+        self.assertEqual(seen, [daa])
+        self.assertTrue(client.is_connected())
+        self.assertIsNotNone(client.shared_daa)
+        self.assertEqual(self.server.submissions, 1)
+        client.close()
+
+    def test_close_stops_hedging_threads(self):
+        client = self.client(timeouts=Timeouts(hedge=5))
+        client.connect('user1', 'password1')
+        client.post_multipart(ITEMS)
+        hedging = client.hedging
+        self.assertIsNotNone(hedging)
+        client.close()
+        self.assertIsNone(client.hedging)
+        self.assertRaises(RuntimeError, hedging.submit, print)
+        # hedging threads are started again when needed
+        client.connect('user1', 'password1')
+        client.post_multipart(ITEMS)
+        self.assertEqual(self.server.submissions, 2)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
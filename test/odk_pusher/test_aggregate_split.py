@@ -0,0 +1,139 @@
+'''tests of AggregateClient.split_items (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys, asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import (AggregateClient, PooledAggregateClient,
+        AsyncAggregateClient, AggregateStatusException, MultipartBody)
+from bench import StandinServer
+
+
+XML = ('xml_submission_file', 'submission.xml', '<data/>', 'text/xml')
+
+def attachment(i, size=1000):
+    return ('a%d.jpg' % i, 'a%d.jpg' % i, b'x' * size, 'image/jpeg')
+
+
+class TestSplitItems(unittest.TestCase):
+
+    def client(self, **kwargs):
+        return AggregateClient('localhost', 80, '/ODKAggregate',
+                scheme='http', **kwargs)
+
+    def check_parts(self, parts, items, budget):
+        # every part starts with the XML, all but the last are incomplete
+        for part in parts:
+            self.assertEqual(part[0], XML)
+        for part in parts[:-1]:
+            self.assertEqual(part[-1], AggregateClient.INCOMPLETE_ITEM)
+        self.assertNotIn(AggregateClient.INCOMPLETE_ITEM, parts[-1])
+        attachments = [[item for item in part
+                if item not in (XML, AggregateClient.INCOMPLETE_ITEM)]
+                for part in parts]
+        # attachments are sent once, in order
+        self.assertEqual(sum(attachments, []), items[1:])
+        # only single attachments may exceed the budget
+        for part, part_attachments in zip(parts, attachments):
+            if len(part_attachments) > 1:
+                self.assertLessEqual(len(MultipartBody(part)), budget)
+
+    def test_no_budget(self):
+        items = [XML] + [attachment(i) for i in range(5)]
+        self.assertEqual(self.client().split_items(items), [items])
+
+    def test_fits(self):
+        items = [XML, attachment(0)]
+        client = self.client(max_size=len(MultipartBody(items)))
+        self.assertEqual(client.split_items(items), [items])
+
+    def test_split(self):
+        items = [XML] + [attachment(i) for i in range(5)]
+        client = self.client(max_size=3000)
+        parts = client.split_items(items)
+        self.assertEqual([len(part) for part in parts], [4, 4, 2])
+        self.check_parts(parts, items, 3000)
+
+    def test_large_attachment(self):
+        items = [XML, attachment(0), attachment(1, 5000), attachment(2)]
+        parts = self.client(max_size=3000).split_items(items)
+        # too large on its own : sent in a part by itself
+        self.assertEqual([part[1:-1] for part in parts[:-1]],
+                [[attachment(0)], [attachment(1, 5000)]])
+        self.assertEqual(parts[-1], [XML, attachment(2)])
+        self.check_parts(parts, items, 3000)
+
+    def test_size_budget(self):
+        client = self.client(max_size=3000)
+        client.set_accept_content_length('2000')
+        self.assertEqual(client.size_budget, 2000)
+        client.set_accept_content_length('10000')
+        self.assertEqual(client.size_budget, 3000)
+        client.set_accept_content_length('invalid')
+        self.assertEqual(client.size_budget, 3000)
+        items = [XML] + [attachment(i) for i in range(4)]
+        client.set_accept_content_length('2000')
+        self.check_parts(client.split_items(items), items, 2000)
+
+    def test_post_parts(self):
+        # server announces its limit and rejects larger requests (413)
+        server = StandinServer(max_content_length=2500).start()
+        try:
+            client = PooledAggregateClient(server.server_address[0],
+                    server.server_address[1], server.uri, scheme='http')
+            client.connect()
+            self.assertEqual(client.size_budget, 2500)
+            items = [XML] + [attachment(i, 600) for i in range(6)]
+            parts = client.split_items(items)
+            self.check_parts(parts, items, 2500)
+            client.post_multipart(items)
+            client.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.submissions, len(parts))
+        self.assertGreater(len(parts), 1)
+
+    def test_rejected_part_not_retried(self):
+        # status 413 for the large attachment : not retried
+        server = StandinServer(max_content_length=2500).start()
+        items = [XML, attachment(0), attachment(1, 5000)]
+        try:
+            client = AggregateClient(server.server_address[0],
+                    server.server_address[1], server.uri, scheme='http')
+            client.connect()
+            posted = []
+            post_part = client.post_part
+            def spy(items, deadline=None):
+                posted.append(items)
+                return post_part(items, deadline)
+            client.post_part = spy
+            with self.assertRaises(AggregateStatusException) as cm:
+                client.post_multipart(items)
+            self.assertEqual(cm.exception.status, 413)
+            self.assertEqual(len(posted), 2)
+            client.close()
+
+            client = AsyncAggregateClient(server.server_address[0],
+                    server.server_address[1], server.uri, scheme='http')
+            bodies = []
+            post_body = client.post_body
+            def spy_async(body, timing=None, deadline=None):
+                bodies.append(body)
+                return post_body(body, timing, deadline)
+            client.post_body = spy_async
+            async def run():
+                await client.connect()
+                try:
+                    await client.post_multipart(items)
+                finally:
+                    await client.close()
+            self.assertRaises(AggregateStatusException, asyncio.run, run())
+            self.assertEqual(len(bodies), 2)
+        finally:
+            server.stop()
+        self.assertEqual(server.submissions, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+'''tests of XPath binds of XFormTemplate (tools/odk_pusher/aggregate.py)'''
+
+import unittest, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from aggregate import XFormTemplate, XFormException, compile_xpath
+
+
+XFORM = '''<?xml version="1.0"?>
+<h:html xmlns="http://www.w3.org/2002/xforms" xmlns:h="http://www.w3.org/1999/xhtml" xmlns:jr="http://openrosa.org/javarosa">
+  <h:head>
+    <h:title>xform test</h:title>
+    <model>
+      <instance>
+        <data id="xform_test">
+          <age/>
+          <consent/>
+          <visit>
+            <date/>
+            <kind>first</kind>
+          </visit>
+          <meta><instanceID/></meta>
+        </data>
+      </instance>
+      <bind nodeset="/data/age" type="int" required="true()" constraint=". &gt;= 0 and . &lt; 130" jr:constraintMsg="age out of range"/>
+      <bind nodeset="/data/consent" type="select1"/>
+      <bind nodeset="/data/visit" relevant="/data/consent = 'yes'"/>
+      <bind nodeset="/data/visit/date" type="date" required="true()" constraint=". &lt;= today()"/>
+      <bind nodeset="/data/visit/kind" type="select1"/>
+      <bind calculate="concat('uuid:', uuid())" nodeset="/data/meta/instanceID" readonly="true()" type="string"/>
+    </model>
+  </h:head>
+  <h:body>
+    <select1 ref="/data/consent">
+      <item><label>yes</label><value>yes</value></item>
+      <item><label>no</label><value>no</value></item>
+    </select1>
+    <select1 ref="/data/visit/kind">
+      <item><label>first</label><value>first</value></item>
+      <item><label>follow up</label><value>followup</value></item>
+    </select1>
+  </h:body>
+</h:html>
+'''
+
+
+class TestXPath(unittest.TestCase):
+
+    index = {'a': 0, 'b': 1, 'a-b': 2, 'g/c': 3}
+
+    def evaluate(self, expression, values, path='a'):
+        f = compile_xpath(expression, path, 'data', self.index)
+        return f(lambda path: values.get(path, ''))
+
+    def test_arithmetic(self):
+        values = dict(a='7', b='2')
+        self.assertEqual(self.evaluate('. + /data/b * 3', values), 13.)
+        self.assertEqual(self.evaluate('/data/a - ../b', values), 5.)
+        self.assertEqual(self.evaluate('. div ../b', values), 3.5)
+        self.assertEqual(self.evaluate('. mod ../b', values), 1.)
+        self.assertEqual(self.evaluate('-.', values), -7.)
+        self.assertEqual(self.evaluate('7-2', values), 5.)
+
+    def test_relative_paths(self):
+        values = {'a': 'x', 'g/c': 'y'}
+        self.assertEqual(self.evaluate('../../a', values, path='g/c'), 'x')
+        self.assertEqual(self.evaluate('.', values, path='g/c'), 'y')
+        self.assertEqual(self.evaluate('concat(../g/c, .)', values), 'yx')
+
+    def test_functions(self):
+        values = dict(a='one two')
+        self.assertIs(self.evaluate('selected(., "two")', values), True)
+        self.assertEqual(self.evaluate('count-selected(.)', values), 2.)
+        self.assertEqual(self.evaluate('string-length(.)', values), 7.)
+        self.assertEqual(self.evaluate("if(. = 'x', 1, 2)", values), 2.)
+
+    def test_hyphen_in_name(self):
+        # like XPath, "a-b" is a name and not "a" minus "b"
+        values = {'a': '7', 'b': '2', 'a-b': 'name'}
+        self.assertEqual(self.evaluate('/data/a-b', values), 'name')
+        self.assertEqual(self.evaluate('/data/a - /data/b', values), 5.)
+        self.assertEqual(self.evaluate('/data/a -/data/b', values), 5.)
+
+    def test_hyphen_before_number(self):
+        with self.assertRaises(XFormException) as cm:
+            self.evaluate('/data/a-1 > 0', {})
+        self.assertIn('whitespace', str(cm.exception))
+        self.assertEqual(self.evaluate('/data/a - 1', dict(a='3')), 2.)
+
+    def test_errors(self):
+        for expression in ('/data/unknown > 1', 'foo(.)', '/other/a', '. >',
+                '. ! 1'):
+            with self.assertRaises(XFormException):
+                self.evaluate(expression, {})
+
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.template = XFormTemplate(XFORM)
+
+    def instance(self, **values):
+        xform = self.template.new()
+        for name, value in values.items():
+            xform[name.replace('__', '/')] = value
+        return xform
+
+    def test_binds(self):
+        binds = self.template.binds
+        self.assertTrue(binds['age'].leaf)
+        self.assertEqual(binds['age'].type, 'int')
+        # instance element with default text
+        self.assertFalse(binds['visit/kind'].leaf)
+        self.assertEqual(binds['visit/kind'].choices, {'first', 'followup'})
+        self.assertEqual([path for path, f in binds['visit/date'].relevants],
+                ['visit'])
+
+    def test_valid(self):
+        self.assertEqual(self.instance(age=30, consent='no').validate(), [])
+        self.assertEqual(self.instance(age=30, consent='yes',
+                visit__date='2020-01-02').validate(), [])
+
+    def test_required_and_type(self):
+        self.assertEqual(self.instance(consent='no').validate(),
+                ['"age" is required'])
+        self.assertEqual(self.instance(age='x', consent='no').validate(),
+                ['"age" : "x" is not a valid int'])
+
+    def test_constraint(self):
+        self.assertEqual(self.instance(age=150, consent='no').validate(),
+                ['"age" : age out of range'])
+
+    def test_choices(self):
+        self.assertEqual(self.instance(age=1, consent='maybe').validate(),
+                ['"consent" : "maybe" is not a valid choice'])
+
+    def test_relevant(self):
+        # visit is not relevant : its required date is not checked
+        self.assertEqual(self.instance(age=1, consent='no',
+                visit__date='x').validate(), [])
+        self.assertEqual(self.instance(age=1, consent='yes').validate(),
+                ['"visit/date" is required'])
+        self.assertEqual(self.instance(age=1, consent='yes',
+                visit__date='2999-01-01').validate(),
+                ['"visit/date" : does not satisfy constraint ". <= today()"'])
+
+    def test_default_text(self):
+        # values set for elements with default text are checked as well
+        xform = self.instance(age=1, consent='yes', visit__date='2020-01-02')
+        self.assertEqual(xform.validate(), [])
+        xform['visit/kind'] = 'other'
+        self.assertEqual(xform.validate(),
+                ['"visit/kind" : "other" is not a valid choice'])
+        xform['visit/kind'] = 'followup'
+        self.assertEqual(xform.validate(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
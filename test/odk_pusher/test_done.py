@@ -0,0 +1,111 @@
+'''tests of tools/odk_pusher/done.py'''
+
+import unittest, os, sys, tempfile, shutil, hashlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+import done
+
+
+class TestDoneStores(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.text_path = os.path.join(self.tmp, '_done.txt')
+        self.sqlite_path = os.path.join(self.tmp, '_done.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_text(self, *fnames):
+        with open(self.text_path, 'w') as fd:
+            fd.write(''.join(fname + '\n' for fname in fnames))
+
+    def test_migrate(self):
+        self.write_text('P1.jpg', '', 'sub/P2.jpg', 'P1.jpg')
+        store = done.SqliteDoneStore(self.tmp)
+        self.assertIn('P1.jpg', store)
+        self.assertIn('sub/P2.jpg', store)
+        self.assertNotIn('', store)
+        self.assertNotIn('P3.jpg', store)
+        self.assertEqual(store.db.execute(
+                'SELECT COUNT(*) FROM done').fetchone()[0], 2)
+        store.close()
+        self.assertFalse(os.path.exists(self.text_path))
+        self.assertTrue(os.path.exists(self.text_path + '.migrated'))
+        self.assertFalse(os.path.exists(self.sqlite_path + '.tmp'))
+
+    def test_migrate_once(self):
+        self.write_text('P1.jpg')
+        done.SqliteDoneStore(self.tmp).close()
+        # crashed before _done.txt was renamed : not imported again
+        self.write_text('P1.jpg', 'P2.jpg')
+        store = done.SqliteDoneStore(self.tmp)
+        self.assertIn('P1.jpg', store)
+        self.assertNotIn('P2.jpg', store)
+        self.assertFalse(os.path.exists(self.text_path))
+        store.close()
+
+    def test_crashed_migration(self):
+        # leftover of an import that did not complete
+        with open(self.sqlite_path + '.tmp', 'wb') as fd:
+            fd.write(b'garbage')
+        self.write_text('P1.jpg')
+        store = done.SqliteDoneStore(self.tmp)
+        self.assertIn('P1.jpg', store)
+        store.close()
+        self.assertFalse(os.path.exists(self.sqlite_path + '.tmp'))
+
+    def test_sqlite_batches(self):
+        store = done.SqliteDoneStore(self.tmp, batch=3)
+        store.add('P1.jpg', 'a' * 64)
+        store.add('P2.jpg')
+        # uncommitted entries are not visible to other connections
+        other = done.SqliteDoneStore(self.tmp)
+        self.assertNotIn('P1.jpg', other)
+        store.add('P3.jpg')
+        self.assertIn('P3.jpg', other)
+        store.add('P4.jpg')
+        store.flush()
+        self.assertIn('P4.jpg', other)
+        self.assertEqual(other.find('a' * 64), 'P1.jpg')
+        self.assertIsNone(other.find('b' * 64))
+        store.close()
+        other.close()
+
+    def test_commit_every_mark(self):
+        # by default, a crash right after add() loses nothing
+        store = done.SqliteDoneStore(self.tmp)
+        other = done.SqliteDoneStore(self.tmp)
+        store.add('P1.jpg')
+        self.assertIn('P1.jpg', other)
+        other.close()
+        text = done.TextDoneStore(self.tmp)
+        text.add('P2.jpg')
+        with open(self.text_path) as fd:
+            self.assertEqual(fd.read(), 'P2.jpg\n')
+        text.close()
+        store.close()
+
+    def test_text(self):
+        self.write_text('P1.jpg')
+        store = done.TextDoneStore(self.tmp, batch=10)
+        self.assertIn('P1.jpg', store)
+        store.add('P2.jpg', 'a' * 64)
+        self.assertIsNone(store.find('a' * 64))
+        store.close()
+        store = done.TextDoneStore(self.tmp)
+        self.assertIn('P2.jpg', store)
+        store.close()
+
+    def test_digest(self):
+        path = os.path.join(self.tmp, 'image.jpg')
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+        self.assertEqual(done.digest(path), hashlib.sha256(data).hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
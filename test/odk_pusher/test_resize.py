@@ -0,0 +1,44 @@
+'''tests of tools/odk_pusher/resize.py'''
+
+import unittest, os, sys, tempfile, shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+import resize
+
+
+@unittest.skipIf(resize.Image is None, 'Pillow not installed')
+class TestResize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src.png')
+        self.dst = os.path.join(self.tmp, 'dst.jpg')
+        resize.Image.new('I;16', (400, 100), 1000).save(self.src)
+        self.max_pixels = resize.Image.MAX_IMAGE_PIXELS
+
+    def tearDown(self):
+        resize.Image.MAX_IMAGE_PIXELS = self.max_pixels
+        shutil.rmtree(self.tmp)
+
+    def test_pool(self):
+        with resize.ResizePool(200, quality=90, processes=1) as pool:
+            self.assertEqual(pool.resize(self.src, self.dst), 'pillow')
+            self.assertIsNotNone(pool.executor)
+        self.assertIsNone(pool.executor)
+        with resize.Image.open(self.dst) as image:
+            self.assertEqual((image.format, image.mode, image.size),
+                    ('JPEG', 'L', (200, 50)))
+
+    def test_decompression_bomb(self):
+        # warning above MAX_IMAGE_PIXELS, error above twice as many
+        for max_pixels in (30000, 10000):
+            resize.Image.MAX_IMAGE_PIXELS = max_pixels
+            self.assertIsNone(resize.open_image(self.src))
+            self.assertRaises(resize.ResizeException, resize.resize,
+                    self.src, self.dst, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
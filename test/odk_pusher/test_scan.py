@@ -0,0 +1,122 @@
+'''tests of tools/odk_pusher/scan.py'''
+
+import unittest, os, sys, tempfile, shutil, time, json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+import scan
+
+
+class TestTreeScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'root')
+        self.snapshot = os.path.join(self.tmp, 'snapshot.json')
+        for rel in ('a.jpg', 'sub/b.jpg', 'sub/deeper/c.jpg', '_skipped/d.jpg',
+                '_e.jpg'):
+            self.write(rel)
+        self.age()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, rel, data=b'x'):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+    def age(self, seconds=60, rels=None):
+        """Moves modification time of directories (default : all) into
+        the past"""
+        t = time.time() - seconds
+        if rels is None:
+            rels = [os.path.relpath(path, self.root)
+                    for path, dirs, files in os.walk(self.root)]
+        for rel in rels:
+            os.utime(os.path.join(self.root, rel), (t, t))
+
+    def scanner(self):
+        return scan.TreeScanner(self.root, self.snapshot, workers=2,
+                skip=lambda name: name.startswith('_'))
+
+    def listed(self, scanner):
+        """Returns relative paths of directories listed by a scan"""
+        listed = []
+        scan_dir = scanner.scan_dir
+        def spy(rel, started):
+            result = scan_dir(rel, started)
+            if result is not None and result[2]:
+                listed.append(rel)
+            return result
+        scanner.scan_dir = spy
+        files = scanner.scan()
+        return files, sorted(listed)
+
+    def test_scan(self):
+        files, listed = self.listed(self.scanner())
+        self.assertEqual(sorted(files), ['a.jpg', os.path.join('sub', 'b.jpg'),
+                os.path.join('sub', 'deeper', 'c.jpg')])
+        self.assertEqual(files['a.jpg'][0], 1)
+        self.assertEqual(listed, ['', 'sub', os.path.join('sub', 'deeper')])
+        with open(self.snapshot) as fd:
+            self.assertEqual(json.load(fd)['version'], 1)
+
+    def test_snapshot(self):
+        self.scanner().scan()
+        # unchanged directories are not listed again (also after restart)
+        files, listed = self.listed(self.scanner())
+        self.assertEqual(len(files), 3)
+        self.assertEqual(listed, [])
+
+        self.write('sub/new.jpg')
+        os.remove(os.path.join(self.root, 'sub', 'deeper', 'c.jpg'))
+        self.age(rels=['sub', os.path.join('sub', 'deeper')])
+        files, listed = self.listed(self.scanner())
+        self.assertEqual(sorted(files), ['a.jpg', os.path.join('sub', 'b.jpg'),
+                os.path.join('sub', 'new.jpg')])
+        self.assertEqual(listed, ['sub', os.path.join('sub', 'deeper')])
+
+    def test_removed_directory(self):
+        self.scanner().scan()
+        shutil.rmtree(os.path.join(self.root, 'sub', 'deeper'))
+        self.age(rels=['sub'])
+        files, listed = self.listed(self.scanner())
+        self.assertEqual(sorted(files), ['a.jpg', os.path.join('sub', 'b.jpg')])
+        self.assertEqual(listed, ['sub'])
+
+    def test_racy(self):
+        # modified just before the scan : listed again by the next scan
+        # even if the mtime did not change (coarse timestamps)
+        self.age(0)
+        st = os.stat(self.root)
+        scanner = self.scanner()
+        scanner.scan()
+        self.write('new.jpg')
+        os.utime(self.root, ns=(st.st_atime_ns, st.st_mtime_ns))
+        files, listed = self.listed(scanner)
+        self.assertIn('new.jpg', files)
+        self.assertIn('', listed)
+
+    def test_not_racy(self):
+        self.scanner().scan()
+        # same mtime : not listed again (the file is missed)
+        st = os.stat(self.root)
+        self.write('new.jpg')
+        os.utime(self.root, ns=(st.st_atime_ns, st.st_mtime_ns))
+        files, listed = self.listed(self.scanner())
+        self.assertNotIn('new.jpg', files)
+        self.assertEqual(listed, [])
+
+    def test_invalid_snapshot(self):
+        with open(self.snapshot, 'w') as fd:
+            fd.write('{')
+        files, listed = self.listed(self.scanner())
+        self.assertEqual(len(files), 3)
+        self.assertEqual(len(listed), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+'''tests of tools/odk_pusher/watch.py'''
+
+import unittest, os, sys, tempfile, shutil, time, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+import watch
+
+
+@unittest.skipUnless(watch.available(), 'inotify not available')
+class TestDirectoryWatcher(unittest.TestCase):
+
+    debounce = 0.3
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # (time.monotonic(), fname) of every callback
+        self.reported = []
+        self.event = threading.Event()
+        self.watcher = watch.DirectoryWatcher(self.tmp, self.callback,
+                debounce=self.debounce).start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.tmp)
+
+    def callback(self, fname):
+        self.reported.append((time.monotonic(), fname))
+        self.event.set()
+
+    def wait(self, timeout=5):
+        self.assertTrue(self.event.wait(timeout))
+        self.event.clear()
+
+    def write(self, fname, data, mode='wb'):
+        with open(os.path.join(self.tmp, fname), mode) as fd:
+            fd.write(data)
+
+    def test_new_file(self):
+        t0 = time.monotonic()
+        self.write('a.jpg', b'x')
+        self.wait()
+        t, fname = self.reported[0]
+        self.assertEqual(fname, 'a.jpg')
+        self.assertGreaterEqual(t - t0, self.debounce)
+
+    def test_debounce(self):
+        # file is written over a longer time than debounce : one report
+        # after the last write
+        t0 = time.monotonic()
+        for i in range(5):
+            self.write('slow.jpg', b'x' * 100, 'ab')
+            time.sleep(self.debounce / 2)
+        t1 = time.monotonic()
+        self.wait()
+        time.sleep(2 * self.debounce)
+        self.assertEqual([fname for t, fname in self.reported], ['slow.jpg'])
+        self.assertGreaterEqual(self.reported[0][0] - t1,
+                self.debounce / 2 - 0.05)
+        self.assertGreater(self.reported[0][0] - t0, 2 * self.debounce)
+
+    def test_changed_without_events(self):
+        # files growing without inotify events (e.g. on network shares)
+        # are not reported either
+        reported = []
+        watcher = watch.DirectoryWatcher(self.tmp, reported.append,
+                debounce=10)
+        try:
+            self.write('a.jpg', b'x')
+            watcher.pending['a.jpg'] = (time.monotonic() - 1,
+                    watcher.signature('a.jpg'))
+            self.write('a.jpg', b'x', 'ab')
+            self.assertGreater(watcher.report_settled(), 9)
+            self.assertEqual(reported, [])
+            # unchanged when due
+            due, signature = watcher.pending['a.jpg']
+            watcher.pending['a.jpg'] = (time.monotonic() - 1, signature)
+            self.assertIsNone(watcher.report_settled())
+            self.assertEqual(reported, ['a.jpg'])
+        finally:
+            for fd in (watcher.fd, watcher.wakeup_r, watcher.wakeup_w):
+                os.close(fd)
+
+    def test_moved_and_deleted(self):
+        self.write('a.tmp', b'x')
+        self.wait()
+        os.rename(os.path.join(self.tmp, 'a.tmp'),
+                os.path.join(self.tmp, 'a.jpg'))
+        # both names are reported (possibly with a single wake up)
+        t0 = time.monotonic()
+        while len(self.reported) < 3 and time.monotonic() - t0 < 5:
+            time.sleep(0.01)
+        self.event.clear()
+        self.assertEqual(sorted(fname for t, fname in self.reported[1:]),
+                ['a.jpg', 'a.tmp'])
+        os.remove(os.path.join(self.tmp, 'a.jpg'))
+        self.wait()
+        self.assertEqual(self.reported[-1][1], 'a.jpg')
+
+    def test_subdirectories_ignored(self):
+        os.mkdir(os.path.join(self.tmp, 'sub'))
+        self.write('a.jpg', b'x')
+        self.wait()
+        time.sleep(self.debounce)
+        self.assertEqual([fname for t, fname in self.reported], ['a.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
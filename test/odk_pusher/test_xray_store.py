@@ -0,0 +1,92 @@
+'''tests of XrayStore (tools/odk_pusher/xray_uploader.py)'''
+
+import unittest, os, sys, tempfile, shutil, re
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+        '..', '..', 'tools', 'odk_pusher'))
+
+from xray_uploader import XrayStore
+from log import lo
+
+
+class TestXrayStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, rel):
+        return os.path.join(self.tmp, rel)
+
+    def write(self, rel, data=b'x'):
+        path = self.path(rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+    def store(self, **kwargs):
+        return XrayStore(self.tmp, re.compile(r'^P\d+$'), **kwargs)
+
+    def test_rescan(self):
+        self.write('P1.jpg')
+        self.write('P2.jpg')
+        self.write('notes.txt')
+        self.write('X1.jpg')
+        store = self.store()
+        self.assertEqual(store.todo, {'P1.jpg', 'P2.jpg'})
+        # same number of images, but a different one
+        os.remove(os.path.join(self.tmp, 'P2.jpg'))
+        self.write('P3.jpg')
+        store.update()
+        self.assertEqual(store.todo, {'P1.jpg', 'P3.jpg'})
+
+    def test_mark_done(self):
+        self.write('P1.jpg')
+        self.write('P2.jpg')
+        store = self.store()
+        store.mark_done('P1.jpg')
+        store.flush()
+        self.assertEqual(store.todo, {'P2.jpg'})
+        store.update()
+        self.assertEqual(store.todo, {'P2.jpg'})
+        store.done.close()
+        self.assertEqual(self.store().todo, {'P2.jpg'})
+
+    def test_detect_duplicates(self):
+        for fname in ('P1.jpg', 'P2.jpg', 'P3.jpg'):
+            self.write(fname, b'same')
+        store = self.store(detect_duplicates=True)
+        store.mark_done('P1.jpg')
+        with self.assertLogs(lo, 'WARNING') as cm:
+            store.mark_done('P2.jpg')
+        self.assertIn('same contents as "P1.jpg"', cm.output[0])
+        store.close()
+        self.assertIsNone(store.done)
+        # contents are only read when asked for
+        store = self.store()
+        with self.assertNoLogs(lo, 'WARNING'):
+            store.mark_done('P3.jpg')
+        self.assertEqual(store.done.db.execute('SELECT digest FROM done '
+                'WHERE fname = ?', ('P3.jpg', )).fetchone(), (None, ))
+        store.close()
+
+    def test_recursive_intermediary(self):
+        self.write(os.path.join('a', 'P1.jpg'))
+        self.write(os.path.join('b', 'P1.jpg'))
+        store = self.store(recursive=True)
+        self.assertEqual(store.todo, {os.path.join('a', 'P1.jpg'),
+                os.path.join('b', 'P1.jpg')})
+        # converted images do not overwrite each other
+        paths = set(store.intermediary_path(fname) for fname in store.todo)
+        self.assertEqual(len(paths), 2)
+        for path in paths:
+            self.assertTrue(os.path.isdir(os.path.dirname(path)))
+        # intermediary directory is not scanned
+        store.update()
+        self.assertEqual(len(store.todo), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
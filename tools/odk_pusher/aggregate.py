@@ -21,6 +21,16 @@ Synopsis
 >>> client.connect(user='user1', password='password1')
 >>> client.post_multipart(form.get_items())
 
+Many forms can be posted concurrently with an AsyncAggregateClient, where
+``submissions`` is an iterable of ``(key, items)``:
+
+>>> from aggregate import AsyncAggregateClient, post_many
+>>> client = AsyncAggregateClient('aggregate.example.org', port=443,
+...                               uri='/ODKAggregate', scheme='https',
+...                               concurrency=8)
+>>> results = post_many(client, submissions, 'user1', 'password1')
+>>> [result.key for result in results if not result.ok]
+
 
 Changelog
 ---------
@@ -31,17 +41,313 @@ Changelog
     - added client.is_connected()
   - version 1.0.3
     - added AggregateFormNotFoundException
+  - version 1.1.0
+    - added AsyncAggregateClient for posting many forms concurrently
+    - added --concurrency to command line interface
+  - version 1.2.0
+    - added thread-safe PooledAggregateClient
+  - version 1.3.0
+    - attachments are streamed from disk (MultipartBody); XForm.get_items()
+      returns AttachmentFile instead of the file content
+  - version 1.4.0
+    - added AggregateClient(zerocopy=True) to send attachments with
+      sendfile() or from memory mapped files
+  - version 1.5.0
+    - added XFormTemplate that parses a XForm once and creates lightweight
+      XFormInstance objects
+  - version 1.6.0
+    - XML of filled in forms is generated without DOM (write_xml())
+  - version 1.6.1
+    - added XFormTemplate.find_path() using hashed path indexes
+  - version 1.7.0
+    - added BulkPoster and Journal for resumable bulk posting
+    - command line interface --csv does not stop on errors; added
+      --journal, --errors, --key, and summary of throughput
+  - version 1.8.0
+    - preemptive digest authentication : nonce is reused on reconnect and
+      shared by pooled connections; requests are repeated once if the
+      server renews the nonce
+  - version 1.9.0
+    - is_connected() checks the socket instead of sending a HEAD request;
+      requests failing on a connection closed by the server are re-sent
+      on a new connection; TLS sessions are resumed
+  - version 1.10.0
+    - added TimingStats to record duration of request phases (DNS,
+      connect, TLS, encode, send, wait, receive) and payload sizes;
+      added --timings to command line interface
+  - version 1.11.0
+    - added AggregateClient.fetch_forms() and FormCache to download
+      XForms listed in the formList with conditional GET
+  - version 1.12.0
+    - added --jsonl to command line interface to post a stream of forms
+      from a file or stdin over one session (with progress line)
+  - version 1.13.0
+    - XFormTemplate compiles the binds of the XForm (type, required,
+      constraint, relevant) and validate() checks forms locally
+    - command line interface checks forms before posting (--no-validate)
+      and has a subcommand "validate" that does not contact the server
+  - version 1.14.0
+    - added EncodingPool to fill in and encode forms in worker processes;
+      post_multipart() accepts an encoded MultipartBody
+    - added --processes to command line interface
+  - version 1.15.0
+    - added Outbox and OutboxDrainer to spool encoded submissions on disk
+      and post them when the server can be reached
+  - version 1.16.0
+    - submissions larger than max_size (or X-OpenRosa-Accept-Content-Length)
+      are posted in several parts marked with *isIncomplete*; added
+      --max-size to command line interface
+  - version 1.17.0
+    - added Timeouts : per-phase timeouts (connect, send, wait), deadline
+      per submission, retries and hedged requests (PooledAggregateClient,
+      AsyncAggregateClient) with a delay derived from TimingStats; added
+      --timeout, --deadline, --retries and --hedge to command line interface
+  - version 1.18.0
+    - added BalancedAggregateClient and AsyncBalancedAggregateClient to
+      spread submissions across several front-ends, ejecting and probing
+      unhealthy ones; --server can be repeated, added --balance
+  - version 1.18.1
+    - AsyncAggregateClient re-sends requests that fail while writing on a
+      re-used connection; attachments are read off the event loop
+    - PooledAggregateClient.is_connected() is False after the server could
+      not be reached; close() stops the hedging threads
+    - XFormTemplate.validate() also checks values set for elements with
+      default text; XPath names follow NCName (use "a - 1" to subtract)
+    - OutboxDrainer only retries transient errors (see is_transient()) and
+      moves rejected submissions and submissions that failed
+      ``max_attempts`` times to ``failed/``
+    - BalancedAggregateClient only counts transient errors against an
+      endpoint (and raises other errors); Balancer.eject() is thread-safe
+    - added ClientOptions with the optional settings shared by the
+      uploaders
+  - version 1.18.2
+    - AsyncAggregateClient.is_connected() is True between connect() and
+      close(); fetch_forms() raises AggregateException (not supported)
+    - PooledAggregateClient authenticates new connections without
+      resetting the DAA shared with other threads; is_connected() is True
+      again after a request succeeded
+    - AggregateClient.is_connected() is False after a request failed
+      because the server could not be reached
+    - parts of split submissions and submissions with Timeouts.retries are
+      only retried after transient errors (see is_transient())
+    - OutboxDrainer retries transient errors forever by default
+      (max_attempts=None); added Outbox.requeue_failed()
 """
 
-VERSION = '1.0.3'
+VERSION = '1.18.2'
 
 from log import lo
 
-import http.client, urllib.request, urllib.parse, urllib.error, sys, time, uuid, hashlib, io, mimetypes, os.path, json, datetime, csv
+import http.client, urllib.request, urllib.parse, urllib.error, sys, time, uuid, hashlib, io, mimetypes, os.path, json, datetime, csv, ssl, mmap, re, select
+import asyncio, threading, contextlib, functools, socket, bisect, collections, math
+import concurrent.futures
 from xml.dom.minidom import parseString
 from xml.parsers.expat import ExpatError
 
 
+### request timing {{{1
+
+class RequestTiming:
+    """Duration of the phases of a single request and payload sizes
+
+    The phases are (in seconds, 0 if the phase did not occur) :
+
+      - ``dns`` -- name resolution (only for new connections)
+      - ``connect`` -- TCP connect (AsyncAggregateClient : including TLS)
+      - ``tls`` -- TLS handshake
+      - ``encode`` -- creating the multipart body
+      - ``send`` -- sending headers and body
+      - ``wait`` -- waiting for the status line of the response
+      - ``receive`` -- reading the rest of the response
+
+    Durations of repeated attempts (see AggregateClient.send()) are added.
+    """
+
+    PHASES = ('dns', 'connect', 'tls', 'encode', 'send', 'wait', 'receive')
+
+    def __init__(self, method, uri):
+        self.method = method
+        self.uri = uri
+        self.started = time.time()
+        self.phases = dict.fromkeys(self.PHASES, 0.)
+        self.attempts = 0
+        self.status = None
+        self.error = None
+        self.request_size = 0
+        self.response_size = 0
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        ret = dict(self.phases)
+        ret.update(method=self.method, uri=self.uri, started=self.started,
+                total=self.total, attempts=self.attempts, status=self.status,
+                error=self.error, request_size=self.request_size,
+                response_size=self.response_size)
+        return ret
+
+
+class Histogram:
+    """Histogram with logarithmic buckets
+
+    Bucket ``i`` counts values up to ``first * factor ** i``; the last
+    bucket counts all values above the last bound.  Percentiles are
+    estimated as the upper bound of the bucket they fall into.
+    """
+
+    def __init__(self, first, factor=2, buckets=24):
+        self.bounds = [first * factor ** i for i in range(buckets)]
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        if i == len(self.bounds):
+            return self.max
+        return min(self.bounds[i], self.max)
+
+    def as_dict(self):
+        return {
+                'count': self.count,
+                'total': self.total,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.count and self.total / self.count or None,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'buckets': [[bound, count] for bound, count in zip(
+                    self.bounds + [None], self.counts) if count],
+            }
+
+
+class TimingStats:
+    """Collects RequestTiming of one or more clients (thread-safe)
+
+    Pass an instance as ``timings`` to an AggregateClient (or any of its
+    subclasses) to record every request.  Durations are aggregated into
+    one Histogram per phase (plus ``total``; phases that did not occur
+    are not counted), sizes into the histograms ``request_size`` and
+    ``response_size``.  The total duration of successful submissions
+    (POST with status 201) is also kept in the histogram ``submission``
+    (e.g. for Timeouts.hedge_delay()).
+    """
+
+    def __init__(self, records=0, callback=None):
+        """
+        Arguments:
+            - records (optional) -- number of most recent RequestTiming
+              kept in ``.records`` (e.g. for dump())
+            - callback (optional) -- called with every RequestTiming (e.g.
+              for logging), from the thread that made the request
+        """
+        self.lock = threading.Lock()
+        self.callback = callback
+        self.records = collections.deque(maxlen=records)
+        self.histograms = collections.OrderedDict(
+                (phase, Histogram(1e-4))
+                for phase in RequestTiming.PHASES + ('total', ))
+        self.histograms['request_size'] = Histogram(64)
+        self.histograms['response_size'] = Histogram(64)
+        # finer buckets : percentiles are used as hedging delay
+        self.histograms['submission'] = Histogram(1e-3, 2 ** .25, 80)
+        self.errors = 0
+
+    def add(self, timing):
+        with self.lock:
+            for phase, seconds in timing.phases.items():
+                # phases that did not occur are not counted
+                if seconds:
+                    self.histograms[phase].add(seconds)
+            self.histograms['total'].add(timing.total)
+            self.histograms['request_size'].add(timing.request_size)
+            self.histograms['response_size'].add(timing.response_size)
+            if timing.method == 'POST' and timing.status == 201:
+                self.histograms['submission'].add(timing.total)
+            if timing.error is not None:
+                self.errors += 1
+            if self.records.maxlen:
+                self.records.append(timing)
+        if self.callback:
+            self.callback(timing)
+
+    def reset(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.records.clear()
+            self.errors = 0
+
+    def percentile(self, name, p, min_count=1):
+        """Returns percentile ``p`` of histogram ``name`` (None if it has
+        less than ``min_count`` values)"""
+        with self.lock:
+            histogram = self.histograms[name]
+            if histogram.count < max(1, min_count):
+                return None
+            return histogram.percentile(p)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                    'errors': self.errors,
+                    'histograms': {name: histogram.as_dict()
+                        for name, histogram in self.histograms.items()},
+                    'records': [timing.as_dict() for timing in self.records],
+                }
+
+    def summary(self):
+        """Returns list of lines (one per phase) for logging"""
+        ms = lambda value: value is None and '-' or '%.1f' % (1000 * value)
+        lines = []
+        with self.lock:
+            for phase in RequestTiming.PHASES + ('total', ):
+                h = self.histograms[phase]
+                if not h.count:
+                    continue
+                lines.append('%-8s n=%d mean=%sms p50=%sms p95=%sms '
+                        'p99=%sms max=%sms' % (phase, h.count,
+                            ms(h.total / h.count), ms(h.percentile(50)),
+                            ms(h.percentile(95)), ms(h.percentile(99)),
+                            ms(h.max)))
+            h = self.histograms['request_size']
+            if h.count:
+                lines.append('%d requests (%d errors) sent %.1f kb' % (
+                        h.count, self.errors, h.total / 1024))
+        return lines
+
+    def dump(self, filename):
+        """Writes histograms and records to JSON file"""
+        with io.open(filename, 'w') as fd:
+            json.dump(self.as_dict(), fd, indent=2)
+
+
 ### AggregateClient & DAA {{{1
 
 class AggregateException(Exception):
@@ -53,10 +359,129 @@ class AggregateFormNotFoundException(AggregateException):
 class AuthenticationException(AggregateException):
     """Risen by DAA"""
 
+class AggregateTimeoutException(AggregateException):
+    """Raised when a phase of a request or a whole submission took too
+    long (see Timeouts)"""
+
+class AggregateStatusException(AggregateException):
+    """Raised when server answers with an unexpected status (see
+    attribute ``status``)"""
+
+    def __init__(self, message, status):
+        AggregateException.__init__(self, message)
+        self.status = status
+
+# errors after which the same request can succeed when it is sent again
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException,
+        asyncio.IncompleteReadError, AggregateTimeoutException)
+
+def is_transient(e):
+    """Returns True if exception ``e`` is caused by the connection or the
+    server rather than by the request (connection errors, timeouts,
+    status 5xx, 408 and 429), i.e. if sending the request again makes
+    sense"""
+    if isinstance(e, AggregateStatusException):
+        return e.status >= 500 or e.status in (408, 429)
+    return isinstance(e, TRANSIENT_ERRORS)
+
+
+class Timeouts:
+    """Timeouts of requests, deadline of submissions and hedging
+
+    Pass an instance as ``timeouts`` to an AggregateClient (or any of its
+    subclasses).  All durations are in seconds, None means no limit :
+
+      - ``connect`` -- opening a connection (TCP connect and TLS
+        handshake; AsyncAggregateClient also limits name resolution)
+      - ``send`` -- a single write of the request to the socket (i.e. how
+        long the server may stop reading)
+      - ``wait`` -- waiting for the first byte of the response (and for
+        every further read of the response)
+      - ``deadline`` -- posting a whole submission, including all of its
+        parts, retries and hedged requests
+
+    A submission that failed because of the connection or the server (e.g.
+    timed out, see is_transient()) is posted up to ``retries`` more times
+    before the deadline.  With ``hedge``, a second copy of a
+    submission that got no response after ``hedge`` seconds is posted on
+    another connection and the first response wins.  If ``hedge`` is
+    'auto', the delay is the ``hedge_percentile`` of the duration of the
+    submissions recorded by the TimingStats of the client (at least
+    ``hedge_min_samples`` are needed before any request is hedged).
+    Retries and hedged requests send the same body and thus the same
+    ``meta/instanceID`` : the server accepts the submission only once.
+    """
+
+    PHASES = ('connect', 'send', 'wait')
+
+    def __init__(self, connect=None, send=None, wait=None, deadline=None,
+            retries=0, hedge=None, hedge_percentile=95, hedge_min_samples=20):
+        self.connect = connect
+        self.send = send
+        self.wait = wait
+        self.deadline = deadline
+        self.retries = retries
+        if hedge is not None and hedge != 'auto':
+            hedge = float(hedge)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+    def start(self):
+        """Returns deadline (``time.perf_counter()`` value) of a
+        submission starting now, None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return time.perf_counter() + self.deadline
+
+    def expired(self, deadline):
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def timeout(self, phase, deadline=None):
+        """Returns timeout of ``phase``, shortened to the time left until
+        ``deadline``; raises AggregateTimeoutException if it has passed"""
+        timeout = getattr(self, phase)
+        if deadline is not None:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise AggregateTimeoutException('deadline exceeded')
+            if timeout is None or left < timeout:
+                timeout = left
+        return timeout
+
+    def hedge_delay(self, timings=None):
+        """Returns seconds after which a request is hedged (None : no
+        hedging)"""
+        if self.hedge != 'auto':
+            return self.hedge
+        if timings is None or not hasattr(timings, 'percentile'):
+            return None
+        return timings.percentile('submission', self.hedge_percentile,
+                self.hedge_min_samples)
+
+@functools.lru_cache(maxsize=32)
+def digest_ha1(username, realm, password):
+    """HA1 of digest access authentication (cached per credential)"""
+    return hashlib.md5(':'.join([username, realm, password]).encode('utf8')).hexdigest()
+
+def parse_www_authenticate(www_authenticate):
+    """Parses "www-authenticate" header value into dictionary"""
+    if not www_authenticate or not www_authenticate.startswith('Digest '):
+        raise AuthenticationException('expected www-authenticate '
+                'header to start with "Digest "')
+    return {
+            key: quoted or value
+            for key, quoted, value in re.findall(
+                r'(\w+)=(?:"([^"]*)"|([^,\s]*))', www_authenticate[7:])
+        }
+
+
 class DAA:
     """Digest Access Authentication (RFC 2069)
     
     Implements the DAA for authentication with an ODK Aggregate server.
+    A DAA instance is thread-safe and can be shared by several connections
+    to send the Authorization header preemptively with every request.
     """
 
     def __init__(self, www_authenticate, username, password, cnonce=None):
@@ -70,15 +495,7 @@ class DAA:
             - cnonce (optional) -- client nonce
         """
 
-        if not www_authenticate.startswith('Digest '):
-            raise AuthenticationException('expected www-authenticate '
-                    'header to start with "Digest "')
-        www_authenticate = www_authenticate[7:]
-
-        self.www_auth = dict([
-                (_[:_.index('=')], _[_.index('=') + 2:-1])
-                for _ in www_authenticate.split(', ')
-            ])
+        self.www_auth = parse_www_authenticate(www_authenticate)
 
         self.username = username
         self.password = password
@@ -87,6 +504,24 @@ class DAA:
         if cnonce is None:
             cnonce = uuid.uuid4().hex
         self.cnonce = cnonce
+        self.lock = threading.Lock()
+
+    def update(self, www_authenticate):
+        """Use new challenge sent by server (e.g. after nonce expired)
+
+        Returns True if the challenge has a new nonce or is flagged as
+        ``stale`` (i.e. a request with the new nonce can succeed), False
+        if the old nonce was rejected again (i.e. wrong credentials).
+        """
+        www_auth = parse_www_authenticate(www_authenticate)
+        with self.lock:
+            renewed = (www_auth.get('stale', '').lower() == 'true' or
+                    www_auth.get('nonce') != self.www_auth.get('nonce'))
+            self.www_auth = www_auth
+            self.nc = 1
+        lo.debug('DAA : new challenge nonce=%s renewed=%s' % (
+                www_auth.get('nonce'), renewed))
+        return renewed
 
     def get_authentication(self, method, uri):
         """Create new authentication token
@@ -99,14 +534,15 @@ class DAA:
             HTTP header
         """
 
-        realm = self.www_auth['realm']
-        snonce = self.www_auth['nonce']
-        qop = self.www_auth['qop']
+        with self.lock:
+            realm = self.www_auth['realm']
+            snonce = self.www_auth['nonce']
+            qop = self.www_auth['qop']
 
-        nc = '%08d' % self.nc
-        self.nc += 1
+            nc = '%08d' % self.nc
+            self.nc += 1
 
-        HA1 = hashlib.md5(':'.join([self.username, realm, self.password]).encode('utf8')).hexdigest()
+        HA1 = digest_ha1(self.username, realm, self.password)
         HA2 = hashlib.md5(':'.join([method, uri]).encode('utf8')).hexdigest()
         HAx = hashlib.md5(':'.join([HA1, snonce, nc, self.cnonce, qop, HA2]).encode('utf8')).hexdigest()
 
@@ -137,6 +573,239 @@ class DAA:
         return 'Digest ' + auth
 
 
+class AttachmentFile:
+    """File on disk that is sent as value of a multipart item
+
+    The file content is not read into memory but streamed from disk
+    by MultipartBody while it is sent.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def read(self):
+        with io.open(self.path, 'rb') as fd:
+            return fd.read()
+
+    def __repr__(self):
+        return 'AttachmentFile(%r)' % self.path
+
+
+class MultipartBody:
+    """Streaming ``multipart/form-data`` request body
+
+    The body is split into segments that are either byte strings
+    (headers, XML) or AttachmentFile instances.  len() returns the total
+    length (to be sent as Content-Length) that is computed up front, and
+    iterating over the body yields chunks of at most ``chunk_size`` bytes,
+    reading attachments from disk only while they are sent.  The body can
+    be iterated several times (e.g. to resend it).
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, items, boundary=None):
+        """
+        Arguments:
+            - items -- a sequence of sequences
+              ``(name, filename, value, file_content_type)`` where value
+              is a str, bytes, or AttachmentFile (filename None for a
+              plain form field)
+            - boundary (optional) -- multipart boundary
+        """
+        if boundary is None:
+            boundary = '----------------AggregateClient' + uuid.uuid4().hex
+        self.boundary = boundary
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+
+        self.segments = []
+        for name, filename, value, file_content_type in items:
+            disposition = 'form-data; name="%s"' % name
+            if filename is not None:
+                disposition += '; filename="%s"' % filename
+            self.add_segment((
+                    '--%s\r\n' % boundary +
+                    'Content-Disposition: %s\r\n' % disposition +
+                    'Content-Type: %s\r\n' % file_content_type +
+                    'Content-Transfer-Encoding: binary\r\n' +
+                    '\r\n').encode('utf8'))
+            if isinstance(value, str):
+                value = value.encode('utf8')
+            self.add_segment(value or b'')
+            self.add_segment(b'\r\n')
+        self.add_segment(('--%s--\r\n' % boundary).encode('utf8'))
+
+        self.length = sum([
+                isinstance(segment, bytes) and len(segment) or segment.size
+                for segment in self.segments])
+
+    @classmethod
+    def from_file(cls, path, content_type):
+        """Returns body that was encoded before and stored in a file"""
+        body = cls.__new__(cls)
+        body.boundary = content_type[content_type.find('boundary=') + 9:]
+        body.content_type = content_type
+        body.segments = [AttachmentFile(path)]
+        body.length = body.segments[0].size
+        return body
+
+    def add_segment(self, segment):
+        # merge consecutive byte strings
+        if (isinstance(segment, bytes) and self.segments
+                and isinstance(self.segments[-1], bytes)):
+            self.segments[-1] += segment
+        else:
+            self.segments.append(segment)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                for i in range(0, len(segment), self.chunk_size):
+                    yield segment[i:i + self.chunk_size]
+                continue
+
+            size = segment.size
+            sent = 0
+            with io.open(segment.path, 'rb') as fd:
+                while True:
+                    chunk = fd.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    yield chunk
+            if sent != size:
+                raise AggregateException('file "%s" changed while sending' %
+                        segment.path)
+
+    def __aiter__(self):
+        return self.iter_async()
+
+    async def iter_async(self):
+        """Like iterating over the body, but attachments are read in the
+        default executor so that the event loop is not blocked"""
+        loop = asyncio.get_event_loop()
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                for i in range(0, len(segment), self.chunk_size):
+                    yield segment[i:i + self.chunk_size]
+                continue
+
+            size = segment.size
+            sent = 0
+            fd = await loop.run_in_executor(None, io.open, segment.path, 'rb')
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(
+                            None, fd.read, self.chunk_size)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    yield chunk
+            finally:
+                fd.close()
+            if sent != size:
+                raise AggregateException('file "%s" changed while sending' %
+                        segment.path)
+
+    def __bytes__(self):
+        return b''.join(self)
+
+
+def multipart_body(items):
+    """Returns MultipartBody of items (items that are already encoded
+    as MultipartBody, e.g. by EncodingPool, are returned unchanged)"""
+    if isinstance(items, MultipartBody):
+        return items
+    return MultipartBody(items)
+
+
+def socket_alive(sock):
+    """Checks whether an idle keep-alive socket is still usable
+
+    Does not send anything : an idle HTTP connection must not become
+    readable, so readability means the server closed the connection (or
+    sent something unexpected).
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class TimedHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection that measures name resolution and TCP connect
+
+    The durations of the last connect() are stored in ``.phases`` (see
+    RequestTiming) until they are collected by AggregateClient.exchange().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.phases = {}
+        # HTTPConnection.connect() calls this instance attribute
+        self._create_connection = self.create_connection
+
+    def create_connection(self, address, timeout, source_address=None):
+        t0 = time.perf_counter()
+        host, port = address
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        t1 = time.perf_counter()
+        error = None
+        for family, type_, proto, canonname, sockaddr in infos:
+            try:
+                sock = socket.create_connection(
+                        sockaddr[:2], timeout, source_address)
+                break
+            except OSError as e:
+                error = e
+        else:
+            raise error or OSError('getaddrinfo returned empty list')
+        self.phases = {'dns': t1 - t0, 'connect': time.perf_counter() - t1}
+        return sock
+
+
+class SessionHTTPSConnection(TimedHTTPConnection, http.client.HTTPSConnection):
+    """HTTPSConnection that resumes the TLS session of its client
+
+    The TLS session of the last response is stored by the AggregateClient
+    (attribute ``tls_session``) and used for new connections, saving the
+    full handshake when a connection is re-opened.
+    """
+
+    def __init__(self, host, port, context, client):
+        super().__init__(host, port, context=context)
+        self.client = client
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        session = self.client.tls_session
+        t0 = time.perf_counter()
+        try:
+            self.sock = self._context.wrap_socket(self.sock,
+                    server_hostname=self._tunnel_host or self.host,
+                    session=session)
+        except ssl.SSLError:
+            if session is None:
+                raise
+            # session from another context / expired : full handshake
+            self.client.tls_session = None
+            http.client.HTTPConnection.connect(self)
+            t0 = time.perf_counter()
+            self.sock = self._context.wrap_socket(self.sock,
+                    server_hostname=self._tunnel_host or self.host)
+        self.phases['tls'] = time.perf_counter() - t0
+        lo.debug('SSL : connected to %s (session reused=%s)' % (
+                self.host, self.sock.session_reused))
+
+
 class AggregateClient:
     """Aggregate client for posting forms
     
@@ -144,7 +813,13 @@ class AggregateClient:
     ODK Aggregate server
     """
 
-    def __init__(self, address, port, uri, scheme='https', deviceID=None):
+    # OpenRosa : parts of a submission that are posted separately
+    INCOMPLETE_ITEM = ('*isIncomplete*', None, 'yes', 'text/plain; charset=utf-8')
+    # number of attempts to post every part of a split submission
+    part_attempts = 3
+
+    def __init__(self, address, port, uri, scheme='https', deviceID=None,
+            zerocopy=False, timings=None, max_size=None, timeouts=None):
         """Initializes client (does not connect yet)
 
         Arguments:
@@ -153,8 +828,25 @@ class AggregateClient:
             - uri -- URI where ODKAggregate is rooted (e.g. '/ODKAggregate')
             - scheme (optional) -- must be 'http' (no SSL, default) or 'https' (SSL)
             - deviceID (optional) -- to identify client device
+            - zerocopy (optional) -- send attachments with sendfile()
+              (plain HTTP) or from memory mapped files (HTTPS) instead of
+              copying them through Python buffers
+            - timings (optional) -- TimingStats (or any object with a
+              method ``add()``) that receives a RequestTiming for every
+              request
+            - max_size (optional) -- maximum size of a request body in
+              bytes; larger submissions are split (see split_items()); the
+              limit announced by the server is used if it is smaller
+            - timeouts (optional) -- Timeouts of the requests and of every
+              submission (by default, requests can block forever)
         """
         self.scheme = scheme
+        self.zerocopy = zerocopy
+        self.timings = timings
+        self.max_size = max_size
+        self.timeouts = timeouts
+        # X-OpenRosa-Accept-Content-Length of server
+        self.accept_content_length = None
         self.address = address
         self.port = port
         if uri[0] != '/':
@@ -168,7 +860,16 @@ class AggregateClient:
         self.submission_url = '%s://%s:%d%s' % (
                 scheme, address, port, self.submission_uri)
 
+        self.ssl_context = None
+        self.tls_session = None
+        if scheme == 'https':
+            #TODO check against provided certificate
+            self.ssl_context = ssl.create_default_context()
+
         self.conn = None
+        self.daa = None
+        # last request failed because the server could not be reached
+        self.connection_failed = False
 
     def create_headers(self, additional_headers=None):
         if additional_headers:
@@ -187,30 +888,194 @@ class AggregateClient:
         return ret
 
     def encode_multipart(self, items):
-        boundary = '----------------AggregateClient' + uuid.uuid4().hex
-        content_type = 'multipart/form-data; boundary=' + boundary
-        body = []
-
-        for name, filename, value, file_content_type in items:
-            body += ['--' + boundary]
-            body += ['Content-Disposition: form-data; name="%s"; filename="%s"' % (name, filename)]
-            body += ['Content-Type: %s' % file_content_type]
-            body += ['Content-Transfer-Encoding: binary']
-            body += ['', value]
+        """Returns content type and complete body as bytes
 
-        body += ['--' + boundary + '--', '']
-
-        return content_type, b'\r\n'.join([
-                type(element) == str and element.encode('utf8') or element or b''
-                for element in body])
+        Use MultipartBody (as post_multipart() does) to avoid reading
+        attachments into memory.
+        """
+        body = MultipartBody(items)
+        return body.content_type, bytes(body)
 
     def request(self, method, uri, data, additional_headers=None):
         headers = self.create_headers(additional_headers)
         if self.daa:
             headers['Authorization'] = self.daa.get_authentication(
                 method, uri)
-        self.conn.request(method, uri, data, headers)
+        if self.zerocopy and isinstance(data, MultipartBody):
+            self.conn.putrequest(method, uri)
+            for name, value in headers.items():
+                self.conn.putheader(name, value)
+            self.conn.endheaders()
+            self.send_body_zerocopy(data)
+        else:
+            self.conn.request(method, uri, data, headers)
+
+    def send_body_zerocopy(self, body):
+        """Writes MultipartBody directly to the socket of .conn
 
+        The headers must already have been sent.  Attachments are
+        transmitted with socket.sendfile() on plain sockets (the kernel
+        copies the file content) and as memoryview of a memory mapped file
+        on SSL sockets (that need to encrypt the data in user space).
+        """
+        sock = self.conn.sock
+        for segment in body.segments:
+            if isinstance(segment, bytes):
+                sock.sendall(segment)
+                continue
+
+            with io.open(segment.path, 'rb') as fd:
+                size = os.fstat(fd.fileno()).st_size
+                if isinstance(sock, ssl.SSLSocket):
+                    sent = 0
+                    if size:
+                        with mmap.mmap(fd.fileno(), 0,
+                                access=mmap.ACCESS_READ) as mm:
+                            with memoryview(mm) as view:
+                                for i in range(0, size, body.chunk_size):
+                                    sock.sendall(view[i:i + body.chunk_size])
+                        sent = size
+                else:
+                    sent = sock.sendfile(fd)
+
+            if sent != segment.size:
+                raise AggregateException('file "%s" changed while sending' %
+                        segment.path)
+
+
+    def create_connection(self):
+        """Returns new (not yet connected) HTTP(S)Connection"""
+        if self.scheme == 'https':
+            return SessionHTTPSConnection(self.address, self.port,
+                    context=self.ssl_context, client=self)
+        else:
+            return TimedHTTPConnection(self.address, self.port)
+
+    def set_timeout(self, phase, deadline=None):
+        """Sets timeout of .conn for ``phase`` (see Timeouts.timeout())"""
+        timeout = self.timeouts.timeout(phase, deadline)
+        self.conn.timeout = timeout
+        if self.conn.sock is not None:
+            self.conn.sock.settimeout(timeout)
+
+    def exchange(self, method, uri, data, additional_headers=None,
+            timing=None, deadline=None):
+        """Send single request on .conn and read response
+
+        If the client has ``timeouts``, every phase is limited (and
+        AggregateTimeoutException is raised when a limit is exceeded).
+
+        Return value: tuple ``(response, response_body)``
+        """
+        phase = 'request'
+        try:
+            t0 = time.perf_counter()
+            if self.timeouts is not None:
+                phase = 'connect'
+                if self.conn.sock is None:
+                    self.set_timeout(phase, deadline)
+                    self.conn.connect()
+                phase = 'send'
+                self.set_timeout(phase, deadline)
+            self.request(method, uri, data, additional_headers)
+            t1 = time.perf_counter()
+            if self.timeouts is not None:
+                phase = 'wait'
+                self.set_timeout(phase, deadline)
+            r = self.conn.getresponse()
+            t2 = time.perf_counter()
+            r_body = r.read()
+            t3 = time.perf_counter()
+        except socket.timeout as e:
+            self.conn.close()
+            raise AggregateTimeoutException('%s %s : %s timed out' % (
+                    method, uri, phase)) from e
+
+        if timing is not None:
+            timing.attempts += 1
+            phases = getattr(self.conn, 'phases', {})
+            for phase, seconds in phases.items():
+                timing.add(phase, seconds)
+            if phases:
+                self.conn.phases = {}
+            timing.add('send', t1 - t0 - sum(phases.values()))
+            timing.add('wait', t2 - t1)
+            timing.add('receive', t3 - t2)
+            timing.status = r.status
+            timing.response_size = len(r_body)
+
+        if isinstance(self.conn.sock, ssl.SSLSocket):
+            # TLS 1.3 session tickets arrive after the handshake
+            self.tls_session = self.conn.sock.session
+
+        return r, r_body
+
+    def send(self, method, uri, data, additional_headers=None, timing=None,
+            deadline=None):
+        """Send request on .conn and read response
+
+        A keep-alive connection that was closed by the server is detected
+        without sending anything and re-opened.  If a request fails
+        nevertheless on a re-used connection (server closed it while the
+        request was sent), it is sent once more on a new connection.
+        Submissions can safely be repeated because Aggregate identifies
+        them by their instanceID.
+
+        If the server answers with a new digest challenge (e.g. because
+        the nonce is stale), the request is authenticated with the new
+        nonce and sent a second time.
+
+        If the client has ``timings``, a RequestTiming is recorded (the
+        durations are added to ``timing`` if specified).  The request
+        fails with AggregateTimeoutException after ``deadline`` (see
+        Timeouts.start()).  If the server cannot be reached, the client
+        is not connected any more (see is_connected()) until a request
+        succeeds again.
+
+        Return value: tuple ``(response, response_body)``
+        """
+        if timing is None and self.timings is not None:
+            timing = RequestTiming(method, uri)
+        if timing is not None:
+            timing.request_size = data and len(data) or 0
+
+        try:
+            if self.conn.sock is not None and not socket_alive(self.conn.sock):
+                lo.debug('keep-alive connection closed by server : reconnecting')
+                self.conn.close()
+
+            reused = self.conn.sock is not None
+            try:
+                r, r_body = self.exchange(
+                        method, uri, data, additional_headers, timing, deadline)
+            except (ConnectionError, ssl.SSLEOFError) as e:
+                self.conn.close()
+                if not reused:
+                    raise
+                lo.debug('keep-alive connection lost (%s) : reconnecting' % e)
+                r, r_body = self.exchange(
+                        method, uri, data, additional_headers, timing, deadline)
+
+            if r.status == 401 and self.daa is not None:
+                www_authenticate = r.getheader('www-authenticate')
+                if www_authenticate and self.daa.update(www_authenticate):
+                    lo.info('server renewed nonce : authenticating again')
+                    r, r_body = self.exchange(method, uri, data,
+                            additional_headers, timing, deadline)
+
+        except Exception as e:
+            if isinstance(e, (OSError, http.client.HTTPException)):
+                self.connection_failed = True
+            if timing is not None:
+                timing.error = str(e) or e.__class__.__name__
+            raise
+
+        finally:
+            if timing is not None and self.timings is not None:
+                self.timings.add(timing)
+
+        self.connection_failed = False
+        return r, r_body
 
     def connect(self, user=None, password=None):
         """Connect to ODK Aggregate server
@@ -220,23 +1085,30 @@ class AggregateClient:
         request was successful, the attribute .conn will be set to a
         value different fron None.
 
+        If the client was already authenticated with the same
+        credentials, the known nonce is reused and the Authorization
+        header is sent preemptively, saving the anonymous round trip.
+
         Arguments:
             - user (optional) -- username to use for authentication
             - password (optional) -- password to use for authentication
         """
 
-        if self.scheme == 'https':
-            self.conn = http.client.HTTPSConnection(self.address, self.port)
-            #TODO check against provided certificate
-            lo.info('SSL : server certificate NOT checked')
-        else:
-            self.conn = http.client.HTTPConnection(self.address, self.port)
+        self.conn = self.create_connection()
+
+        if (self.daa is not None and user is not None and
+                (self.daa.username, self.daa.password) == (user, password)):
+            r, r_body = self.send('HEAD', self.submission_uri, '')
+            lo.debug("HEAD %s (preemptive DAA) : status=%d reason=%s" % (
+                    self.submission_url, r.status, r.reason))
+            self.check_authenticated_status(r.status, user)
+            self.set_accept_content_length(
+                    r.getheader('X-OpenRosa-Accept-Content-Length'))
+            return
 
         self.daa = None
         # raises ConnectionRefusedError
-        self.request('HEAD', self.submission_uri, '')
-        r = self.conn.getresponse()
-        r_body = r.read()
+        r, r_body = self.send('HEAD', self.submission_uri, '')
 
         #cookie = r.getheader('Set-Cookie')
         #if cookie:
@@ -245,58 +1117,140 @@ class AggregateClient:
         lo.debug("HEAD %s : status=%d reason=%s" % (
                 self.submission_url, r.status, r.reason))
 
+        if self.check_anonymous_status(r.status, user, password):
+
+            self.daa = DAA(r.getheader('www-authenticate'), user, password)
+
+            #headers = create_headers(cookie)
+            r, r_body = self.send('HEAD', self.submission_uri, '')
+
+            lo.debug("server response DAA : status=%d reason=%s" % (r.status, r.reason))
+
+            self.check_authenticated_status(r.status, user)
+
+        self.set_accept_content_length(
+                r.getheader('X-OpenRosa-Accept-Content-Length'))
+
+    def set_accept_content_length(self, value):
+        try:
+            self.accept_content_length = value and int(value) or None
+        except ValueError:
+            lo.warning('invalid X-OpenRosa-Accept-Content-Length : ' + value)
+
+    @property
+    def size_budget(self):
+        """Maximum body size (None if unlimited)"""
+        limits = [limit for limit in (self.max_size, self.accept_content_length)
+                if limit]
+        return limits and min(limits) or None
+
+    def split_items(self, items):
+        """Splits submission into parts that fit into ``size_budget``
+
+        Following the OpenRosa form submission API, every part contains
+        the XML (first item) and some of the attachments; all parts but
+        the last are marked with an item ``*isIncomplete*=yes``.  An
+        attachment that does not fit into the budget on its own is sent
+        in a part by itself.
+
+        Return value: list of item lists (one if no split is needed)
+        """
+        budget = self.size_budget
+        if budget is None or len(MultipartBody(items)) <= budget:
+            return [list(items)]
+
+        base = len(MultipartBody([items[0], self.INCOMPLETE_ITEM]))
+        empty = len(MultipartBody([]))
+        parts = []
+        part = []
+        size = base
+        for item in items[1:]:
+            item_size = len(MultipartBody([item])) - empty
+            if part and size + item_size > budget:
+                parts.append(part)
+                part = []
+                size = base
+            part.append(item)
+            size += item_size
+        parts.append(part)
+
+        lo.debug('splitting submission of %d bytes into %d parts' % (
+                len(MultipartBody(items)), len(parts)))
+        return [[items[0]] + part + [self.INCOMPLETE_ITEM]
+                for part in parts[:-1]] + [[items[0]] + parts[-1]]
+
+    def check_encoded_size(self, body):
+        """Warns if an already encoded ``body`` exceeds ``size_budget``
+
+        Encoded bodies (e.g. from EncodingPool or an Outbox) cannot be
+        split any more and are posted as a single request.
+        """
+        budget = self.size_budget
+        if budget is not None and len(body) > budget:
+            lo.warning('encoded submission of %d bytes exceeds limit of %d '
+                    'bytes and cannot be split' % (len(body), budget))
+
+    def check_anonymous_status(self, status, user, password):
+        """Interprets status of initial anonymous HEAD request
+
+        Returns True if digest access authentication is needed and
+        raises AggregateException in case of error.
+        """
         # anonymous user has Data Collector rights -> status=204
-        if r.status == 204:
-            self.daa = None
+        if status == 204:
             lo.info('connected to %s (no authentication)' % self.url)
+            return False
 
         # anonymous user has no Data Collector rights -> status=401
-        elif r.status == 401:
+        elif status == 401:
             lo.info('Aggregate replied status=401 -> digest access authentication (DAA)')
 
             if user is None or password is None:
                 raise AggregateException('Must specify user/password for authentication')
 
-            self.daa = DAA(r.getheader('www-authenticate'), user, password)
-
-            #headers = create_headers(cookie)
-            self.request('HEAD', self.submission_uri, '')
-            r = self.conn.getresponse()
-            r_body = r.read()
+            return True
 
-            lo.debug("server response DAA : status=%d reason=%s" % (r.status, r.reason))
+        elif status == 404:
+            raise AggregateException('Could not connect : path "%s" not found' %
+                    self.uri)
 
-            if r.status == 401:
-                lo.error('cannot authenticate : received second 401 response')
-                raise AggregateException('Cannot authenticate')
+        else:
+            raise AggregateStatusException(
+                    'Could not connect : unknown status %d' % status, status)
 
-            if r.status != 204:
-                lo.error('expected status=204 (got %d) after authentication' %
-                        r.status)
-                if r.status == 403:
-                    raise AggregateException(
-                            'user "%s" is not allowed to post forms' % user)
-                raise AggregateException('cannot authenticate')
+    def check_authenticated_status(self, status, user):
+        """Interprets status of authenticated HEAD request
 
-            lo.info('connected to %s (authenticated as "%s")' % (self.url, user))
+        Raises AggregateException if authentication was not successful.
+        """
+        if status == 401:
+            lo.error('cannot authenticate : received second 401 response')
+            raise AggregateException('Cannot authenticate')
 
-        elif r.status == 404:
-            raise AggregateException('Could not connect : path "%s" not found' %
-                    self.uri)
+        if status != 204:
+            lo.error('expected status=204 (got %d) after authentication' %
+                    status)
+            if status == 403:
+                raise AggregateException(
+                        'user "%s" is not allowed to post forms' % user)
+            raise AggregateStatusException('cannot authenticate', status)
 
-        else:
-            raise AggregateException('Could not connect : unknown status')
+        lo.info('connected to %s (authenticated as "%s")' % (self.url, user))
 
     def is_connected(self):
-        """checks whether there is a working connection"""
-        if self.conn is None or self.conn.sock is None:
-            return False
-        try:
-            self.conn.request('HEAD', '/ODKAggregate', '')
-            r = self.conn.getresponse()
-            return True
-        except http.client.CannotSendRequest:
+        """checks whether the client is connected and authenticated
+
+        Does not send anything to the server : a keep-alive connection
+        that was closed by the server is closed and will be re-opened by
+        the next request (see send()).  Returns False after a request
+        failed because the server could not be reached.
+        """
+        if self.conn is None or self.connection_failed:
             return False
+        if self.conn.sock is not None and not socket_alive(self.conn.sock):
+            lo.debug('keep-alive connection closed by server')
+            self.conn.close()
+        return True
 
     def close(self):
         """closes the server connection"""
@@ -312,200 +1266,3353 @@ class AggregateClient:
         Arguments:
             - items -- a sequence of sequences 
               ``(name, filename, value, file_content_type)``
-              such as returned by XForm.get_items()
+              such as returned by XForm.get_items(); attachments
+              (AttachmentFile values) are streamed from disk; can also
+              be a MultipartBody (e.g. encoded by EncodingPool)
+
+        Submissions larger than ``size_budget`` are posted in several
+        parts (see split_items()); every part that fails because of the
+        connection or the server (see is_transient()) is retried on its
+        own (``part_attempts`` times) and the whole submission is only
+        complete when the last part was accepted.
+
+        With ``timeouts``, the submission must be completed before the
+        deadline and is retried (see Timeouts).
         """
-        content_type, body = self.encode_multipart(items)
-        self.request('POST', self.submission_uri, body, {
-                'Content-Type': content_type,
+        deadline = self.timeouts and self.timeouts.start()
+        if isinstance(items, MultipartBody):
+            self.check_encoded_size(items)
+            parts = [items]
+        else:
+            parts = self.split_items(items)
+        attempts = self.attempts(len(parts))
+
+        for i, part in enumerate(parts):
+            for attempt in range(attempts):
+                try:
+                    self.post_part(part, deadline)
+                    break
+                except Exception as e:
+                    # e.g. status 400 or 413 would fail again
+                    if (not is_transient(e) or attempt + 1 == attempts or
+                            self.timeouts and self.timeouts.expired(deadline)):
+                        raise
+                    lo.warning('could not post %s (%s) : retrying' % (
+                            self.part_name(i, len(parts)), e))
+                    if self.conn is not None:
+                        self.conn.close()
+
+    def attempts(self, parts):
+        """Returns number of attempts for every part of a submission
+        split into ``parts``"""
+        attempts = parts > 1 and self.part_attempts or 1
+        if self.timeouts is not None:
+            attempts = max(attempts, 1 + self.timeouts.retries)
+        return attempts
+
+    def part_name(self, i, parts):
+        if parts == 1:
+            return 'submission'
+        return 'part %d/%d' % (i + 1, parts)
+
+    def post_part(self, items, deadline=None):
+        """Post items in a single request (see post_multipart())"""
+        timing = None
+        if self.timings is not None:
+            timing = RequestTiming('POST', self.submission_uri)
+        t0 = time.perf_counter()
+        body = multipart_body(items)
+        if timing is not None:
+            timing.add('encode', time.perf_counter() - t0)
+
+        r, r_body = self.send('POST', self.submission_uri, body, {
+                'Content-Type': body.content_type,
                 'Content-Length': len(body)
-            })
-        r = self.conn.getresponse()
-        r_body = r.read()
+            }, timing, deadline)
+
+        self.check_post_status(r.status, r.reason, r_body)
+
+    def check_post_status(self, status, reason, r_body):
+        """Raises AggregateException if posting was not successful"""
 
         lo.debug('POST %s -> status=%d reason=%s data="%s"' % (
-            self.submission_uri, r.status, r.reason, r_body))
+            self.submission_uri, status, reason, r_body))
 
-        if r.status == 404:
+        if status == 404:
             lo.error('could not find form with specified id')
             lo.debug('response body : ' + r_body.decode('utf8'))
             raise AggregateFormNotFoundException('Form not found on server')
 
-        if r.status != 201:
-            lo.error('expected status=201 after posting, got ' + str(r.status))
+        if status != 201:
+            lo.error('expected status=201 after posting, got ' + str(status))
             lo.debug('response body : ' + r_body.decode('utf8'))
-            raise AggregateException('Could not post multipart')
-
-
-### XForm {{{1
-
-class XFormException(Exception):
-    """Risen by XForm"""
+            raise AggregateStatusException(
+                    'Could not post multipart (status %d)' % status, status)
 
-class XForm:
-    """Simple XForm parser for use with AggregateClient
+    def fetch_forms(self, cache, formids=None):
+        """Update FormCache with the XForms listed by the server
 
-    Only a small part of the XForm standard is implemented that
-    is sufficient to parse XForms, fill in some values and generate
-    the data to be sent via AggregateClient
-    """
+        Reads the OpenRosa formList and downloads new or changed XForms.
+        Forms whose cached copy matches the hash in the formList are not
+        requested at all; the formList itself and forms without hash are
+        revalidated with a conditional GET (``If-None-Match`` and
+        ``If-Modified-Since``), so unchanged forms cost a ``304`` answer.
+        Must be connected (see connect()).
 
-    def __init__(self, xml):
-        """Initializes from a XML string
+        The ``downloadUrl`` is requested on the current connection (only
+        path and query are used, because the host name configured in
+        Aggregate is not always reachable from the client).
 
         Arguments:
-            - xml -- file content of an XForm XML file
-        """
-        try:
-            self.document = parseString(xml)
-        except ExpatError as e:
-            raise XFormException('could not parse XML : ' + str(e))
+            - cache -- FormCache instance
+            - formids (optional) -- sequence of form IDs to download (by
+              default all forms of the formList); raises
+              AggregateFormNotFoundException if any of them is missing
 
-        instance = self.get_path(('h:html', 'h:head', 'model', 'instance'))
-        forms = [child for child in instance.childNodes
-                if child.nodeType == self.document.ELEMENT_NODE]
-        if len(forms) != 1:
-            raise XFormException('no unique form instance found')
+        Return value: dictionary form ID -> path of cached XForm
+        """
+        uri = self.uri + '/formList'
+        r, r_body = self.send('GET', uri, None, cache.conditional_headers())
+        lo.debug('GET %s -> status=%d reason=%s' % (uri, r.status, r.reason))
+        if r.status == 304:
+            forms = cache.form_list
+        elif r.status == 200:
+            forms = parse_form_list(r_body)
+            cache.set_form_list(forms,
+                    r.getheader('ETag'), r.getheader('Last-Modified'))
+        else:
+            lo.error('expected status=200 for formList, got %d' % r.status)
+            raise AggregateException('Could not get formList')
+
+        if formids is not None:
+            missing = set(formids) - set(forms)
+            if missing:
+                raise AggregateFormNotFoundException(
+                        'Form(s) not found on server : ' +
+                        ', '.join(sorted(missing)))
+
+        ret = {}
+        for formid, entry in forms.items():
+            if formids is not None and formid not in formids:
+                continue
+
+            if entry.get('hash') and cache.matches(formid, entry['hash']):
+                lo.debug('form "%s" : cached copy matches hash' % formid)
+                ret[formid] = cache.path(formid)
+                continue
+
+            url = urllib.parse.urlparse(entry['downloadUrl'])
+            uri = url.path + (url.query and '?' + url.query or '')
+            r, r_body = self.send('GET', uri, None,
+                    cache.conditional_headers(formid))
+            lo.debug('GET %s -> status=%d reason=%s' % (
+                    uri, r.status, r.reason))
+
+            if r.status == 304:
+                lo.debug('form "%s" : not modified' % formid)
+            elif r.status == 200:
+                if entry.get('hash') and not hash_matches(
+                        r_body, entry['hash']):
+                    raise AggregateException(
+                            'form "%s" does not match hash in formList' %
+                            formid)
+                cache.store(formid, r_body,
+                        r.getheader('ETag'), r.getheader('Last-Modified'))
+                lo.info('downloaded form "%s"%s' % (formid,
+                        entry.get('version') and
+                        ' (version %s)' % entry['version'] or ''))
+            elif r.status == 404:
+                raise AggregateFormNotFoundException(
+                        'Form "%s" not found on server' % formid)
+            else:
+                lo.error('expected status=200 for form "%s", got %d' % (
+                        formid, r.status))
+                raise AggregateException('Could not download form')
+
+            ret[formid] = cache.path(formid)
 
-        self.template = forms[0]
-        self.name = self.template.nodeName
-        formid = self.template.attributes.get('id')
-        if not formid:
-            raise XFormException('instance %s has no id attribute' % self.name)
-        self.formid = formid.value
+        return ret
 
-        #TODO implement 'required' and 'constraint'
 
-        self.paths = []
-        self.add_paths(self.template, tuple())
+### PooledAggregateClient {{{1
 
-        self.clear()
+class PooledConnection:
+    """Keep-alive connection managed by a ConnectionPool
 
-        lo.debug('loaded XForm %s "%s" : %d paths' % (
-            self.name, self.formid, len(self.paths)))
+    Every pooled connection can hold its own digest access authentication
+    state (attribute ``daa``, i.e. its own nonce count).
+    """
 
-    def add_paths(self, element, path):
-        if path:
-            self.paths.append('/'.join(path))
-        for child in element.childNodes:
-            if child.nodeType == self.document.ELEMENT_NODE:
-                self.add_paths(child, path + (child.nodeName,))
+    def __init__(self):
+        self.conn = None
+        self.daa = None
+        self.last_used = time.time()
 
-    def get_path(self, path):
-        node = self.document
-        for element in path:
-            candidates = [child for child in node.childNodes
-                    if child.nodeName == element]
-            if len(candidates) == 0:
-                raise XFormException('path "%s" (element "%s") not found' % (
-                        str(path), element))
-            if len(candidates) > 1:
-                raise XFormException('path "%s" (element "%s") not unique' % (
-                        str(path), element))
-            node = candidates[0]
-        return node
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+        self.daa = None
 
-    def clear(self):
-        self.items = {}
-        self.filenames = {}
-        self.mimetypes = {}
-        self['meta/instanceID'] = 'uuid:' + str(uuid.uuid4())
 
-    def __setitem__(self, name, value):
-        """Set value of a XForm field
+class ConnectionPool:
+    """Thread-safe pool of keep-alive connections
 
-        Raises XFormException if no field with given name can be found
-        in this form.
+    Connections are handed out with checkout() and returned with
+    checkin().  At most ``max_size`` connections exist at any time and
+    connections that were not used for more than ``idle_timeout`` seconds
+    are closed.
+    """
 
-        Arguments
-            - name -- name of field, path parts separated by '/'
-            - value -- value; int, float, date, time, and datetime will be
-              converted to string; None will forestall the sending of
-              this path
+    def __init__(self, max_size=4, idle_timeout=60):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.checked_out = 0
+        self.cond = threading.Condition()
+
+    def evict_idle(self):
+        """Closes connections that were idle for too long or that were
+        closed by the server"""
+        with self.cond:
+            now = time.time()
+            keep = []
+            for pconn in self.idle:
+                if now - pconn.last_used > self.idle_timeout:
+                    lo.debug('closing connection idle for %.1fs' % (
+                            now - pconn.last_used))
+                    pconn.close()
+                elif (pconn.conn is not None and pconn.conn.sock is not None
+                        and not socket_alive(pconn.conn.sock)):
+                    lo.debug('keep-alive connection closed by server')
+                    pconn.close()
+                else:
+                    keep.append(pconn)
+            self.idle = keep
+
+    def checkout(self, timeout=None):
+        """Get a connection from the pool
+
+        Blocks while ``max_size`` connections are checked out.  Returns a
+        PooledConnection that is either already connected or has its
+        attribute ``conn`` set to None.  Raises AggregateTimeoutException
+        if no connection becomes available within ``timeout`` seconds.
         """
-        if not name in self.paths:
-            raise XFormException('path "%s" not found in form "%s"' % (
-                name, self.name))
-
-        if value is None:
-            return
+        with self.cond:
+            self.evict_idle()
+            if not self.cond.wait_for(
+                    lambda: self.idle or self.checked_out < self.max_size,
+                    timeout):
+                raise AggregateTimeoutException(
+                        'no connection available in pool')
+            self.checked_out += 1
+            if self.idle:
+                # most recently used connection is most likely still alive
+                return self.idle.pop()
+            return PooledConnection()
+
+    def checkin(self, pconn, discard=False):
+        """Return a connection into the pool
 
-        if isinstance(value, int):
-            value = str(value)
-        elif isinstance(value, float):
-            value = str(value)
-        elif isinstance(value, datetime.time):
-            value = value.strftime('%H:%M:%S.0')
-        elif isinstance(value, datetime.date):
-            value = value.strftime('%Y-%m-%d')
-        elif isinstance(value, datetime.datetime):
-            value = value.strftime('%Y-%m-%d %H:%M:%S.0')
-
-        if not isinstance(value, str):
-            raise XFormException('cannot convert value : ' + str(value))
-        self.items[name] = value
-        lo.debug('setting %s[%s] = %s' % (self.formid, name, value))
+        Arguments:
+            - pconn -- PooledConnection returned by checkout()
+            - discard (optional) -- close connection instead of keeping it
+              (e.g. after an error)
+        """
+        with self.cond:
+            self.checked_out -= 1
+            if discard:
+                pconn.close()
+            else:
+                pconn.last_used = time.time()
+                self.idle.append(pconn)
+            self.cond.notify()
 
-    def set_file(self, name, filename, mimetype=None):
-        """Set value of a XForm "file type" field
+    def close(self):
+        """Closes all idle connections"""
+        with self.cond:
+            for pconn in self.idle:
+                pconn.close()
+            self.idle = []
+
+
+class PooledAggregateClient(AggregateClient):
+    """Thread-safe aggregate client using a pool of connections
+
+    Has the same interface as AggregateClient, but post_multipart() can be
+    called from several threads simultaneously.  Every call checks out a
+    keep-alive connection from a ConnectionPool; new connections are
+    authenticated with the credentials specified to connect().
+
+    By default, all connections share the same DAA : once the client is
+    connected, new connections send the Authorization header with their
+    first request and need no additional round trips.
+
+    With a hedging delay in ``timeouts``, requests are sent from a pool
+    of threads so that a second copy can be posted on another connection
+    while the first one is still waiting (see post_part()).
+
+    A request failing because the server cannot be reached marks the
+    client as not connected (see is_connected()) until a request succeeds
+    again.  Connections opened meanwhile authenticate on their own and
+    only then replace the shared DAA, so that requests in flight on
+    other connections keep using a valid one.
+    """
 
-        Raises XFormException if no field with given name can be found
-        in this form.
+    def __init__(self, address, port, uri, scheme='https', deviceID=None,
+            zerocopy=False, max_connections=4, idle_timeout=60,
+            share_nonce=True, timings=None, max_size=None, timeouts=None):
+        """Initializes client (does not connect yet)
 
         Arguments:
-            - name -- name of field, path parts separated by '/'
-            - filename -- name of file to be sent as value of field
-            - mimetype (optional) -- will be used as the file's
-              "Content-Type"
+            - address, port, uri, scheme, deviceID, zerocopy, timings,
+              max_size, timeouts -- see AggregateClient
+            - max_connections (optional) -- maximum size of connection pool
+            - idle_timeout (optional) -- seconds after which an unused
+              connection is closed
+            - share_nonce (optional) -- whether all connections share the
+              same DAA (else every connection authenticates separately)
         """
-        if mimetype is None:
-            mimetype = mimetypes.guess_type(filename)[0]
-            if mimetypes is None:
-                mimetype = 'application/binary'
+        self.share_nonce = share_nonce
+        self.shared_daa = None
+        self.daa_lock = threading.Lock()
+        self.local = threading.local()
+        self.pool = ConnectionPool(max_connections, idle_timeout)
+        self.user = self.password = None
+        self.connected = False
+        # only created when requests are hedged (see post_part())
+        self.hedging = None
+        self.hedging_lock = threading.Lock()
+        super().__init__(address, port, uri, scheme=scheme, deviceID=deviceID,
+                zerocopy=zerocopy, timings=timings, max_size=max_size,
+                timeouts=timeouts)
+
+    # .conn and .daa refer to the connection checked out by current thread
+    # (.daa to the shared DAA unless the connection is authenticating)
+
+    @property
+    def conn(self):
+        pconn = getattr(self.local, 'pconn', None)
+        return pconn and pconn.conn
+
+    @conn.setter
+    def conn(self, conn):
+        pconn = getattr(self.local, 'pconn', None)
+        if pconn is not None:
+            pconn.conn = conn
+
+    @property
+    def daa(self):
+        if self.share_nonce and not getattr(self.local, 'authenticating', False):
+            return self.shared_daa
+        pconn = getattr(self.local, 'pconn', None)
+        return pconn and pconn.daa
+
+    @daa.setter
+    def daa(self, daa):
+        if self.share_nonce and not getattr(self.local, 'authenticating', False):
+            with self.daa_lock:
+                self.shared_daa = daa
+            return
+        pconn = getattr(self.local, 'pconn', None)
+        if pconn is not None:
+            pconn.daa = daa
+
+    def authenticate(self, pconn):
+        """Opens connection of ``pconn`` and authenticates it (see
+        AggregateClient.connect()) without touching the shared DAA, which
+        is replaced after the authentication succeeded"""
+        if not self.share_nonce:
+            AggregateClient.connect(self, self.user, self.password)
+            return
+        with self.daa_lock:
+            # known nonce is re-used if the credentials did not change
+            pconn.daa = self.shared_daa
+        self.local.authenticating = True
+        try:
+            AggregateClient.connect(self, self.user, self.password)
+        finally:
+            self.local.authenticating = False
+        with self.daa_lock:
+            self.shared_daa = pconn.daa
+        pconn.daa = None
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager that checks out a connection for current thread"""
+        if getattr(self.local, 'pconn', None) is not None:
+            # nested use : keep connection checked out by outer block
+            yield self.local.pconn
+            return
 
-        self[name] = os.path.basename(filename)
-        self.filenames[name] = filename
-        self.mimetypes[name] = mimetype
-        lo.debug('(mimetype %s)' % mimetype)
+        pconn = self.pool.checkout()
+        self.local.pconn = pconn
+        try:
+            if pconn.conn is None:
+                if self.connected and self.share_nonce and self.daa:
+                    # authenticate preemptively with first request
+                    pconn.conn = self.create_connection()
+                else:
+                    self.authenticate(pconn)
+            yield pconn
+        except (OSError, http.client.HTTPException):
+            # server cannot be reached : re-connect before next request
+            self.connected = False
+            self.pool.checkin(pconn, discard=True)
+            raise
+        except:
+            self.pool.checkin(pconn, discard=True)
+            raise
+        else:
+            self.connected = True
+            self.pool.checkin(pconn)
+        finally:
+            self.local.pconn = None
 
-    def fill_in(self, element, path):
-        if path and element.attributes:
-            # remove all attributes apart from root element (has "id")
-            for name in list(element.attributes.keys()):
-                element.removeAttribute(name)
-        for child in element.childNodes:
-            self.fill_in(child, path + (child.nodeName,))
-        name = '/'.join(path) 
-        if name in self.items:
-            text = self.document.createTextNode(self.items[name])
-            element.appendChild(text)
+    def connect(self, user=None, password=None):
+        """Connect to ODK Aggregate server
 
-    def xml(self):
-        """Dump form content as XML"""
-        ret = self.template.cloneNode(deep=True)
-        self.fill_in(ret, tuple())
-        return '<?xml version="1.0" ?>' + ret.toxml()
+        Closes all pooled connections and opens a new one, raising
+        AggregateException in case of error (see AggregateClient.connect).
+        Further connections are opened when needed.
+        """
+        self.pool.close()
+        self.connected = False
+        self.user = user
+        self.password = password
+        with self.connection():
+            pass
+        self.connected = True
+
+    def is_connected(self):
+        """checks whether the client is connected and authenticated
+
+        Does not send anything to the server : returns False before
+        connect(), after close() and after a request failed because the
+        server could not be reached.  Idle connections that were closed by
+        the server are discarded (and re-opened when needed).  Becomes
+        True again as soon as a request succeeds.
+        """
+        if self.connected:
+            self.pool.evict_idle()
+        return self.connected
+
+    def close(self):
+        """closes all server connections (and stops hedging threads)"""
+        self.pool.close()
+        self.connected = False
+        with self.hedging_lock:
+            if self.hedging is not None:
+                self.hedging.shutdown(wait=False)
+                self.hedging = None
+
+    def hedging_executor(self):
+        """Returns pool of threads sending hedged requests"""
+        with self.hedging_lock:
+            if self.hedging is None:
+                self.hedging = concurrent.futures.ThreadPoolExecutor(
+                        2 * self.pool.max_size, thread_name_prefix='hedging')
+            return self.hedging
+
+    def post_part(self, items, deadline=None):
+        """Post items in a single request (thread-safe)
+
+        Every request checks out its own connection.  If there is a
+        hedging delay (see Timeouts.hedge_delay()) and the request did not
+        complete within it, the same body is posted a second time on
+        another connection; the first successful response is returned
+        and the other request is left to finish in the background.
+        """
+        delay = self.timeouts and self.timeouts.hedge_delay(self.timings)
+        if delay is None:
+            with self.connection():
+                return super().post_part(items, deadline)
+
+        body = multipart_body(items)
+        def attempt():
+            with self.connection():
+                AggregateClient.post_part(self, body, deadline)
+
+        hedging = self.hedging_executor()
+        first = hedging.submit(attempt)
+        done, _ = concurrent.futures.wait([first], delay)
+        if done:
+            return first.result()
+
+        lo.debug('no response after %.3fs : hedging submission' % delay)
+        error = None
+        for future in concurrent.futures.as_completed(
+                [first, hedging.submit(attempt)]):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        raise error
+
+    def fetch_forms(self, cache, formids=None):
+        """See AggregateClient.fetch_forms()"""
+        with self.connection():
+            return super().fetch_forms(cache, formids)
+
+
+### AsyncAggregateClient {{{1
+
+class SubmissionResult:
+    """Outcome of a single submission posted by AsyncAggregateClient"""
+
+    def __init__(self, key, error=None, elapsed=None, size=None):
+        """
+        Arguments:
+            - key -- identifies the submission (as passed to submit_many)
+            - error (optional) -- exception raised while posting, None
+              if the server accepted the submission
+            - elapsed (optional) -- seconds spent posting the submission
+            - size (optional) -- size of request body in bytes
+        """
+        self.key = key
+        self.error = error
+        self.elapsed = elapsed
+        self.size = size
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return 'SubmissionResult(%r, error=%r, elapsed=%r)' % (
+                self.key, self.error, self.elapsed)
+
+
+class AsyncConnection:
+    """Minimal HTTP/1.1 keep-alive connection on top of asyncio streams"""
+
+    def __init__(self, address, port, ssl_context=None):
+        self.address = address
+        self.port = port
+        self.ssl_context = ssl_context
+        self.reader = self.writer = None
+        self.requests = 0
+        self.phases = {}
+
+    async def open(self):
+        loop = asyncio.get_event_loop()
+        t0 = time.perf_counter()
+        infos = await loop.getaddrinfo(
+                self.address, self.port, type=socket.SOCK_STREAM)
+        t1 = time.perf_counter()
+        error = None
+        for family, type_, proto, canonname, sockaddr in infos:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(
+                        sockaddr[0], sockaddr[1], ssl=self.ssl_context,
+                        server_hostname=self.ssl_context and self.address or None)
+                break
+            except OSError as e:
+                error = e
+        else:
+            raise error or OSError('getaddrinfo returned empty list')
+        self.phases = {'dns': t1 - t0, 'connect': time.perf_counter() - t1}
+        self.requests = 0
+
+    @property
+    def is_open(self):
+        return self.writer is not None and not self.reader.at_eof()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def within(self, phase, awaitable, timeouts, deadline):
+        """Awaits ``awaitable`` within the timeout of ``phase`` (see
+        Timeouts.timeout()), closing the connection on timeout"""
+        if timeouts is None:
+            return await awaitable
+        try:
+            timeout = timeouts.timeout(phase, deadline)
+        except AggregateTimeoutException:
+            awaitable.close()
+            self.close()
+            raise
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError as e:
+            self.close()
+            raise AggregateTimeoutException('%s timed out' % phase) from e
+
+    async def request(self, method, uri, body, headers, timing=None,
+            timeouts=None, deadline=None):
+        """Send request and read complete response
+
+        Returns a tuple ``(status, reason, headers, body)`` with the
+        header names in lower case.  Durations are added to ``timing``
+        (RequestTiming) if specified.  Every phase is limited by
+        ``timeouts`` and ``deadline`` if specified (see Timeouts).
+        """
+        opened = not self.is_open
+        if opened:
+            await self.within('connect', self.open(), timeouts, deadline)
+        t1 = time.perf_counter()
+
+        lines = ['%s %s HTTP/1.1' % (method, uri),
+                'Host: %s:%d' % (self.address, self.port)]
+        lines += ['%s: %s' % (name, value) for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin1'))
+        if isinstance(body, bytes):
+            body = (body, )
+        if hasattr(body, '__aiter__'):
+            # MultipartBody : attachments are read off the event loop
+            async for chunk in body:
+                self.writer.write(chunk)
+                await self.within('send', self.writer.drain(), timeouts,
+                        deadline)
+        else:
+            for chunk in body or ():
+                self.writer.write(chunk)
+                await self.within('send', self.writer.drain(), timeouts,
+                        deadline)
+        await self.within('send', self.writer.drain(), timeouts, deadline)
+        self.requests += 1
+
+        t2 = time.perf_counter()
+        status_line = await self.within('wait', self.reader.readline(),
+                timeouts, deadline)
+        t3 = time.perf_counter()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        parts = status_line.decode('latin1').rstrip('\r\n').split(' ', 2)
+        status = int(parts[1])
+        reason = len(parts) > 2 and parts[2] or ''
+
+        r_headers, r_body = await self.within('wait',
+                self.read_response(method, status), timeouts, deadline)
+
+        if timing is not None:
+            timing.attempts += 1
+            if opened:
+                for phase, seconds in self.phases.items():
+                    timing.add(phase, seconds)
+            timing.add('send', t2 - t1)
+            timing.add('wait', t3 - t2)
+            timing.add('receive', time.perf_counter() - t3)
+            timing.status = status
+            timing.response_size = len(r_body)
+
+        return status, reason, r_headers, r_body
+
+    async def read_response(self, method, status):
+        """Reads headers and body of response after the status line"""
+        r_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, value = line.split(':', 1)
+            r_headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            r_body = b''
+        elif r_headers.get('transfer-encoding', '').lower() == 'chunked':
+            r_body = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # skip trailers
+                    while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                r_body += await self.reader.readexactly(size)
+                await self.reader.readline()
+        elif 'content-length' in r_headers:
+            r_body = await self.reader.readexactly(
+                    int(r_headers['content-length']))
+        else:
+            r_body = await self.reader.read()
+            self.close()
+
+        if r_headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return r_headers, r_body
+
+
+class AsyncAggregateClient(AggregateClient):
+    """Aggregate client for posting many forms concurrently
+
+    Same semantics as AggregateClient, but implemented with asyncio and
+    keeping up to ``concurrency`` keep-alive connections to the server.
+    The methods connect(), post_multipart() and close() are coroutines.
+
+    Hedged requests (see Timeouts) do not count against ``concurrency``
+    : up to a quarter as many can be in flight on additional connections.
+    """
+
+    def __init__(self, address, port, uri, scheme='https', deviceID=None,
+            concurrency=4, timings=None, max_size=None, timeouts=None):
+        """Initializes client (does not connect yet)
+
+        Arguments:
+            - address, port, uri, scheme, deviceID, timings, max_size,
+              timeouts -- see AggregateClient
+            - concurrency (optional) -- maximum number of submissions in
+              flight at any time (i.e. number of connections used)
+        """
+        super().__init__(address, port, uri, scheme=scheme, deviceID=deviceID,
+                timings=timings, max_size=max_size, timeouts=timeouts)
+        self.concurrency = concurrency
+        self.daa = None
+        self.idle = []
+        self.slots = None
+        self.hedge_slots = None
+
+    def create_connection(self):
+        return AsyncConnection(self.address, self.port, self.ssl_context)
+
+    async def request(self, conn, method, uri, data, additional_headers=None,
+            timing=None, deadline=None):
+        """Send request on ``conn`` (AsyncConnection)
+
+        If the client has ``timings``, the request is recorded as a
+        RequestTiming (unless ``timing`` is specified : then the durations
+        are added to it and the caller records it).
+        """
+        headers = self.create_headers(additional_headers)
+        if self.daa:
+            headers['Authorization'] = self.daa.get_authentication(
+                method, uri)
+        if timing is not None or self.timings is None:
+            return await conn.request(method, uri, data, headers, timing,
+                    self.timeouts, deadline)
+
+        timing = RequestTiming(method, uri)
+        try:
+            return await conn.request(method, uri, data, headers, timing,
+                    self.timeouts, deadline)
+        except Exception as e:
+            timing.error = str(e) or e.__class__.__name__
+            raise
+        finally:
+            self.timings.add(timing)
+
+    async def connect(self, user=None, password=None):
+        """Connect to ODK Aggregate server
+
+        See AggregateClient.connect()
+        """
+        self.daa = None
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.hedge_slots = asyncio.Semaphore(max(1, self.concurrency // 4))
+        conn = self.create_connection()
+        status, reason, headers, r_body = await self.request(
+                conn, 'HEAD', self.submission_uri, b'')
+
+        lo.debug("HEAD %s : status=%d reason=%s" % (
+                self.submission_url, status, reason))
+
+        if self.check_anonymous_status(status, user, password):
+
+            self.daa = DAA(headers.get('www-authenticate'), user, password)
+
+            status, reason, headers, r_body = await self.request(
+                    conn, 'HEAD', self.submission_uri, b'')
+
+            lo.debug("server response DAA : status=%d reason=%s" % (status, reason))
+
+            self.check_authenticated_status(status, user)
+
+        self.set_accept_content_length(
+                headers.get('x-openrosa-accept-content-length'))
+        self.idle.append(conn)
+
+    def is_connected(self):
+        """checks whether connect() succeeded and close() was not called
+        since (connections are opened when needed)"""
+        return self.slots is not None
+
+    async def close(self):
+        """closes all server connections"""
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+        self.slots = self.hedge_slots = None
+
+    def fetch_forms(self, cache, formids=None):
+        """Not supported : use AggregateClient.fetch_forms()"""
+        raise AggregateException('AsyncAggregateClient cannot fetch forms : '
+                'use AggregateClient.fetch_forms()')
+
+    async def post_multipart(self, items):
+        """Post items to server
+
+        See AggregateClient.post_multipart(); waits for a free slot if
+        ``concurrency`` submissions are already in flight.
+        """
+        await self.post_submission(items)
+
+    async def post_submission(self, items):
+        """Post items (see post_multipart()); returns size of the bodies"""
+        deadline = self.timeouts and self.timeouts.start()
+        if isinstance(items, MultipartBody):
+            self.check_encoded_size(items)
+            parts = [items]
+        else:
+            parts = self.split_items(items)
+        if len(parts) > 1 or self.attempts(1) > 1:
+            return await self.post_parts(parts, deadline)
+
+        timing = None
+        if self.timings is not None:
+            timing = RequestTiming('POST', self.submission_uri)
+        t0 = time.perf_counter()
+        body = multipart_body(parts[0])
+        if timing is not None:
+            timing.add('encode', time.perf_counter() - t0)
+        await self.post_body(body, timing, deadline)
+        return len(body)
+
+    async def post_body(self, body, timing=None, deadline=None):
+        """Post MultipartBody to server (see post_multipart())
+
+        If the client has ``timings``, a RequestTiming is recorded (the
+        durations are added to ``timing`` if specified).
+
+        If there is a hedging delay (see Timeouts.hedge_delay()) and the
+        request did not complete within it, the same body is posted a
+        second time on another connection; the first successful response
+        wins and the other request is cancelled.
+        """
+        if self.slots is None:
+            raise AggregateException('must connect() before posting')
+
+        delay = self.timeouts and self.timeouts.hedge_delay(self.timings)
+        if delay is None:
+            return await self.post_attempt(body, timing, deadline)
+
+        first = asyncio.ensure_future(self.post_attempt(body, timing, deadline))
+        done, pending = await asyncio.wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        lo.debug('no response after %.3fs : hedging submission' % delay)
+        pending.add(asyncio.ensure_future(
+                self.post_attempt(body, None, deadline, hedge=True)))
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def post_attempt(self, body, timing=None, deadline=None, hedge=False):
+        """Post body once, recording a RequestTiming (see post_body())"""
+        if timing is None and self.timings is not None:
+            timing = RequestTiming('POST', self.submission_uri)
+        if timing is None:
+            return await self.send_body(body, None, deadline, hedge)
+
+        timing.request_size = len(body)
+        try:
+            await self.send_body(body, timing, deadline, hedge)
+        except asyncio.CancelledError:
+            timing.error = 'cancelled'
+            raise
+        except Exception as e:
+            timing.error = str(e) or e.__class__.__name__
+            raise
+        finally:
+            self.timings.add(timing)
+
+    async def send_body(self, body, timing, deadline=None, hedge=False):
+        """Post body on idle (or new) connection, retrying if needed
+
+        Hedged requests (``hedge=True``) wait for one of the
+        ``hedge_slots`` instead of a regular slot.
+        """
+        headers = {
+                'Content-Type': body.content_type,
+                'Content-Length': len(body)
+            }
+
+        async with (hedge and self.hedge_slots or self.slots):
+            conn = self.idle and self.idle.pop() or self.create_connection()
+            # before sending : a failing write leaves .requests unchanged
+            reused = conn.is_open and conn.requests > 0
+            try:
+                try:
+                    status, reason, r_headers, r_body = await self.request(
+                            conn, 'POST', self.submission_uri, body, headers,
+                            timing, deadline)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    if not reused:
+                        raise
+                    # server closed idle keep-alive connection -> retry once
+                    lo.debug('keep-alive connection lost (%s) : reconnecting' % e)
+                    conn.close()
+                    status, reason, r_headers, r_body = await self.request(
+                            conn, 'POST', self.submission_uri, body, headers,
+                            timing, deadline)
+                www_authenticate = r_headers.get('www-authenticate')
+                if (status == 401 and self.daa is not None and
+                        www_authenticate and self.daa.update(www_authenticate)):
+                    lo.info('server renewed nonce : authenticating again')
+                    status, reason, r_headers, r_body = await self.request(
+                            conn, 'POST', self.submission_uri, body, headers,
+                            timing, deadline)
+            except:
+                conn.close()
+                raise
+            self.idle.append(conn)
+
+        self.check_post_status(status, reason, r_body)
+
+    async def post_parts(self, parts, deadline=None):
+        """Post parts of a split submission in order, retrying every
+        part on its own after transient errors (see is_transient());
+        returns total size of the bodies"""
+        attempts = self.attempts(len(parts))
+        size = 0
+        for i, part in enumerate(parts):
+            body = multipart_body(part)
+            for attempt in range(attempts):
+                try:
+                    await self.post_body(body, None, deadline)
+                    break
+                except Exception as e:
+                    if (not is_transient(e) or attempt + 1 == attempts or
+                            self.timeouts and self.timeouts.expired(deadline)):
+                        raise
+                    lo.warning('could not post %s (%s) : retrying' % (
+                            self.part_name(i, len(parts)), e))
+            size += len(body)
+        return size
+
+    async def submit(self, key, items):
+        t0 = time.time()
+        try:
+            size = await self.post_submission(items)
+            return SubmissionResult(key, elapsed=time.time() - t0, size=size)
+        except Exception as e:
+            return SubmissionResult(key, error=e, elapsed=time.time() - t0)
+
+    async def submit_many(self, submissions, concurrency=None):
+        """Post submissions, keeping several of them in flight
+
+        Asynchronous generator that yields a SubmissionResult for every
+        submission, in the order of completion.  The next submission is
+        only taken from ``submissions`` when there is a free slot, so a
+        generator producing submissions is never far ahead of the
+        network (backpressure).  Synchronous iterables are advanced in
+        the default executor and can therefore block (e.g. reading files
+        or database rows) without stalling the transfers in flight.
+
+        Arguments:
+            - submissions -- (asynchronous) iterable of ``(key, items)``
+              where ``items`` is what post_multipart() expects and ``key``
+              is used to identify the SubmissionResult
+            - concurrency (optional) -- maximum number of submissions in
+              flight; defaults to the value specified in the constructor
+        """
+        concurrency = concurrency or self.concurrency
+        loop = asyncio.get_event_loop()
+        if hasattr(submissions, '__aiter__'):
+            iterator = submissions.__aiter__()
+            async def next_submission():
+                try:
+                    return await iterator.__anext__()
+                except StopAsyncIteration:
+                    return None
+        else:
+            iterator = iter(submissions)
+            async def next_submission():
+                return await loop.run_in_executor(None, next, iterator, None)
+
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency:
+                    submission = await next_submission()
+                    if submission is None:
+                        exhausted = True
+                    else:
+                        pending.add(asyncio.ensure_future(
+                                self.submit(*submission)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def post_many(client, submissions, user=None, password=None, callback=None):
+    """Post submissions with an AsyncAggregateClient from synchronous code
+
+    Connects the client, posts all submissions (see
+    AsyncAggregateClient.submit_many()) and closes the client again.
+
+    Arguments:
+        - client -- AsyncAggregateClient instance
+        - submissions -- iterable of ``(key, items)``
+        - user, password (optional) -- credentials for connect()
+        - callback (optional) -- called with every SubmissionResult as
+          soon as it is available; exceptions raised by the callback
+          abort the remaining submissions
+
+    Return value: list of SubmissionResult in order of completion
+    """
+    results = []
+
+    async def run():
+        await client.connect(user, password)
+        results_iter = client.submit_many(submissions)
+        try:
+            async for result in results_iter:
+                results.append(result)
+                if callback:
+                    callback(result)
+        finally:
+            await results_iter.aclose()
+            await client.close()
+
+    asyncio.run(run())
+    return results
+
+
+### BalancedAggregateClient {{{1
+
+class Endpoint:
+    """One of the clients of a Balancer and its health"""
+
+    def __init__(self, client):
+        self.client = client
+        # submissions in flight
+        self.outstanding = 0
+        # moving average of the duration of successful submissions
+        self.latency = None
+        self.posted = 0
+        self.failed = 0
+        # consecutive failures, ejections
+        self.failures = 0
+        self.ejections = 0
+        # time.monotonic() when the endpoint will be probed again
+        self.ejected_until = None
+        self.probing = False
+
+    @property
+    def url(self):
+        return self.client.url
+
+    def as_dict(self):
+        return {
+                'url': self.url,
+                'outstanding': self.outstanding,
+                'latency': self.latency,
+                'posted': self.posted,
+                'failed': self.failed,
+                'ejected': self.ejected_until is not None,
+            }
+
+
+class Balancer:
+    """Spreads submissions across several endpoints (thread-safe)
+
+    With ``policy='outstanding'``, a submission goes to the endpoint with
+    the fewest submissions in flight; with ``policy='latency'``, to the
+    endpoint with the smallest expected wait, i.e. the moving average of
+    its latency times one more than its submissions in flight (endpoints
+    without any measured latency are tried first).  Ties are broken in
+    turn (round robin).
+
+    After ``max_failures`` consecutive failures, an endpoint is ejected
+    for ``eject_time`` seconds (doubling with every further ejection up
+    to ``max_eject_time``).  Once that time has passed, the next
+    submission probes the endpoint (see acquire()) : if it succeeds, the
+    endpoint is used again, otherwise it is ejected for longer.  If all
+    endpoints are ejected, the one that was ejected first is probed
+    instead of failing the submission.
+    """
+
+    POLICIES = ('outstanding', 'latency')
+
+    def __init__(self, clients, policy='outstanding', max_failures=3,
+            eject_time=10, max_eject_time=300, smoothing=0.3):
+        """
+        Arguments:
+            - clients -- one client per endpoint
+            - policy (optional) -- 'outstanding' or 'latency' (see above)
+            - max_failures (optional) -- consecutive failures that eject
+              an endpoint
+            - eject_time, max_eject_time (optional) -- seconds an
+              endpoint is ejected the first time, at most
+            - smoothing (optional) -- weight of the last latency in the
+              moving average
+        """
+        if policy not in self.POLICIES:
+            raise ValueError('unknown policy "%s" (expected one of %s)' % (
+                    policy, ', '.join(self.POLICIES)))
+        if not clients:
+            raise ValueError('need at least one client')
+        self.endpoints = [Endpoint(client) for client in clients]
+        self.policy = policy
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        # index of endpoint that wins the next tie
+        self.turn = 0
+
+    def score(self, endpoint):
+        turn = (self.endpoints.index(endpoint) - self.turn) % len(self.endpoints)
+        if self.policy == 'latency':
+            return ((endpoint.latency or 0) * (endpoint.outstanding + 1), turn)
+        return (endpoint.outstanding, turn)
+
+    def acquire(self, exclude=()):
+        """Chooses endpoint for the next submission
+
+        Returns a tuple ``(endpoint, probe)`` (``endpoint`` is None if all
+        endpoints are in ``exclude``) and counts the submission as in
+        flight until release() is called.  If ``probe`` is True, the
+        endpoint was ejected and should be checked before posting (e.g.
+        by reconnecting).
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints
+                    if endpoint not in exclude]
+            healthy = [endpoint for endpoint in candidates
+                    if endpoint.ejected_until is None]
+            due = [endpoint for endpoint in candidates
+                    if endpoint.ejected_until is not None and
+                    not endpoint.probing and endpoint.ejected_until <= now]
+            if due:
+                endpoint = min(due, key=lambda endpoint: endpoint.ejected_until)
+            elif healthy:
+                endpoint = min(healthy, key=self.score)
+            else:
+                ejected = [endpoint for endpoint in candidates
+                        if not endpoint.probing]
+                if not ejected:
+                    return None, False
+                endpoint = min(ejected,
+                        key=lambda endpoint: endpoint.ejected_until)
+            self.turn = self.endpoints.index(endpoint) + 1
+            probe = endpoint.ejected_until is not None
+            if probe:
+                lo.info('probing endpoint %s' % endpoint.url)
+                endpoint.probing = True
+            endpoint.outstanding += 1
+            return endpoint, probe
+
+    def release(self, endpoint, elapsed=None, error=None):
+        """Records outcome of a submission started with acquire()
+
+        Arguments:
+            - endpoint -- as returned by acquire()
+            - elapsed (optional) -- seconds the successful submission took
+            - error (optional) -- exception if the submission failed
+              because of the endpoint (ejects it eventually)
+        """
+        with self.lock:
+            endpoint.outstanding -= 1
+            probing = endpoint.probing
+            endpoint.probing = False
+            if error is None:
+                endpoint.posted += 1
+                endpoint.failures = 0
+                if elapsed is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = elapsed
+                    else:
+                        endpoint.latency += self.smoothing * (
+                                elapsed - endpoint.latency)
+                if endpoint.ejected_until is not None:
+                    lo.info('endpoint %s is back' % endpoint.url)
+                    endpoint.ejected_until = None
+                    endpoint.ejections = 0
+                return
+
+            endpoint.failed += 1
+            endpoint.failures += 1
+            if probing or (endpoint.ejected_until is None and
+                    endpoint.failures >= self.max_failures):
+                self.eject_locked(endpoint, error)
+
+    def eject_locked(self, endpoint, error):
+        seconds = min(self.max_eject_time,
+                self.eject_time * 2 ** endpoint.ejections)
+        endpoint.ejections += 1
+        endpoint.ejected_until = time.monotonic() + seconds
+        lo.warning('ejecting endpoint %s for %.1fs (%s)' % (
+                endpoint.url, seconds, error))
+
+    def eject(self, endpoint, error):
+        """Ejects endpoint (e.g. because it could not be connected)"""
+        with self.lock:
+            endpoint.failed += 1
+            endpoint.failures += 1
+            self.eject_locked(endpoint, error)
+
+    @property
+    def healthy(self):
+        """Endpoints that are not ejected"""
+        with self.lock:
+            return [endpoint for endpoint in self.endpoints
+                    if endpoint.ejected_until is None]
+
+    def summary(self):
+        """Returns list of lines (one per endpoint) for logging"""
+        ms = lambda value: value is None and '-' or '%.1f' % (1000 * value)
+        with self.lock:
+            return ['%s : %d posted, %d failed, latency=%sms%s' % (
+                    endpoint.url, endpoint.posted, endpoint.failed,
+                    ms(endpoint.latency),
+                    endpoint.ejected_until is not None and ' (ejected)' or '')
+                    for endpoint in self.endpoints]
+
+
+class BalancedAggregateClient:
+    """Posts submissions to several Aggregate front-ends (replicas)
+
+    Has the same interface as AggregateClient and spreads the
+    submissions across ``clients`` (one per front-end, all using the same
+    database) with a Balancer.  A submission that fails on one endpoint
+    because of the connection or the server (see is_transient()) is
+    posted again on the next one (with the same instanceID, so it is
+    stored only once) until every endpoint was tried; other errors are
+    raised without counting against the endpoint.
+
+    post_multipart() is thread-safe if the clients are (e.g.
+    PooledAggregateClient).
+    """
+
+    INCOMPLETE_ITEM = AggregateClient.INCOMPLETE_ITEM
+
+    # errors that count against the health of an endpoint if they are
+    # transient (see is_transient()); others are raised
+    ENDPOINT_ERRORS = TRANSIENT_ERRORS + (AggregateStatusException, )
+    # errors that eject an endpoint in connect()
+    CONNECT_ERRORS = ENDPOINT_ERRORS + (AggregateException, )
+
+    def __init__(self, clients, policy='outstanding', **kwargs):
+        """
+        Arguments:
+            - clients -- list of AggregateClient (or subclass) instances,
+              one per endpoint (should share ``timings``)
+            - policy (optional) -- see Balancer
+            - further keyword arguments are passed to the Balancer
+        """
+        self.balancer = Balancer(clients, policy, **kwargs)
+        self.clients = clients
+        self.user = self.password = None
+        self.connected = False
+
+    @property
+    def url(self):
+        return ', '.join(client.url for client in self.clients)
+
+    @property
+    def timings(self):
+        return self.clients[0].timings
+
+    @property
+    def size_budget(self):
+        """Smallest size_budget of all endpoints (None if unlimited)"""
+        budgets = [client.size_budget for client in self.clients
+                if client.size_budget]
+        return budgets and min(budgets) or None
+
+    # parts must fit into the budget of every endpoint
+    split_items = AggregateClient.split_items
+    check_encoded_size = AggregateClient.check_encoded_size
+
+    def connect(self, user=None, password=None):
+        """Connects all endpoints; endpoints that cannot be reached are
+        ejected.  Raises the error of the first endpoint if none can be
+        reached."""
+        self.user = user
+        self.password = password
+        errors = []
+        for endpoint in self.balancer.endpoints:
+            try:
+                endpoint.client.connect(user, password)
+            except AuthenticationException:
+                raise
+            except self.CONNECT_ERRORS as e:
+                lo.error('could not connect to %s : %s' % (endpoint.url, e))
+                self.balancer.eject(endpoint, e)
+                errors.append(e)
+        if len(errors) == len(self.clients):
+            raise errors[0]
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def close(self):
+        for client in self.clients:
+            if client.is_connected():
+                client.close()
+        self.connected = False
+
+    def post_multipart(self, items):
+        """Post items to one of the endpoints
+
+        See AggregateClient.post_multipart()
+        """
+        tried = []
+        error = AggregateException('no endpoint available')
+        while True:
+            endpoint, probe = self.balancer.acquire(tried)
+            if endpoint is None:
+                raise error
+            tried.append(endpoint)
+            t0 = time.perf_counter()
+            try:
+                if probe or not endpoint.client.is_connected():
+                    endpoint.client.connect(self.user, self.password)
+                endpoint.client.post_multipart(items)
+            except self.ENDPOINT_ERRORS as e:
+                if not is_transient(e):
+                    # e.g. status 400 : would fail on every endpoint
+                    self.balancer.release(endpoint)
+                    raise
+                self.balancer.release(endpoint, error=e)
+                error = e
+                lo.warning('could not post to %s (%s)' % (endpoint.url, e))
+                continue
+            except:
+                self.balancer.release(endpoint)
+                raise
+            self.balancer.release(endpoint, time.perf_counter() - t0)
+            return
+
+    def fetch_forms(self, cache, formids=None):
+        """See AggregateClient.fetch_forms() (uses first healthy endpoint)"""
+        endpoints = self.balancer.healthy or self.balancer.endpoints
+        return endpoints[0].client.fetch_forms(cache, formids)
+
+
+class AsyncBalancedAggregateClient(BalancedAggregateClient):
+    """Posts submissions to several Aggregate front-ends concurrently
+
+    Same as BalancedAggregateClient for AsyncAggregateClient instances :
+    connect(), post_multipart() and close() are coroutines and
+    submit_many() keeps up to the sum of the ``concurrency`` of all
+    clients in flight.
+    """
+
+
+    @property
+    def concurrency(self):
+        return sum(client.concurrency for client in self.clients)
+
+    async def connect(self, user=None, password=None):
+        """See BalancedAggregateClient.connect()"""
+        self.user = user
+        self.password = password
+        results = await asyncio.gather(*[
+                client.connect(user, password) for client in self.clients],
+                return_exceptions=True)
+        errors = []
+        for endpoint, result in zip(self.balancer.endpoints, results):
+            if isinstance(result, AuthenticationException):
+                raise result
+            if isinstance(result, self.CONNECT_ERRORS):
+                lo.error('could not connect to %s : %s' % (endpoint.url, result))
+                self.balancer.eject(endpoint, result)
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                raise result
+        if len(errors) == len(self.clients):
+            raise errors[0]
+        self.connected = True
+
+    async def close(self):
+        for client in self.clients:
+            await client.close()
+        self.connected = False
+
+    async def post_multipart(self, items):
+        """See BalancedAggregateClient.post_multipart()"""
+        await self.post_submission(items)
+
+    async def post_submission(self, items):
+        """Post items to one of the endpoints; returns size of the bodies"""
+        tried = []
+        error = AggregateException('no endpoint available')
+        while True:
+            endpoint, probe = self.balancer.acquire(tried)
+            if endpoint is None:
+                raise error
+            tried.append(endpoint)
+            t0 = time.perf_counter()
+            try:
+                if probe:
+                    await endpoint.client.close()
+                    await endpoint.client.connect(self.user, self.password)
+                size = await endpoint.client.post_submission(items)
+            except self.ENDPOINT_ERRORS as e:
+                if not is_transient(e):
+                    self.balancer.release(endpoint)
+                    raise
+                self.balancer.release(endpoint, error=e)
+                error = e
+                lo.warning('could not post to %s (%s)' % (endpoint.url, e))
+                continue
+            except BaseException:
+                self.balancer.release(endpoint)
+                raise
+            self.balancer.release(endpoint, time.perf_counter() - t0)
+            return size
+
+    # scheduling only relies on post_submission() and concurrency
+    submit = AsyncAggregateClient.submit
+    submit_many = AsyncAggregateClient.submit_many
+
+
+### XForm {{{1
+
+class XFormException(Exception):
+    """Risen by XForm"""
+
+def convert_value(value):
+    """Converts value to be filled into a XForm field
+
+    int, float, date, time, and datetime are converted to string, None
+    is returned unchanged; raises XFormException for other types
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, int):
+        value = str(value)
+    elif isinstance(value, float):
+        value = str(value)
+    elif isinstance(value, datetime.time):
+        value = value.strftime('%H:%M:%S.0')
+    elif isinstance(value, datetime.date):
+        value = value.strftime('%Y-%m-%d')
+    elif isinstance(value, datetime.datetime):
+        value = value.strftime('%Y-%m-%d %H:%M:%S.0')
+
+    if not isinstance(value, str):
+        raise XFormException('cannot convert value : ' + str(value))
+    return value
+
+# minidom escapes quotes in text nodes up to Python 3.12 but not any more
+# in later versions : XFormTemplate.write_xml() must produce the same output
+ESCAPE_QUOTES = '&quot;' in parseString('<x/>').createTextNode('"').toxml()
+
+def escape_text(text):
+    """Escapes text content like xml.dom.minidom does"""
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    if ESCAPE_QUOTES:
+        text = text.replace('"', '&quot;')
+    return text
+
+def guess_mimetype(filename, mimetype=None):
+    """Returns mimetype or a guess based on filename"""
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(filename)[0]
+        if mimetype is None:
+            mimetype = 'application/binary'
+    return mimetype
+
+def encode_items(formid, form_content, files):
+    """Encode form and files for use with AggregateClient.post_multipart
+
+    Arguments:
+        - formid -- id of form (used to name XML file)
+        - form_content -- XML content of form
+        - files -- sequence of ``(basename, filename, mimetype)``
+    """
+    timestamp = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())
+    form_fname = formid + '_' + timestamp + '.xml'
+
+    return [
+            (
+                'xml_submission_file',
+                form_fname,
+                form_content,
+                'text/xml'
+            )
+        ] + [
+            (
+                basename,
+                basename,
+                AttachmentFile(filename),
+                mimetype
+            ) for basename, filename, mimetype in files
+        ]
+
+
+# subset of XPath 1.0 used in "required", "constraint" and "relevant" of
+# XForms; expressions are compiled into Python functions that are called
+# with a function returning the (typed) value of a path
+XPATH_TOKEN = re.compile(r'''\s*(?:
+        (?P<number>\d+(?:\.\d*)?|\.\d+)
+        |(?P<string>'[^']*'|"[^"]*")
+        |(?P<op>!=|<=|>=|\.\.|[=<>+\-*|(),/.])
+        |(?P<name>[A-Za-z_][\w.\-]*(?::[A-Za-z_][\w.\-]*)?)
+        )''', re.X)
+
+EPOCH = datetime.date(1970, 1, 1)
+
+def parse_date(text):
+    """Returns datetime.date or datetime.datetime, None if not parseable"""
+    text = text.strip()
+    for fmt, n in (('%Y-%m-%d', 10), ('%Y-%m-%dT%H:%M:%S', 19),
+            ('%Y-%m-%d %H:%M:%S', 19)):
+        try:
+            value = datetime.datetime.strptime(text[:n], fmt)
+        except ValueError:
+            continue
+        if n == 10 and len(text) == 10:
+            return value.date()
+        if n == 19:
+            return value
+    return None
+
+def xpath_number(value):
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, float):
+        return value
+    if isinstance(value, datetime.datetime):
+        return (value - datetime.datetime(1970, 1, 1)).total_seconds() / 86400
+    if isinstance(value, datetime.date):
+        return float((value - EPOCH).days)
+    try:
+        return float(value)
+    except ValueError:
+        date = parse_date(value)
+        if date is not None:
+            return xpath_number(date)
+        return float('nan')
+
+def xpath_string(value):
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return str(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+def xpath_boolean(value):
+    if isinstance(value, float):
+        return value != 0 and value == value
+    if isinstance(value, str):
+        return value != ''
+    return bool(value)
+
+def xpath_compare(op, a, b):
+    if op in ('=', '!='):
+        if isinstance(a, bool) or isinstance(b, bool):
+            a, b = xpath_boolean(a), xpath_boolean(b)
+        elif isinstance(a, (float, datetime.date)) or isinstance(b, (float, datetime.date)):
+            a, b = xpath_number(a), xpath_number(b)
+        else:
+            a, b = xpath_string(a), xpath_string(b)
+        return (a == b) == (op == '=')
+    a, b = xpath_number(a), xpath_number(b)
+    return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[op]
+
+def xpath_arithmetic(op, a, b):
+    a, b = xpath_number(a), xpath_number(b)
+    try:
+        if op == '+':
+            return a + b
+        if op == '-':
+            return a - b
+        if op == '*':
+            return a * b
+        if op == 'div':
+            return a / b
+        return math.fmod(a, b)
+    except (ZeroDivisionError, ValueError):
+        return float('nan')
+
+def xpath_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, float):
+        if value != value:
+            return ''
+        return EPOCH + datetime.timedelta(days=int(value))
+    return parse_date(xpath_string(value)) or ''
+
+def xpath_if(condition, a, b):
+    return a if xpath_boolean(condition) else b
+
+# name -> (function, minimum arguments, maximum arguments or None)
+XPATH_FUNCTIONS = {
+    'true': (lambda: True, 0, 0),
+    'false': (lambda: False, 0, 0),
+    'not': (lambda x: not xpath_boolean(x), 1, 1),
+    'boolean': (xpath_boolean, 1, 1),
+    'number': (xpath_number, 1, 1),
+    'string': (xpath_string, 1, 1),
+    'int': (lambda x: float(int(xpath_number(x)))
+            if xpath_number(x) == xpath_number(x) else float('nan'), 1, 1),
+    'round': (lambda x, d=0.: round(xpath_number(x), int(xpath_number(d))), 1, 2),
+    'concat': (lambda *args: ''.join(map(xpath_string, args)), 0, None),
+    'string-length': (lambda x: float(len(xpath_string(x))), 1, 1),
+    'contains': (lambda a, b: xpath_string(b) in xpath_string(a), 2, 2),
+    'starts-with': (lambda a, b: xpath_string(a).startswith(xpath_string(b)), 2, 2),
+    'ends-with': (lambda a, b: xpath_string(a).endswith(xpath_string(b)), 2, 2),
+    'normalize-space': (lambda x: ' '.join(xpath_string(x).split()), 1, 1),
+    'regex': (lambda x, pattern: re.search(xpath_string(pattern),
+            xpath_string(x)) is not None, 2, 2),
+    'selected': (lambda x, choice: xpath_string(choice).strip() in
+            xpath_string(x).split(), 2, 2),
+    'count-selected': (lambda x: float(len(xpath_string(x).split())), 1, 1),
+    'coalesce': (lambda a, b: a if xpath_string(a) else b, 2, 2),
+    'if': (xpath_if, 3, 3),
+    'today': (datetime.date.today, 0, 0),
+    'now': (datetime.datetime.now, 0, 0),
+    'date': (xpath_date, 1, 1),
+}
+
+class XPathCompiler:
+    """Compiles an XPath expression of a bind into a Python function
+
+    Paths are resolved relative to the ``nodeset`` of the bind and must
+    exist in the XFormTemplate.  The returned function is called with a
+    function ``get(path)`` returning the value of a path.  Raises
+    XFormException for expressions that are not supported.
+    """
+
+    def __init__(self, expression, path, root, index):
+        """
+        Arguments:
+            - expression -- XPath expression
+            - path -- path of the context node (``.``)
+            - root -- name of the instance element (first part of
+              absolute paths)
+            - index -- XFormTemplate.index
+        """
+        self.expression = expression
+        self.path = path
+        self.root = root
+        self.index = index
+        self.tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = XPATH_TOKEN.match(expression, pos)
+            if not match:
+                self.error('unexpected "%s"' % expression[pos:])
+            pos = match.end()
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        self.pos = 0
+
+    def error(self, message):
+        raise XFormException('cannot compile "%s" : %s' % (
+                self.expression, message))
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if value is not None and token[1] != value:
+            self.error('expected "%s"' % value)
+        if token[0] is None:
+            self.error('unexpected end')
+        self.pos += 1
+        return token
+
+    def compile(self):
+        f = self.parse_or()
+        if self.pos < len(self.tokens):
+            self.error('unexpected "%s"' % self.peek()[1])
+        return f
+
+    def binary(self, parse_operand, operators, combine):
+        f = parse_operand()
+        while self.peek()[1] in operators and self.peek()[0] in ('op', 'name'):
+            op = self.take()[1]
+            g = parse_operand()
+            f = combine(op, f, g)
+        return f
+
+    def parse_or(self):
+        return self.binary(self.parse_and, ('or',), lambda op, f, g:
+                lambda get: xpath_boolean(f(get)) or xpath_boolean(g(get)))
+
+    def parse_and(self):
+        return self.binary(self.parse_equality, ('and',), lambda op, f, g:
+                lambda get: xpath_boolean(f(get)) and xpath_boolean(g(get)))
+
+    def parse_equality(self):
+        return self.binary(self.parse_relational, ('=', '!='), lambda op, f, g:
+                lambda get: xpath_compare(op, f(get), g(get)))
+
+    def parse_relational(self):
+        return self.binary(self.parse_additive, ('<', '<=', '>', '>='),
+                lambda op, f, g: lambda get: xpath_compare(op, f(get), g(get)))
+
+    def parse_additive(self):
+        return self.binary(self.parse_multiplicative, ('+', '-'),
+                lambda op, f, g: lambda get: xpath_arithmetic(op, f(get), g(get)))
+
+    def parse_multiplicative(self):
+        return self.binary(self.parse_unary, ('*', 'div', 'mod'),
+                lambda op, f, g: lambda get: xpath_arithmetic(op, f(get), g(get)))
+
+    def parse_unary(self):
+        if self.peek() == ('op', '-'):
+            self.take()
+            f = self.parse_unary()
+            return lambda get: -xpath_number(f(get))
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.peek()
+        if kind == 'number':
+            self.take()
+            number = float(value)
+            return lambda get: number
+        if kind == 'string':
+            self.take()
+            string = value[1:-1]
+            return lambda get: string
+        if value == '(':
+            self.take()
+            f = self.parse_or()
+            self.take(')')
+            return f
+        if kind == 'name' and self.peek(1) == ('op', '('):
+            return self.parse_function()
+        if kind == 'name' or value in ('/', '.', '..'):
+            path = self.parse_path()
+            return lambda get: get(path)
+        self.error('unexpected "%s"' % (value or 'end'))
+
+    def parse_function(self):
+        name = self.take()[1]
+        self.take('(')
+        args = []
+        while self.peek()[1] != ')':
+            args.append(self.parse_or())
+            if self.peek()[1] != ')':
+                self.take(',')
+        self.take(')')
+        if name not in XPATH_FUNCTIONS:
+            self.error('unsupported function "%s"' % name)
+        function, nmin, nmax = XPATH_FUNCTIONS[name]
+        if len(args) < nmin or nmax is not None and len(args) > nmax:
+            self.error('wrong number of arguments for "%s"' % name)
+        return lambda get: function(*[arg(get) for arg in args])
+
+    def parse_path(self):
+        if self.peek() == ('op', '/'):
+            self.take()
+            parts = []
+        else:
+            parts = [self.root] + self.path.split('/')
+        while True:
+            kind, value = self.take()
+            if value == '..':
+                parts = parts[:-1]
+            elif kind == 'name':
+                parts.append(value)
+            elif value != '.':
+                self.error('unexpected "%s" in path' % value)
+            if self.peek() != ('op', '/'):
+                break
+            self.take()
+        if not parts or parts[0] != self.root:
+            self.error('path outside of instance "%s"' % self.root)
+        path = '/'.join(parts[1:])
+        if path not in self.index:
+            if '-' in parts[-1]:
+                # like XPath, "a-1" is a name (NCName), not a subtraction
+                self.error('path "%s" not found (use whitespace around "-" '
+                        'to subtract)' % path)
+            self.error('path "%s" not found' % path)
+        return path
+
+
+def compile_xpath(expression, path, root, index):
+    """Compiles XPath expression of bind, see XPathCompiler"""
+    return XPathCompiler(expression, path, root, index).compile()
+
+
+def check_geopoint(value):
+    parts = value.split()
+    if not 2 <= len(parts) <= 4:
+        return False
+    try:
+        [float(part) for part in parts]
+        return True
+    except ValueError:
+        return False
+
+# bind type -> function returning True if a (non empty) value is valid
+TYPE_CHECKS = {
+    'int': re.compile(r'^\s*[-+]?\d+\s*$').match,
+    'integer': re.compile(r'^\s*[-+]?\d+\s*$').match,
+    'decimal': lambda value: xpath_number(value) == xpath_number(value)
+            and parse_date(value) is None,
+    'date': lambda value: isinstance(parse_date(value), datetime.date)
+            and not isinstance(parse_date(value), datetime.datetime),
+    'dateTime': lambda value: parse_date(value) is not None,
+    'time': re.compile(r'^\d\d:\d\d(:\d\d(\.\d+)?)?(Z|[-+]\d\d(:?\d\d)?)?$').match,
+    'geopoint': check_geopoint,
+}
+
+
+class XFormBind:
+    """Compiled ``<bind>`` of a XForm (see XFormTemplate.validate())"""
+
+    __slots__ = ('path', 'ordinal', 'type', 'leaf', 'required', 'constraint',
+            'constraint_msg', 'relevant', 'relevants', 'choices')
+
+    def __init__(self, path, ordinal, type_, leaf):
+        self.path = path
+        self.ordinal = ordinal
+        self.type = type_
+        self.leaf = leaf
+        # compiled expressions (None if not specified)
+        self.required = self.constraint = self.relevant = None
+        self.constraint_msg = None
+        # (path, relevant) of this bind and its ancestors
+        self.relevants = []
+        # allowed values of select/select1, None if unknown
+        self.choices = None
+
+    def __repr__(self):
+        return '<XFormBind %s>' % self.path
+
+
+class XFormTemplate:
+    """XForm that is parsed once and then filled in many times
+
+    Parses the XForm and precomputes the stripped instance skeleton and
+    an index of the paths (every path has an ordinal number).  Use new()
+    to create lightweight XFormInstance objects that only store the
+    values filled in.
+
+    The skeleton is compiled into a sequence of operations that
+    write_xml() executes to generate the XML without building a DOM.
+    The ``<bind>`` elements are compiled into XFormBind objects that
+    validate() uses to check values without sending them to the server.
+    """
+
+    # operations in .ops : (LITERAL, text, None, None),
+    # (LEAF, start tag, ordinal, end tag), (CLOSE, None, ordinal, end tag)
+    LITERAL, LEAF, CLOSE = range(3)
+
+    def __init__(self, xml):
+        """Initializes from a XML string
+
+        Arguments:
+            - xml -- file content of an XForm XML file
+        """
+        try:
+            self.document = parseString(xml)
+        except ExpatError as e:
+            raise XFormException('could not parse XML : ' + str(e))
+
+        instance = self.get_path(('h:html', 'h:head', 'model', 'instance'))
+        forms = [child for child in instance.childNodes
+                if child.nodeType == self.document.ELEMENT_NODE]
+        if len(forms) != 1:
+            raise XFormException('no unique form instance found')
+
+        self.template = forms[0]
+        self.name = self.template.nodeName
+        formid = self.template.attributes.get('id')
+        if not formid:
+            raise XFormException('instance %s has no id attribute' % self.name)
+        self.formid = formid.value
+
+        # .paths[ordinal] == path and .index[path] == ordinal
+        self.paths = []
+        self.index = {}
+        # ordinals of skeleton elements in document order
+        self.ordinals = []
+        self.skeleton = self.template.cloneNode(deep=True)
+        self.add_paths(self.skeleton, tuple())
+
+        # lower case path -> path, lower case leaf name -> [path, ...]
+        self.lower_index = {}
+        self.leaf_index = {}
+        for path in self.paths:
+            self.lower_index.setdefault(path.lower(), path)
+            leaf = path[path.rfind('/') + 1:].lower()
+            self.leaf_index.setdefault(leaf, []).append(path)
+
+        self.ops = []
+        self.compile(self.skeleton, iter(self.ordinals))
+
+        # path -> XFormBind
+        self.binds = {}
+        self.compile_binds()
+        # ordinals of date/dateTime values (typed for XPath comparisons)
+        self.date_ordinals = set(bind.ordinal for bind in self.binds.values()
+                if bind.type in ('date', 'dateTime'))
+
+        lo.debug('loaded XForm %s "%s" : %d paths, %d binds' % (
+            self.name, self.formid, len(self.paths), len(self.binds)))
+
+    def add_paths(self, element, path):
+        if path:
+            # remove all attributes apart from root element (has "id")
+            for name in list(element.attributes.keys()):
+                element.removeAttribute(name)
+            name = '/'.join(path)
+            if name not in self.index:
+                self.index[name] = len(self.paths)
+                self.paths.append(name)
+            self.ordinals.append(self.index[name])
+        else:
+            self.ordinals.append(None)
+        for child in element.childNodes:
+            if child.nodeType == self.document.ELEMENT_NODE:
+                self.add_paths(child, path + (child.nodeName,))
+
+    def get_path(self, path):
+        node = self.document
+        for element in path:
+            candidates = [child for child in node.childNodes
+                    if child.nodeName == element]
+            if len(candidates) == 0:
+                raise XFormException('path "%s" (element "%s") not found' % (
+                        str(path), element))
+            if len(candidates) > 1:
+                raise XFormException('path "%s" (element "%s") not unique' % (
+                        str(path), element))
+            node = candidates[0]
+        return node
+
+    def compile_binds(self):
+        model = self.get_path(('h:html', 'h:head', 'model'))
+        leaves = set(ordinal for op, text, ordinal, tail in self.ops
+                if op == self.LEAF)
+        prefix = '/' + self.name + '/'
+
+        for element in model.getElementsByTagName('bind'):
+            nodeset = element.getAttribute('nodeset')
+            path = nodeset[len(prefix):]
+            if not nodeset.startswith(prefix) or path not in self.index:
+                lo.warning('form "%s" : ignoring bind of unknown nodeset "%s"'
+                        % (self.formid, nodeset))
+                continue
+            type_ = element.getAttribute('type')
+            ordinal = self.index[path]
+            bind = XFormBind(path, ordinal, type_[type_.find(':') + 1:],
+                    ordinal in leaves)
+
+            for name in ('required', 'constraint', 'relevant'):
+                expression = element.getAttribute(name)
+                if not expression or expression == 'false()':
+                    continue
+                try:
+                    setattr(bind, name, compile_xpath(
+                            expression, path, self.name, self.index))
+                except XFormException as e:
+                    # rather accept invalid data than reject valid data
+                    lo.warning('form "%s" : ignoring %s of "%s" : %s' % (
+                            self.formid, name, path, e))
+            bind.constraint_msg = (element.getAttribute('jr:constraintMsg') or
+                    'does not satisfy constraint "%s"' %
+                    element.getAttribute('constraint'))
+            self.binds[path] = bind
+
+        for path, bind in self.binds.items():
+            parts = path.split('/')
+            for i in range(len(parts)):
+                ancestor = self.binds.get('/'.join(parts[:i + 1]))
+                if ancestor is not None and ancestor.relevant is not None:
+                    bind.relevants.append((ancestor.path, ancestor.relevant))
+
+        # choices of select/select1 (not for choices from an itemset)
+        for tag in ('select1', 'select'):
+            for element in self.document.getElementsByTagName(tag):
+                bind = self.binds.get(element.getAttribute('ref')[len(prefix):])
+                choices = set(
+                        ''.join(text.data for text in value.childNodes
+                            if text.nodeType == self.document.TEXT_NODE).strip()
+                        for item in element.childNodes if item.nodeName == 'item'
+                        for value in item.childNodes if value.nodeName == 'value')
+                if bind is not None and choices:
+                    bind.choices = choices
+
+    def find_path(self, name):
+        """Find path matching a column name (e.g. from .csv or SQL)
+
+        Tries an exact match first, then a case insensitive match and
+        finally a case insensitive match of the last path part (if it is
+        unique within the form).  Returns None if no path matches.
+        """
+        if name in self.index:
+            return name
+        lower = name.lower()
+        if lower in self.lower_index:
+            return self.lower_index[lower]
+        paths = self.leaf_index.get(lower, ())
+        if len(paths) == 1:
+            return paths[0]
+        return None
+
+    def get_ordinal(self, name):
+        """Returns ordinal of path, raises XFormException if not found"""
+        try:
+            return self.index[name]
+        except KeyError:
+            raise XFormException('path "%s" not found in form "%s"' % (
+                name, self.name))
+
+    def new(self):
+        """Returns a new (empty) XFormInstance"""
+        return XFormInstance(self)
+
+    def validate(self, values):
+        """Checks values against the binds of the form
+
+        Fields that are not relevant are not checked.  Empty fields are
+        rejected if they are required; other values must match the type
+        of the field, one of the choices of a select/select1 and the
+        constraint.  Expressions that cannot be evaluated do not reject.
+        Elements with default text (or children) in the instance are only
+        checked if a value is set.
+
+        Arguments:
+            - values -- sequence of values (str or None) indexed by ordinal
+
+        Returns list of error messages (empty if values are valid)
+        """
+        def get(path):
+            ordinal = self.index[path]
+            value = values[ordinal]
+            if value is None:
+                return ''
+            if ordinal in self.date_ordinals:
+                date = parse_date(value)
+                if date is not None:
+                    return date
+            return value
+
+        def evaluate(f, default):
+            try:
+                return xpath_boolean(f(get))
+            except Exception as e:
+                # e.g. invalid regular expression
+                lo.debug('cannot evaluate bind : ' + str(e))
+                return default
+
+        relevant = {}
+        def is_relevant(bind):
+            for path, f in bind.relevants:
+                if path not in relevant:
+                    relevant[path] = evaluate(f, True)
+                if not relevant[path]:
+                    return False
+            return True
+
+        errors = []
+        for bind in self.binds.values():
+            value = values[bind.ordinal]
+            if not bind.leaf and value is None or not is_relevant(bind):
+                continue
+            if not value:
+                if bind.required is not None and evaluate(bind.required, False):
+                    errors.append('"%s" is required' % bind.path)
+                continue
+            check = TYPE_CHECKS.get(bind.type)
+            if check is not None and not check(value):
+                errors.append('"%s" : "%s" is not a valid %s' % (
+                        bind.path, value, bind.type))
+                continue
+            if bind.choices is not None:
+                choices = bind.type == 'select' and value.split() or [value]
+                if not bind.choices.issuperset(choices):
+                    errors.append('"%s" : "%s" is not a valid choice' % (
+                            bind.path, value))
+                    continue
+            if bind.constraint is not None and not evaluate(bind.constraint, True):
+                errors.append('"%s" : %s' % (bind.path, bind.constraint_msg))
+        return errors
+
+    def add_op(self, op, text=None, ordinal=None, tail=None):
+        # merge consecutive literals
+        if op == self.LITERAL and self.ops and self.ops[-1][0] == self.LITERAL:
+            self.ops[-1] = (op, self.ops[-1][1] + text, None, None)
+        else:
+            self.ops.append((op, text, ordinal, tail))
+
+    def compile(self, element, ordinals):
+        ordinal = next(ordinals)
+        # let minidom render start tag (with attributes of root element)
+        head = element.cloneNode(deep=False).toxml()[:-2]
+        tail = '</%s>' % element.tagName
+
+        if not element.childNodes:
+            if ordinal is None:
+                self.add_op(self.LITERAL, head + '/>')
+            else:
+                self.add_op(self.LEAF, head, ordinal, tail)
+            return
+
+        self.add_op(self.LITERAL, head + '>')
+        for child in element.childNodes:
+            if child.nodeType == self.document.ELEMENT_NODE:
+                self.compile(child, ordinals)
+            else:
+                self.add_op(self.LITERAL, child.toxml())
+        if ordinal is None:
+            self.add_op(self.LITERAL, tail)
+        else:
+            self.add_op(self.CLOSE, None, ordinal, tail)
+
+    def write_xml(self, values, write):
+        """Write form content as XML
+
+        Generates exactly the same output as filling the values into a
+        copy of the DOM and serializing it with minidom.
+
+        Arguments:
+            - values -- sequence of values (str or None) indexed by ordinal
+            - write -- called with every piece of XML (e.g. the method
+              ``write`` of a io.StringIO)
+        """
+        write('<?xml version="1.0" ?>')
+        for op, text, ordinal, tail in self.ops:
+            if op == self.LITERAL:
+                write(text)
+            elif op == self.LEAF:
+                value = values[ordinal]
+                if value is None:
+                    write(text + '/>')
+                else:
+                    write(text + '>' + escape_text(value) + tail)
+            else:
+                value = values[ordinal]
+                if value is not None:
+                    write(escape_text(value))
+                write(tail)
+
+    def xml(self, values):
+        """Dump form content as XML
+
+        Arguments:
+            - values -- sequence of values (str or None) indexed by ordinal
+        """
+        parts = []
+        self.write_xml(values, parts.append)
+        return ''.join(parts)
+
+
+class XFormInstance:
+    """Values and files filled into an XFormTemplate
+
+    Has the same interface for filling in values and generating the data
+    to be sent as XForm, but only stores the values (indexed by the path
+    ordinals of the template).
+    """
+
+    __slots__ = ('xform_template', 'values', 'files')
+
+    def __init__(self, xform_template):
+        self.xform_template = xform_template
+        self.clear()
+
+    @property
+    def name(self):
+        return self.xform_template.name
+
+    @property
+    def formid(self):
+        return self.xform_template.formid
+
+    @property
+    def paths(self):
+        return self.xform_template.paths
+
+    def find_path(self, name):
+        """See XFormTemplate.find_path()"""
+        return self.xform_template.find_path(name)
+
+    def clear(self):
+        self.values = [None] * len(self.xform_template.paths)
+        # ordinal -> (filename, mimetype)
+        self.files = {}
+        self['meta/instanceID'] = 'uuid:' + str(uuid.uuid4())
+
+    def __setitem__(self, name, value):
+        """Set value of a XForm field (see XForm.__setitem__)"""
+        ordinal = self.xform_template.get_ordinal(name)
+        value = convert_value(value)
+        if value is None:
+            return
+        self.values[ordinal] = value
+
+    def __getitem__(self, name):
+        return self.values[self.xform_template.get_ordinal(name)]
+
+    def set_file(self, name, filename, mimetype=None):
+        """Set value of a XForm "file type" field (see XForm.set_file)"""
+        self[name] = os.path.basename(filename)
+        self.files[self.xform_template.get_ordinal(name)] = (
+                filename, guess_mimetype(filename, mimetype))
+
+    def validate(self):
+        """Returns errors of values (see XFormTemplate.validate())"""
+        return self.xform_template.validate(self.values)
+
+    def xml(self):
+        """Dump form content as XML"""
+        return self.xform_template.xml(self.values)
 
     def get_items(self):
         """Encode form and files for use with AggregateClient.post_multipart"""
-        form_content = self.xml()
-        timestamp = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())
-        form_fname = self.formid + '_' + timestamp + '.xml'
-
-        return [
-                (
-                    'xml_submission_file',
-                    form_fname,
-                    form_content,
-                    'text/xml'
-                )
-            ] + [
-                (
-                    self.items[name],
-                    self.items[name],
-                    io.open(filename, 'rb').read(),
-                    self.mimetypes[name]
-                ) for name, filename in self.filenames.items()
-            ]
+        return encode_items(self.formid, self.xml(), [
+                (self.values[ordinal], filename, mimetype)
+                for ordinal, (filename, mimetype) in self.files.items()])
+
+
+class XForm:
+    """Simple XForm parser for use with AggregateClient
+
+    Only a small part of the XForm standard is implemented that
+    is sufficient to parse XForms, fill in some values and generate
+    the data to be sent via AggregateClient.  Use XFormTemplate when
+    filling in the same form many times.
+    """
+
+    def __init__(self, xml):
+        """Initializes from a XML string
+
+        Arguments:
+            - xml -- file content of an XForm XML file (or XFormTemplate,
+              e.g. from FormCache.template())
+        """
+        if isinstance(xml, XFormTemplate):
+            self.xform_template = xml
+        else:
+            self.xform_template = XFormTemplate(xml)
+
+        self.document = self.xform_template.document
+        self.template = self.xform_template.template
+        self.name = self.xform_template.name
+        self.formid = self.xform_template.formid
+        self.paths = self.xform_template.paths
+
+        self.clear()
+
+    def find_path(self, name):
+        """See XFormTemplate.find_path()"""
+        return self.xform_template.find_path(name)
+
+    def clear(self):
+        self.items = {}
+        self.filenames = {}
+        self.mimetypes = {}
+        self['meta/instanceID'] = 'uuid:' + str(uuid.uuid4())
+
+    def __setitem__(self, name, value):
+        """Set value of a XForm field
+
+        Raises XFormException if no field with given name can be found
+        in this form.
+
+        Arguments
+            - name -- name of field, path parts separated by '/'
+            - value -- value; int, float, date, time, and datetime will be
+              converted to string; None will forestall the sending of
+              this path
+        """
+        if not name in self.xform_template.index:
+            raise XFormException('path "%s" not found in form "%s"' % (
+                name, self.name))
+
+        value = convert_value(value)
+        if value is None:
+            return
+
+        self.items[name] = value
+        lo.debug('setting %s[%s] = %s' % (self.formid, name, value))
+
+    def set_file(self, name, filename, mimetype=None):
+        """Set value of a XForm "file type" field
+
+        Raises XFormException if no field with given name can be found
+        in this form.
+
+        Arguments:
+            - name -- name of field, path parts separated by '/'
+            - filename -- name of file to be sent as value of field
+            - mimetype (optional) -- will be used as the file's
+              "Content-Type"
+        """
+        mimetype = guess_mimetype(filename, mimetype)
+
+        self[name] = os.path.basename(filename)
+        self.filenames[name] = filename
+        self.mimetypes[name] = mimetype
+        lo.debug('(mimetype %s)' % mimetype)
+
+    def validate(self):
+        """Returns errors of values (see XFormTemplate.validate())"""
+        return self.xform_template.validate([
+                self.items.get(path) for path in self.paths])
+
+    def xml(self):
+        """Dump form content as XML"""
+        return self.xform_template.xml([
+                self.items.get(path) for path in self.paths])
+
+    def get_items(self):
+        """Encode form and files for use with AggregateClient.post_multipart"""
+        return encode_items(self.formid, self.xml(), [
+                (self.items[name], filename, self.mimetypes[name])
+                for name, filename in self.filenames.items()])
+
+
+### form download {{{1
+
+def parse_form_list(xml):
+    """Parses OpenRosa formList
+
+    Return value: dictionary form ID -> dictionary with keys ``name``,
+    ``version``, ``hash`` and ``downloadUrl`` (missing values are None)
+    """
+    try:
+        document = parseString(xml)
+    except ExpatError as e:
+        raise AggregateException('could not parse formList : ' + str(e))
+
+    def text(element, name):
+        for child in element.getElementsByTagName(name):
+            return ''.join(node.data for node in child.childNodes
+                    if node.nodeType == node.TEXT_NODE).strip() or None
+
+    forms = {}
+    for element in document.getElementsByTagName('xform'):
+        formid = text(element, 'formID')
+        if formid is None or text(element, 'downloadUrl') is None:
+            continue
+        forms[formid] = {key: text(element, key)
+                for key in ('name', 'version', 'hash', 'downloadUrl')}
+    return forms
+
+
+def hash_matches(content, hash_value):
+    """Checks bytes against formList hash (e.g. ``md5:7c6b...``)"""
+    algorithm, _, digest = hash_value.partition(':')
+    if algorithm not in hashlib.algorithms_available:
+        return False
+    return hashlib.new(algorithm, content).hexdigest() == digest.lower()
+
+
+class FormCache:
+    """Local copies of XForms downloaded from the server
+
+    The directory contains a ``<formID>.xml`` for every form and the file
+    ``index.json`` with the last formList and the validators (``ETag``,
+    ``Last-Modified``) of every download.  Use
+    AggregateClient.fetch_forms() to update the cache and xml() or
+    template() to load a cached form (e.g. ``XForm(cache.template(id))``).
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.templates = {}
+        try:
+            with io.open(os.path.join(directory, self.INDEX)) as fd:
+                self.index = json.load(fd)
+        except (IOError, ValueError):
+            self.index = {}
+        self.index.setdefault('formList', {})
+        self.index.setdefault('forms', {})
+
+    def path(self, formid):
+        return os.path.join(self.directory, formid + '.xml')
+
+    @property
+    def form_list(self):
+        return self.index['formList'].get('forms', {})
+
+    def write(self, name, content):
+        """Replaces file atomically"""
+        path = os.path.join(self.directory, name)
+        with io.open(path + '.tmp', 'wb') as fd:
+            fd.write(content)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(path + '.tmp', path)
+
+    def save_index(self):
+        self.write(self.INDEX, json.dumps(self.index, indent=2).encode('utf8'))
+
+    def conditional_headers(self, formid=None):
+        """Returns headers for revalidating formList or form ``formid``"""
+        if formid is None:
+            entry = self.index['formList']
+        else:
+            entry = self.index['forms'].get(formid, {})
+            if not os.path.isfile(self.path(formid)):
+                return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def set_form_list(self, forms, etag=None, last_modified=None):
+        self.index['formList'] = {
+                'forms': forms,
+                'etag': etag,
+                'last_modified': last_modified,
+            }
+        self.save_index()
+
+    def matches(self, formid, hash_value):
+        """Checks whether the cached copy of ``formid`` has given hash"""
+        try:
+            with io.open(self.path(formid), 'rb') as fd:
+                return hash_matches(fd.read(), hash_value)
+        except IOError:
+            return False
+
+    def store(self, formid, content, etag=None, last_modified=None):
+        self.write(formid + '.xml', content)
+        self.index['forms'][formid] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'md5': hashlib.md5(content).hexdigest(),
+            }
+        self.save_index()
+        self.templates.pop(formid, None)
+
+    def xml(self, formid):
+        """Returns cached XForm as string"""
+        try:
+            with io.open(self.path(formid), encoding='utf8') as fd:
+                return fd.read()
+        except IOError:
+            raise AggregateFormNotFoundException(
+                    'form "%s" not found in cache "%s"' % (
+                        formid, self.directory))
+
+    def template(self, formid):
+        """Returns XFormTemplate of cached XForm"""
+        if formid not in self.templates:
+            self.templates[formid] = XFormTemplate(self.xml(formid))
+        return self.templates[formid]
+
+    def refresh(self, client, user=None, password=None, formids=None):
+        """Connects client and updates cache, keeping cached forms if the
+        server cannot be reached
+
+        Returns True if the cache was revalidated with the server.
+        """
+        connected = False
+        try:
+            client.connect(user, password)
+            connected = True
+            client.fetch_forms(self, formids)
+            return True
+        except AggregateFormNotFoundException:
+            raise
+        except (AggregateException, OSError, http.client.HTTPException) as e:
+            lo.warning('could not update forms from server (using cached '
+                    'copies) : ' + str(e))
+            return False
+        finally:
+            if connected:
+                client.close()
+
+
+### bulk posting {{{1
+
+class Journal:
+    """Checkpoint journal of submissions posted in bulk
+
+    Every submission is recorded twice in a text file : a line
+    ``P <instanceID> <key>`` is appended before it is posted and a line
+    ``D <instanceID> <key>`` after the server accepted it.  When a run is
+    resumed, rows that are done can be skipped, and rows that were
+    pending are posted again with the same instanceID, so the server
+    does not create duplicates.
+    """
+
+    # number of accepted submissions between fsync() calls
+    sync_every = 100
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.done = set()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.unsynced = 0
+
+        if os.path.exists(filename):
+            with io.open(filename, encoding='utf8') as fd:
+                for line in fd:
+                    try:
+                        state, instance_id, key = line.rstrip('\n').split('\t')
+                        key = json.loads(key)
+                    except ValueError:
+                        # torn line written while crashing
+                        lo.warning('ignoring journal line "%s"' % line.strip())
+                        continue
+                    if state == 'D':
+                        self.done.add(key)
+                        self.pending.pop(key, None)
+                    else:
+                        self.pending[key] = instance_id
+            lo.info('resuming from journal "%s" : %d done, %d pending' % (
+                    filename, len(self.done), len(self.pending)))
+
+        self.fd = io.open(filename, 'a', encoding='utf8')
+
+    def write(self, state, instance_id, key):
+        with self.lock:
+            self.fd.write('%s\t%s\t%s\n' % (state, instance_id, json.dumps(key)))
+            self.fd.flush()
+            if state == 'D':
+                self.unsynced += 1
+                if self.unsynced >= self.sync_every:
+                    os.fsync(self.fd.fileno())
+                    self.unsynced = 0
+
+    def begin(self, key, instance_id):
+        """Record that submission identified by key is about to be posted"""
+        self.pending[key] = instance_id
+        self.write('P', instance_id, key)
+
+    def commit(self, key, instance_id):
+        """Record that submission identified by key was accepted"""
+        self.write('D', instance_id, key)
+        self.pending.pop(key, None)
+        self.done.add(key)
+
+    def close(self):
+        with self.lock:
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+            self.fd.close()
+
+
+def read_jsonl(fd, key=None):
+    """Reads JSON lines records for BulkPoster
+
+    Every line holds a JSON object, either ``{"values": {NAME: VALUE},
+    "files": {NAME: PATH}}`` (both optional) or directly ``{NAME: VALUE}``.
+    Empty lines are skipped.  Lines are read as they arrive (``fd`` can be
+    a pipe); invalid lines are generated as ValueError (see fill_record()).
+
+    Arguments:
+        - fd -- text stream to read from
+        - key (optional) -- name of value that identifies the record
+          (default: line number)
+
+    Generates tuples ``(key, record)``
+    """
+    for n, line in enumerate(fd):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('expected JSON object')
+        except ValueError as e:
+            yield n + 1, ValueError('line %d : invalid record : %s' % (
+                    n + 1, e))
+            continue
+        if key:
+            values = record.get('values', record)
+            yield str(values.get(key, n + 1)), record
+        else:
+            yield n + 1, record
+
+
+def fill_record(xform_template, record):
+    """Returns XFormInstance filled in with record from read_jsonl()"""
+    if isinstance(record, Exception):
+        raise record
+    form = xform_template.new()
+    if 'values' in record or 'files' in record:
+        values = record.get('values', {})
+        files = record.get('files', {})
+    else:
+        values = record
+        files = {}
+    for name, value in values.items():
+        path = xform_template.find_path(name)
+        if path is None:
+            raise XFormException('field "%s" not found' % name)
+        form[path] = value
+    for name, filename in files.items():
+        path = xform_template.find_path(name)
+        if path is None:
+            raise XFormException('field "%s" not found' % name)
+        if not os.path.isfile(filename):
+            raise XFormException('file "%s" not found' % filename)
+        form.set_file(path, filename)
+    return form
+
+
+# XFormTemplate of EncodingPool worker process
+encoder_template = None
+
+def init_encoder(xml):
+    global encoder_template
+    encoder_template = XFormTemplate(xml)
+
+def encode_records(records, validate):
+    """Fills in and encodes records in EncodingPool worker process
+
+    Returns ``(instanceID, MultipartBody)`` or exception for every
+    ``(record, instance_id)`` (see EncodingPool.encode())
+    """
+    results = []
+    for record, instance_id in records:
+        try:
+            form = fill_record(encoder_template, record)
+            if instance_id:
+                form['meta/instanceID'] = instance_id
+            errors = validate and form.validate()
+            if errors:
+                raise XFormException('; '.join(errors))
+            results.append((form['meta/instanceID'],
+                    MultipartBody(form.get_items())))
+        except Exception as e:
+            # exceptions must be pickled to be sent back
+            results.append(XFormException(str(e)))
+    return results
+
+def validate_records(records):
+    """Returns errors for every record in EncodingPool worker process"""
+    results = []
+    for record, instance_id in records:
+        try:
+            results.append(fill_record(encoder_template, record).validate())
+        except Exception as e:
+            results.append([str(e)])
+    return results
+
+
+class EncodingPool:
+    """Fills in and encodes forms in a pool of worker processes
+
+    Filling in values, generating the XML and encoding the multipart body
+    of wide forms takes more CPU time than sending them.  Every worker
+    parses the XForm once and turns records (see fill_record()) into
+    ready to send MultipartBody objects (attachments are only referenced
+    and streamed from disk when the body is sent).  Records are sent to
+    the workers in chunks; the results are returned in the original
+    order.
+
+    Use as context manager or call close().
+    """
+
+    def __init__(self, xform_template, processes=None, validate=False,
+            chunksize=16):
+        """
+        Arguments:
+            - xform_template -- XFormTemplate of the records
+            - processes (optional) -- number of worker processes (default:
+              number of CPUs)
+            - validate (optional) -- check forms against binds of XForm
+              before they are encoded (see XFormTemplate.validate())
+            - chunksize (optional) -- number of records per task
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.validate = validate
+        self.chunksize = chunksize
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.processes, initializer=init_encoder,
+                initargs=(xform_template.document.toxml(),))
+
+    def map(self, function, items, *args):
+        """Generates ``(item, result)`` in order of ``items``
+
+        ``items`` generates ``(item, record, instance_id)``; at most two
+        chunks per worker are processed ahead of the consumer.
+        """
+        pending = collections.deque()
+        chunk = []
+
+        def submit():
+            pending.append(([item for item, record, instance_id in chunk],
+                    self.executor.submit(function, [
+                        (record, instance_id)
+                        for item, record, instance_id in chunk], *args)))
+
+        for item, record, instance_id in items:
+            chunk.append((item, record, instance_id))
+            if len(chunk) >= self.chunksize:
+                submit()
+                chunk = []
+            while len(pending) > 2 * self.processes:
+                chunk_items, future = pending.popleft()
+                yield from zip(chunk_items, future.result())
+        if chunk:
+            submit()
+        while pending:
+            chunk_items, future = pending.popleft()
+            yield from zip(chunk_items, future.result())
+
+    def encode(self, items):
+        """Fills in and encodes records
+
+        Arguments:
+            - items -- iterable of ``(item, record, instance_id)`` where
+              ``item`` is returned with the result, ``record`` is a record
+              for fill_record() and ``instance_id`` (if not None) overrides
+              the generated ``meta/instanceID``
+
+        Generates ``(item, (instance_id, MultipartBody))`` or ``(item,
+        exception)`` in order of ``items``
+        """
+        return self.map(encode_records, items, self.validate)
+
+    def check(self, items):
+        """Generates ``(item, errors)`` (see encode() and validate())"""
+        return self.map(validate_records, items)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BulkPoster:
+    """Posts forms filled from many rows of data with AsyncAggregateClient
+
+    Failing rows are reported and do not stop the run; with a Journal,
+    a run can be interrupted and resumed without posting rows twice.
+    """
+
+    def __init__(self, client, fill, journal=None, report=None, label='',
+            progress=None, validate=False, encoder=None):
+        """
+        Arguments:
+            - client -- AsyncAggregateClient (or
+              AsyncBalancedAggregateClient) used for posting (can be None
+              if only check() is used)
+            - fill -- function creating XFormInstance from a row; any
+              exception raised is reported as error of that row
+            - journal (optional) -- Journal to skip rows already posted
+            - report (optional) -- function called with ``(row, error)``
+              for every row that could not be posted
+            - label (optional) -- name of form for log messages
+            - progress (optional) -- stream (e.g. ``sys.stderr``) on which
+              a progress line is updated; successfully posted rows are then
+              only logged with debug level
+            - validate (optional) -- check every form against the binds
+              of the XForm before it is posted (see also check())
+            - encoder (optional) -- EncodingPool that fills in and encodes
+              the forms in worker processes; ``fill`` must then return a
+              record for fill_record() instead of a XFormInstance
+        """
+        self.client = client
+        self.fill = fill
+        self.journal = journal
+        self.report = report
+        self.label = label
+        self.progress = progress
+        self.validate = validate
+        self.encoder = encoder
+
+        self.posted = self.skipped = self.failed = self.size = 0
+        # keys of rows rejected by check()
+        self.rejected = set()
+        self.t0 = self.progress_shown = time.time()
+        self.inflight = {}
+        # submissions() runs in executor thread
+        self.lock = threading.Lock()
+
+    def fail(self, key, row, error, message='could not post form'):
+        lo.error('%s %s, "%s" : %s', message, self.label, key, error)
+        with self.lock:
+            self.failed += 1
+            if self.report:
+                self.report(row, error)
+        self.show_progress()
+
+    def show_progress(self, final=False):
+        """Updates progress line (at most twice per second)"""
+        if self.progress is None:
+            return
+        with self.lock:
+            now = time.time()
+            if not final and now - self.progress_shown < .5:
+                return
+            self.progress_shown = now
+            dt = max(now - self.t0, 1e-6)
+            self.progress.write('\r%d posted, %d skipped, %d failed : '
+                    '%.1f forms/s, %.1f kB/s ' % (
+                        self.posted, self.skipped, self.failed,
+                        self.posted / dt, self.size / dt / 1024))
+            if final:
+                self.progress.write('\n')
+            self.progress.flush()
+
+    def submissions(self, rows):
+        """Generates ``(key, items)`` for submit_many() from ``(key, row)``"""
+        if self.encoder is not None:
+            yield from self.encoded_submissions(rows)
+            return
+        for key, row in rows:
+            if self.journal and key in self.journal.done:
+                self.skipped += 1
+                continue
+            if key in self.rejected:
+                continue
+            if key in self.inflight:
+                self.fail(key, row, 'duplicate key')
+                continue
+            try:
+                form = self.fill(row)
+                if self.validate:
+                    errors = form.validate()
+                    if errors:
+                        raise XFormException('; '.join(errors))
+                if self.journal and key in self.journal.pending:
+                    form['meta/instanceID'] = self.journal.pending[key]
+                items = form.get_items()
+            except Exception as e:
+                # e.g. XFormException, IOError, or missing columns
+                self.fail(key, row, e)
+                continue
+            instance_id = form['meta/instanceID']
+            self.inflight[key] = (row, instance_id)
+            if self.journal:
+                self.journal.begin(key, instance_id)
+            yield key, items
+
+    def records(self, rows):
+        """Generates ``((key, row), record, instance_id)`` for encoder"""
+        for key, row in rows:
+            if self.journal and key in self.journal.done:
+                self.skipped += 1
+                continue
+            if key in self.rejected:
+                continue
+            try:
+                record = self.fill(row)
+            except Exception as e:
+                self.rejected.add(key)
+                self.fail(key, row, e)
+                continue
+            yield (key, row), record, self.journal and self.journal.pending.get(key)
+
+    def encoded_submissions(self, rows):
+        """Generates ``(key, MultipartBody)`` encoded by ``encoder``"""
+        for (key, row), result in self.encoder.encode(self.records(rows)):
+            if isinstance(result, Exception):
+                self.fail(key, row, result)
+                continue
+            if key in self.inflight:
+                self.fail(key, row, 'duplicate key')
+                continue
+            instance_id, body = result
+            self.inflight[key] = (row, instance_id)
+            if self.journal:
+                self.journal.begin(key, instance_id)
+            yield key, body
+
+    def posted_cb(self, result):
+        row, instance_id = self.inflight.pop(result.key)
+        if not result.ok:
+            self.fail(result.key, row, result.error)
+            return
+        self.posted += 1
+        self.size += result.size or 0
+        if self.journal:
+            self.journal.commit(result.key, instance_id)
+        if self.progress is None:
+            lo.info('successfully posted form %s, "%s"', self.label, result.key)
+        else:
+            lo.debug('successfully posted form %s, "%s"', self.label, result.key)
+            self.show_progress()
+
+    def validated(self, rows):
+        """Generates ``((key, row), errors)``"""
+        for key, row in rows:
+            if self.journal and key in self.journal.done:
+                continue
+            try:
+                errors = self.fill(row).validate()
+            except Exception as e:
+                errors = [str(e)]
+            yield (key, row), errors
+
+    def check(self, rows):
+        """Validate all rows before anything is posted
+
+        Rows that cannot be filled in or fail the validation against the
+        binds of the XForm (see XFormTemplate.validate()) are reported and
+        will be skipped by run().  No request is sent to the server.
+
+        Arguments:
+            - rows -- iterable of ``(key, row)`` (see run())
+
+        Returns number of rejected rows
+        """
+        t0 = time.time()
+        n = 0
+        if self.encoder is not None:
+            results = self.encoder.check(self.records(rows))
+        else:
+            results = self.validated(rows)
+        for (key, row), errors in results:
+            n += 1
+            if errors:
+                self.rejected.add(key)
+                self.fail(key, row, '; '.join(errors), 'invalid form')
+        # rows are read again by run()
+        self.skipped = 0
+        lo.info('validated %d forms %s in %.1fs : %d rejected' % (
+                n, self.label, time.time() - t0, len(self.rejected)))
+        return len(self.rejected)
+
+    def run(self, rows, user=None, password=None):
+        """Post all rows, returns number of rows that failed
+
+        Arguments:
+            - rows -- iterable of ``(key, row)`` where ``key`` identifies
+              the row in the journal and in log messages
+            - user, password (optional) -- credentials for connect()
+        """
+        t0 = self.t0 = time.time()
+        try:
+            post_many(self.client, self.submissions(rows), user, password,
+                    callback=self.posted_cb)
+        finally:
+            if self.journal:
+                self.journal.close()
+            self.show_progress(final=True)
+            dt = max(time.time() - t0, 1e-6)
+            lo.info('posted %d forms (%d skipped, %d failed) in %.1fs : '
+                    '%.1f forms/s, %.1f kB/s' % (
+                    self.posted, self.skipped, self.failed, dt,
+                    self.posted / dt, self.size / dt / 1024))
+        return self.failed
+
+
+### outbox {{{1
+
+class OutboxEntry:
+    """Submission stored in an Outbox"""
+
+    def __init__(self, outbox, name, meta):
+        self.outbox = outbox
+        self.name = name
+        self.key = meta['key']
+        self.instance_id = meta['instance_id']
+        self.content_type = meta['content_type']
+        self.length = meta['length']
+        # failed posts (since the outbox was opened)
+        self.attempts = 0
+
+    def path(self, extension):
+        return os.path.join(self.outbox.directory, self.name + extension)
+
+    @property
+    def body(self):
+        """MultipartBody streamed from the outbox"""
+        return MultipartBody.from_file(self.path('.body'), self.content_type)
+
+    def __repr__(self):
+        return '<OutboxEntry %s>' % self.name
+
+
+class Outbox:
+    """Durable on-disk spool of encoded submissions
+
+    Producers append() submissions also while the server cannot be
+    reached; an OutboxDrainer posts them and removes them after the
+    server accepted them.  Every submission is stored fully encoded in
+    the files ``NAME.body`` (multipart body) and ``NAME.json`` (key,
+    instanceID, content type), where ``NAME`` consists of a sequence
+    number and the instanceID.
+
+    The files are written under a temporary name and renamed after they
+    were synced to disk by sync(), which is called every ``sync_every``
+    appended submissions and should be called before the source of the
+    submissions is marked as done.  Only synced submissions are handed
+    out to the drainer.  Because a submission keeps its instanceID, the
+    server recognizes it as duplicate if it is posted again after a
+    crash.
+    """
+
+    # number of appended submissions between sync() calls
+    sync_every = 50
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.failed_directory = os.path.join(directory, 'failed')
+        os.makedirs(self.failed_directory, exist_ok=True)
+        self.lock = threading.Condition()
+        # name -> OutboxEntry (synced entries, in order of sequence number)
+        self.entries = collections.OrderedDict()
+        self.unsynced = []
+        self.seq = 0
+
+        for fname in sorted(os.listdir(directory)):
+            path = os.path.join(directory, fname)
+            if fname.endswith('.tmp'):
+                # not synced before crash (source was not marked as done)
+                os.remove(path)
+                continue
+            if not fname.endswith('.json'):
+                continue
+            name = fname[:-5]
+            self.seq = max(self.seq, int(name.split('_')[0]) + 1)
+            if not os.path.exists(os.path.join(directory, name + '.body')):
+                # crashed while removing entry
+                os.remove(path)
+                continue
+            with io.open(path, encoding='utf8') as fd:
+                self.entries[name] = OutboxEntry(self, name, json.load(fd))
+
+        lo.info('outbox "%s" : %d submissions' % (directory, len(self.entries)))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, key, items, instance_id):
+        """Stores submission in outbox
+
+        Arguments:
+            - key -- identifies submission in log messages (must be
+              JSON serializable)
+            - items -- see AggregateClient.post_multipart()
+            - instance_id -- ``meta/instanceID`` of the form
+
+        Returns OutboxEntry (handed out to drainer after sync())
+        """
+        body = multipart_body(items)
+        with self.lock:
+            name = '%012d_%s' % (self.seq, re.sub(r'[^\w-]', '_', instance_id))
+            self.seq += 1
+        meta = dict(key=key, instance_id=instance_id,
+                content_type=body.content_type, length=len(body))
+        entry = OutboxEntry(self, name, meta)
+
+        with io.open(entry.path('.body.tmp'), 'wb') as fd:
+            for chunk in body:
+                fd.write(chunk)
+        with io.open(entry.path('.json.tmp'), 'w', encoding='utf8') as fd:
+            json.dump(meta, fd)
+
+        with self.lock:
+            self.unsynced.append(entry)
+            unsynced = len(self.unsynced)
+        if unsynced >= self.sync_every:
+            self.sync()
+        return entry
+
+    def sync(self):
+        """Syncs appended submissions to disk and hands them to drainer"""
+        with self.lock:
+            unsynced, self.unsynced = self.unsynced, []
+        if not unsynced:
+            return
+        for entry in unsynced:
+            for extension in ('.json', '.body'):
+                fd = os.open(entry.path(extension + '.tmp'), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            # .body is renamed last : submission is complete if it exists
+            os.replace(entry.path('.json.tmp'), entry.path('.json'))
+            os.replace(entry.path('.body.tmp'), entry.path('.body'))
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        with self.lock:
+            for entry in sorted(unsynced, key=lambda entry: entry.name):
+                self.entries[entry.name] = entry
+            self.lock.notify_all()
+
+    def first(self, timeout=None):
+        """Returns oldest synced OutboxEntry (waits up to ``timeout``
+        seconds if the outbox is empty, returns None after timeout)"""
+        with self.lock:
+            if not self.entries:
+                self.lock.wait(timeout)
+            for entry in self.entries.values():
+                return entry
+        return None
+
+    def remove(self, entry):
+        """Removes submission (after it was accepted by the server)"""
+        with self.lock:
+            self.entries.pop(entry.name, None)
+        os.remove(entry.path('.body'))
+        os.remove(entry.path('.json'))
+
+    def fail(self, entry):
+        """Moves submission that cannot be posted to ``failed/``"""
+        with self.lock:
+            self.entries.pop(entry.name, None)
+        for extension in ('.body', '.json'):
+            os.replace(entry.path(extension), os.path.join(
+                    self.failed_directory, entry.name + extension))
+
+    def requeue_failed(self):
+        """Moves the submissions in ``failed/`` back into the outbox (e.g.
+        after the form was created on the server or the credentials were
+        corrected); they are posted in the order of their sequence number
+
+        Returns number of requeued submissions
+        """
+        requeued = []
+        for fname in sorted(os.listdir(self.failed_directory)):
+            if not fname.endswith('.json'):
+                continue
+            name = fname[:-5]
+            src = os.path.join(self.failed_directory, name)
+            dst = os.path.join(self.directory, name)
+            if os.path.exists(src + '.body'):
+                os.replace(src + '.body', dst + '.body')
+            elif not os.path.exists(dst + '.body'):
+                continue
+            with io.open(src + '.json', encoding='utf8') as fd:
+                meta = json.load(fd)
+            # .json is moved last : the outbox ignores a .body without it
+            os.replace(src + '.json', dst + '.json')
+            requeued.append(OutboxEntry(self, name, meta))
+        if not requeued:
+            return 0
+        with self.lock:
+            entries = sorted(list(self.entries.values()) + requeued,
+                    key=lambda entry: entry.name)
+            self.entries = collections.OrderedDict(
+                    (entry.name, entry) for entry in entries)
+            self.lock.notify_all()
+        lo.info('outbox "%s" : requeued %d failed submissions' % (
+                self.directory, len(requeued)))
+        return len(requeued)
+
+
+class OutboxDrainer(threading.Thread):
+    """Background thread posting the submissions of an Outbox
+
+    Submissions are posted in the order they were appended and removed
+    after the server accepted them.  If posting fails because of the
+    connection or the server (see is_transient()), the submission is
+    retried after an increasing delay (by default until it succeeds, so
+    that an outage of any length is ridden out).  Submissions that the
+    server rejects (e.g. status 400, or 404 for forms that do not exist on
+    the server) are moved to ``failed/``, so that they do not hold up the
+    following ones (see Outbox.requeue_failed()).  Failing to connect does
+    not count as an attempt.
+    """
+
+    def __init__(self, outbox, client, user=None, password=None,
+            retry_interval=5, max_retry_interval=300, max_attempts=None):
+        """
+        Arguments:
+            - outbox -- Outbox to post submissions from
+            - client -- (Pooled)AggregateClient used for posting
+            - user, password (optional) -- credentials for connect()
+            - retry_interval (optional) -- seconds to wait before the
+              first retry; doubled after every failure up to
+              ``max_retry_interval``
+            - max_attempts (optional) -- posts of a submission failing
+              with transient errors before it is moved to ``failed/``
+              (default None : retry forever)
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.outbox = outbox
+        self.client = client
+        self.user = user
+        self.password = password
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.max_attempts = max_attempts
+        self.posted = 0
+        self.failed = 0
+        self.callbacks = []
+        self.stopping = threading.Event()
+
+    def add_callback(self, callback):
+        """Adds function called with every OutboxEntry posted"""
+        if not callback in self.callbacks:
+            self.callbacks.append(callback)
+
+    def stop(self):
+        """Stops thread after current submission"""
+        self.stopping.set()
+        with self.outbox.lock:
+            self.outbox.lock.notify_all()
+
+    def post(self, entry):
+        self.client.post_multipart(entry.body)
+
+    def fail(self, entry, error):
+        lo.error('cannot post "%s" from outbox : %s -> moved to %s' % (
+                entry.key, error, self.outbox.failed_directory))
+        self.outbox.fail(entry)
+        self.failed += 1
+
+    def run(self):
+        delay = self.retry_interval
+        while not self.stopping.is_set():
+            entry = self.outbox.first(timeout=1)
+            if entry is None:
+                continue
+            try:
+                if not self.client.is_connected():
+                    self.client.connect(self.user, self.password)
+            except Exception as e:
+                lo.error('could not connect to post from outbox (%d waiting) '
+                        ': %s ; retrying in %gs' % (len(self.outbox), e, delay))
+                self.stopping.wait(delay)
+                delay = min(2 * delay, self.max_retry_interval)
+                continue
+            try:
+                self.post(entry)
+            except Exception as e:
+                if not is_transient(e):
+                    # rejected by the server
+                    self.fail(entry, e)
+                    continue
+                entry.attempts += 1
+                if self.max_attempts and entry.attempts >= self.max_attempts:
+                    self.fail(entry, '%s (after %d attempts)' % (
+                            e, entry.attempts))
+                    continue
+                lo.error('could not post "%s" from outbox (%d waiting) : %s ; '
+                        'retrying in %gs' % (entry.key, len(self.outbox),
+                        e, delay))
+                self.stopping.wait(delay)
+                delay = min(2 * delay, self.max_retry_interval)
+                continue
+
+            delay = self.retry_interval
+            self.outbox.remove(entry)
+            self.posted += 1
+            lo.info('posted "%s" from outbox (%d waiting)' % (
+                    entry.key, len(self.outbox)))
+            for callback in self.callbacks:
+                callback(entry)
+
+
+### uploader configuration {{{1
+
+def parse_server_url(server):
+    """Returns ``(scheme, hostname, port, path)`` of a server address,
+    raises ValueError if it is incomplete"""
+    url = urllib.parse.urlparse(server)
+    if not url.scheme or not url.hostname or not url.path:
+        raise ValueError('incomplete server address "%s" : you must specify '
+                'scheme (http/https), server, URI' % server)
+    return (url.scheme, url.hostname,
+            url.port or (url.scheme == 'https' and 443 or 80), url.path)
+
+
+class ClientOptions:
+    """Optional settings of the uploaders for posting to Aggregate
+
+    Parses (and removes) the optional keys that mssql_uploader and
+    xray_uploader share from their JSON configuration, and creates the
+    client posting the forms.  Raises ValueError for invalid values.
+    """
+
+    def __init__(self, data, odk=None):
+        """
+        Arguments:
+            - data -- dictionary with the optional keys ``timings_file``,
+              ``outbox``, ``max_size`` and ``timeouts``
+            - odk (optional) -- dictionary with the optional keys
+              ``forms_dir``, ``replicas`` and ``balance`` (default ``data``)
+        """
+        if odk is None:
+            odk = data
+        # optional : dump request timings after uploads
+        self.timings_file = data.pop('timings_file', None)
+        # optional : spool forms in this directory and post them from there
+        self.outbox = data.pop('outbox', None)
+        # optional : split submissions into requests of at most this size
+        self.max_size = data.pop('max_size', None)
+        if self.max_size is not None:
+            try:
+                self.max_size = int(self.max_size)
+            except ValueError:
+                raise ValueError('cannot parse max_size "%s"' % self.max_size)
+        # optional : timeouts, deadline, retries and hedging (see Timeouts)
+        self.timeouts = data.pop('timeouts', None)
+        if self.timeouts is not None:
+            try:
+                self.timeouts = Timeouts(**self.timeouts)
+            except (TypeError, ValueError) as e:
+                raise ValueError('invalid timeouts : ' + str(e))
+
+        # optional : xforms are form IDs downloaded into forms_dir
+        self.forms_dir = odk.pop('forms_dir', None)
+        # optional : further front-ends of the same Aggregate (sharing its
+        # database) that receive part of the forms
+        self.replicas = []
+        for replica in odk.pop('replicas', []):
+            try:
+                self.replicas.append(parse_server_url(replica))
+            except ValueError:
+                raise ValueError('incomplete replica address "%s"' % replica)
+        self.balance = odk.pop('balance', 'outstanding')
+        if self.balance not in Balancer.POLICIES:
+            raise ValueError('balance must be one of ' +
+                    ', '.join(Balancer.POLICIES))
+
+    def create_client(self, scheme, hostname, port, path, **kwargs):
+        """Returns PooledAggregateClient posting to the server (or a
+        BalancedAggregateClient if there are replicas)
+
+        Arguments:
+            - scheme, hostname, port, path -- address of the server
+            - further keyword arguments (e.g. ``timings``,
+              ``max_connections``) are passed to every
+              PooledAggregateClient
+        """
+        def pooled(scheme, hostname, port, path):
+            return PooledAggregateClient(hostname, port, path, scheme=scheme,
+                    max_size=self.max_size, timeouts=self.timeouts, **kwargs)
+        client = pooled(scheme, hostname, port, path)
+        if not self.replicas:
+            return client
+        return BalancedAggregateClient([client] + [
+                pooled(*replica) for replica in self.replicas], self.balance)
 
 
 ### command line interface {{{1
@@ -517,6 +4624,11 @@ if __name__ == '__main__':
 
     import argparse
 
+    def hedge_delay(value):
+        if value == 'auto':
+            return value
+        return float(value)
+
     parser = argparse.ArgumentParser(description=
             'scriptable communication with ODK Aggregate server v' + VERSION)
 
@@ -524,10 +4636,13 @@ if __name__ == '__main__':
     parser.add_argument('--username', '-u', help='username for login', default=None)
     parser.add_argument('--password', '-p', help='password for login', default=None)
 
-    parser.add_argument('--server', '-s', required=True,
+    parser.add_argument('--server', '-s', action='append',
             help='complete URL of server in the form ' +
             'http[s]://server.com[:port]/ODKAggregate (assumes port ' +
-            '80 for http and 443 for https if not specified)')
+            '80 for http and 443 for https if not specified); required ' +
+            'apart from subcommand "validate"; can be specified several ' +
+            'times for front-ends sharing one database : "post" spreads ' +
+            'the forms across them (see --balance)')
 
     parsers = parser.add_subparsers(
             title='subcommands',
@@ -555,56 +4670,316 @@ if __name__ == '__main__':
     parser_post.add_argument('--csv', '-c', 
             help='read data from a .csv file; the NAME values are read from the ' +
             'first row (header) and every further row specifies the data for ' +
-            'one form; see under -v for signification of NAME');
+            'one form; see under -v for signification of NAME (the names ' +
+            'are matched case insensitively and can be abbreviated to the ' +
+            'last part of the path if it is unique)');
+    parser_post.add_argument('--jsonl', '-l',
+            help='read one JSON object per line from this file (or "-" ' +
+            'for stdin) and post a form for every line as it arrives; ' +
+            'a line has the form {"values": {NAME: VALUE, ...}, ' +
+            '"files": {NAME: FILE, ...}} or simply {NAME: VALUE, ...} ' +
+            '(see -v and -f for NAME); the progress is shown on stderr')
+    parser_post.add_argument('--concurrency', '--workers', '-n', type=int,
+            default=1, help='number of forms from the .csv/.jsonl file ' +
+            '(see --csv, --jsonl) that are posted in parallel (default 1)')
+    parser_post.add_argument('--processes', '-P', type=int, default=0,
+            help='fill in and encode the forms of the .csv file in this ' +
+            'number of worker processes (e.g. number of CPU cores) while ' +
+            'the main process only sends them (default 0 : no workers)')
+    parser_post.add_argument('--key', '-k',
+            help='column of .csv file (or value of --jsonl records) that ' +
+            'uniquely identifies a row in the journal and in log messages ' +
+            '(default: row number)')
+    parser_post.add_argument('--journal',
+            help='file in which posted rows are recorded; when a run with ' +
+            'the same journal is restarted, rows already posted are skipped ' +
+            'and interrupted rows are resent with the same instanceID')
+    parser_post.add_argument('--errors', '-e',
+            help='write rows that could not be posted to this .csv file ' +
+            '(with an additional column "error"); with --jsonl, records ' +
+            'are written as JSON lines with an additional key "error"')
+
+    parser_post.add_argument('--max-size', type=int,
+            help='maximum size of a request in bytes; larger submissions ' +
+            'are posted in several parts with the same instanceID (the ' +
+            'limit announced by the server is used if it is smaller)')
+
+    parser_post.add_argument('--timeout', type=float,
+            help='seconds after which connecting, sending a request or ' +
+            'waiting for the response is abandoned')
+    parser_post.add_argument('--deadline', type=float,
+            help='seconds after which posting a form (including all parts, ' +
+            'retries and hedged requests) is abandoned')
+    parser_post.add_argument('--retries', type=int, default=0,
+            help='post a form that failed because of the connection or the ' +
+            'server (e.g. timed out) up to this many more times (with the ' +
+            'same instanceID)')
+    parser_post.add_argument('--hedge', type=hedge_delay,
+            help='seconds after which a second copy of a form that got no ' +
+            'response yet is posted on another connection (with the same ' +
+            'instanceID); "auto" uses the 95th percentile of the duration ' +
+            'of the forms posted so far')
+
+    parser_post.add_argument('--balance', choices=Balancer.POLICIES,
+            default='outstanding',
+            help='with several --server : post every form to the server ' +
+            'with the fewest forms in flight (default) or with the lowest ' +
+            'expected latency; --concurrency applies to every server')
+
+    parser_post.add_argument('--timings', '-t',
+            help='write duration of request phases (histograms and every ' +
+            'request) to this .json file and log a summary')
+
+    parser_post.add_argument('--forms-dir',
+            help='download the XForm from the server into this directory ' +
+            '(see subcommand "forms"); --xform is then the form ID')
+
+    parser_post.add_argument('--no-validate', dest='validate',
+            action='store_false',
+            help='do not check the forms against "required", "constraint", ' +
+            '"relevant" and type of the XForm fields before posting (by ' +
+            'default, all rows of --csv are checked before the first form ' +
+            'is posted and failing rows are reported and not posted)')
 
     parser_post.add_argument('--xform', '-x', required=True, help='Xform to post')
 
+    parser_validate = parsers.add_parser('validate',
+            help='check forms from .csv/.jsonl file against the XForm ' +
+            'without posting them (--server is only needed with --forms-dir)')
+    parser_validate.set_defaults(command='validate', concurrency=1,
+            journal=None, timings=None, validate=True)
+    parser_validate.add_argument('--processes', '-P', type=int, default=0,
+            help='check the rows of the .csv file in this number of ' +
+            'worker processes (default 0 : no workers)')
+    parser_validate.add_argument('--csv', '-c',
+            help='read data from a .csv file (see post --csv)')
+    parser_validate.add_argument('--jsonl', '-l',
+            help='read JSON lines from this file or "-" (see post --jsonl)')
+    parser_validate.add_argument('--key', '-k',
+            help='column or value that identifies a row (see post --key)')
+    parser_validate.add_argument('--errors', '-e',
+            help='write rejected rows to this file (see post --errors)')
+    parser_validate.add_argument('--forms-dir',
+            help='directory with XForms downloaded from server (see ' +
+            'subcommand "forms"); --xform is then the form ID')
+    parser_validate.add_argument('--xform', '-x', required=True,
+            help='Xform to check against')
+
+    parser_forms = parsers.add_parser('forms',
+            help='download XForms from server into local directory')
+    parser_forms.set_defaults(command='forms')
+    parser_forms.add_argument('--forms-dir', required=True,
+            help='directory where XForms are stored; unchanged XForms ' +
+            'are not downloaded again')
+    parser_forms.add_argument('formid', nargs='*',
+            help='form IDs to download (default: all forms)')
+
     args = parser.parse_args()
     lo.setLevel(not args.debug and INFO or DEBUG)
 
-
-    url = urllib.parse.urlparse(args.server)
-    port = url.port or (url.scheme == 'https' and 443 or 80)
-    hostname = url.netloc
-    if ':' in url.netloc:
-        hostname = url.netloc[:url.netloc.index(':')]
-        port = int(url.netloc[url.netloc.index(':')+1:])
-    client = AggregateClient(hostname, port, url.path, scheme=url.scheme)
-    client.connect(args.username, args.password)
-
-
-    if args.command == 'post':
-
-        with io.open(args.xform) as fd:
-            form_xml = fd.read()
-            form = XForm(form_xml)
+    if not args.server and not (args.command == 'validate' and
+            not args.forms_dir):
+        parser.error('--server is required')
+    if args.command == 'validate' and not (args.csv or args.jsonl):
+        parser.error('validate needs --csv or --jsonl')
+
+
+    def parse_server(server):
+        url = urllib.parse.urlparse(server)
+        port = url.port or (url.scheme == 'https' and 443 or 80)
+        hostname = url.netloc
+        if ':' in url.netloc:
+            hostname = url.netloc[:url.netloc.index(':')]
+            port = int(url.netloc[url.netloc.index(':')+1:])
+        return hostname, port, url
+
+    servers = [parse_server(server) for server in args.server or ['']]
+    hostname, port, url = servers[0]
+
+
+    if args.command == 'forms':
+
+        client = AggregateClient(hostname, port, url.path, scheme=url.scheme)
+        client.connect(args.username, args.password)
+        paths = client.fetch_forms(FormCache(args.forms_dir),
+                args.formid or None)
+        for formid, path in sorted(paths.items()):
+            lo.info('form "%s" : %s' % (formid, path))
+
+    if args.command in ('post', 'validate'):
+
+        timings = None
+        if args.timings:
+            timings = TimingStats(records=1000000)
+        timeouts = None
+        if args.command == 'post' and (args.timeout or args.deadline or
+                args.retries or args.hedge):
+            timeouts = Timeouts(args.timeout, args.timeout, args.timeout,
+                    args.deadline, args.retries, args.hedge)
+            if args.hedge == 'auto' and timings is None:
+                # hedging delay is derived from the recorded durations
+                timings = TimingStats()
+
+        def log_timings(client=None):
+            if isinstance(client, BalancedAggregateClient):
+                for line in client.balancer.summary():
+                    lo.info('endpoint : ' + line)
+            if args.timings:
+                for line in timings.summary():
+                    lo.info('timing : ' + line)
+                timings.dump(args.timings)
+
+        def create_client(cls, balanced_cls, **kwargs):
+            clients = [cls(hostname, port, url.path, scheme=url.scheme,
+                    timings=timings, max_size=args.max_size, timeouts=timeouts,
+                    **kwargs) for hostname, port, url in servers]
+            if len(clients) == 1:
+                return clients[0]
+            return balanced_cls(clients, args.balance)
+
+        if args.forms_dir:
+            forms = FormCache(args.forms_dir)
+            if args.server:
+                forms.refresh(AggregateClient(hostname, port, url.path,
+                        scheme=url.scheme), args.username, args.password,
+                        [args.xform])
+            xform_template = forms.template(args.xform)
+        else:
+            with io.open(args.xform) as fd:
+                xform_template = XFormTemplate(fd.read())
+        form = xform_template.new()
 
         if args.csv:
 
             # post multiple forms
 
             with io.open(args.csv) as csvfd:
-
-                reader = csv.reader(csvfd)
-                header = next(reader)
-
-                idxs = {}
-                for i, name in enumerate(header):
-                    if name in form.paths:
-                        idxs[name] = i
-                    else:
-                        lo.error('field "%s" not found in form "%s" -> IGNORING',
-                                   name, args.xform)
-                        sys.exit(-1)
-
-                for row in reader:
-                    form = XForm(form_xml)
-                    for name in idxs:
-                        form[name] = row[idxs[name]]
-
-                    client.post_multipart(form.get_items())
-                    lo.info('successfully posted form %s, "%s"',
-                            args.xform, row[0])
+                header = next(csv.reader(csvfd))
+
+            idxs = {}
+            for i, name in enumerate(header):
+                path = xform_template.find_path(name)
+                if path is not None:
+                    idxs[path] = i
+                else:
+                    lo.error('field "%s" not found in form "%s" -> IGNORING',
+                               name, args.xform)
+                    sys.exit(-1)
+
+            if args.key and args.key not in header:
+                lo.error('key column "%s" not found in "%s"',
+                        args.key, args.csv)
+                sys.exit(-1)
+
+            def rows():
+                # generates rows after header; file is read twice when
+                # all rows are validated before posting
+                keyidx = args.key and header.index(args.key)
+                with io.open(args.csv) as csvfd:
+                    reader = csv.reader(csvfd)
+                    next(reader)
+                    for n, row in enumerate(reader):
+                        if args.key:
+                            yield row[keyidx], row
+                        else:
+                            yield n + 1, row
+
+            def fill(row):
+                form = xform_template.new()
+                for name in idxs:
+                    form[name] = row[idxs[name]]
+                return form
+
+            encoder = None
+            if args.processes > 0:
+                # workers fill in records (see fill_record())
+                encoder = EncodingPool(xform_template, args.processes)
+                def fill(row):
+                    return {'values': {
+                        name: row[idx] for name, idx in idxs.items()}}
+
+            journal = args.journal and Journal(args.journal)
+            report = None
+            errorsfd = None
+            if args.errors:
+                errorsfd = io.open(args.errors, 'w', newline='')
+                errors = csv.writer(errorsfd)
+                errors.writerow(header + ['error'])
+                def report(row, error):
+                    errors.writerow(row + [str(error)])
+                    errorsfd.flush()
+
+            client = None
+            if args.command == 'post':
+                client = create_client(AsyncAggregateClient,
+                        AsyncBalancedAggregateClient,
+                        concurrency=args.concurrency)
+            poster = BulkPoster(client, fill, journal=journal,
+                    report=report, label=args.xform, encoder=encoder)
+            failed = 0
+            try:
+                if args.validate:
+                    failed = poster.check(rows())
+                if args.command == 'post':
+                    failed = poster.run(rows(), args.username, args.password)
+                    log_timings(client)
+            finally:
+                if encoder is not None:
+                    encoder.close()
+                if errorsfd is not None:
+                    errorsfd.close()
+            if failed:
+                sys.exit(1)
+
+        elif args.jsonl:
+
+            # post stream of forms
+
+            if args.jsonl == '-':
+                jsonlfd = sys.stdin
+            else:
+                jsonlfd = io.open(args.jsonl)
+
+            journal = args.journal and Journal(args.journal)
+            report = None
+            errorsfd = None
+            if args.errors:
+                errorsfd = io.open(args.errors, 'w')
+                def report(record, error):
+                    if isinstance(record, Exception):
+                        record = {}
+                    errorsfd.write(json.dumps(dict(record,
+                            error=str(error))) + '\n')
+                    errorsfd.flush()
+
+            try:
+                # records are streamed : every form is validated just
+                # before it is posted
+                if args.command == 'validate':
+                    poster = BulkPoster(None,
+                            functools.partial(fill_record, xform_template),
+                            report=report, label=args.xform)
+                    failed = poster.check(read_jsonl(jsonlfd, args.key))
+                    sys.exit(failed and 1 or 0)
+
+                client = create_client(AsyncAggregateClient,
+                        AsyncBalancedAggregateClient,
+                        concurrency=args.concurrency)
+                poster = BulkPoster(client,
+                        functools.partial(fill_record, xform_template),
+                        journal=journal, report=report, label=args.xform,
+                        progress=not args.debug and sys.stderr or None,
+                        validate=args.validate)
+                failed = poster.run(read_jsonl(jsonlfd, args.key),
+                        args.username, args.password)
+                log_timings(client)
+            finally:
+                if errorsfd is not None:
+                    errorsfd.close()
+                if jsonlfd is not sys.stdin:
+                    jsonlfd.close()
+            if failed:
+                sys.exit(1)
 
         else:
 
@@ -624,8 +4999,17 @@ if __name__ == '__main__':
             for name, filename in args.file:
                 form.set_file(name, filename)
 
+            errors = args.validate and form.validate()
+            if errors:
+                for error in errors:
+                    lo.error('invalid form %s : %s', args.xform, error)
+                sys.exit(1)
+
+            client = create_client(AggregateClient, BalancedAggregateClient)
+            client.connect(args.username, args.password)
             client.post_multipart(form.get_items())
             lo.info('successfully posted form ' + args.xform)
+            log_timings(client)
 
 # vim: fdm=marker
 
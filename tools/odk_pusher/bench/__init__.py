@@ -0,0 +1,27 @@
+"""Submission throughput benchmark for the aggregate module
+
+Posts generated forms to a local stand-in OpenRosa server (or to a real
+ODK Aggregate instance) and reports forms/sec, bytes/sec and latency
+percentiles for every scenario, so that changes to the clients in
+``aggregate.py`` can be checked for regressions.
+
+Run from the ``tools/odk_pusher`` directory::
+
+  python3 -m bench -h
+  python3 -m bench --client async --concurrency 8 --latency 0.02
+  python3 -m bench --scenario image --auth --json results.json
+
+Synopsis
+--------
+
+>>> from bench import StandinServer, SCENARIOS, run_scenario
+>>> server = StandinServer(users={'user1': 'password1'}, latency=0.01).start()
+>>> stats = run_scenario(SCENARIOS['small'], server.url, count=200,
+...                      client='async', concurrency=8,
+...                      user='user1', password='password1')
+>>> print(stats.report())
+>>> server.stop()
+"""
+
+from bench.server import StandinServer
+from bench.scenarios import Scenario, SCENARIOS, Stats, run_scenario
@@ -0,0 +1,83 @@
+"""Command line interface of the benchmark (``python3 -m bench -h``)"""
+
+import sys, io, json, argparse
+
+from log import lo, init_log, INFO, DEBUG, WARNING
+from aggregate import VERSION
+from bench import StandinServer, SCENARIOS, run_scenario
+from bench.scenarios import CLIENTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=
+            'submission throughput benchmark for aggregate.py v' + VERSION)
+
+    parser.add_argument('--debug', '-d', help='show debug output', action='store_true')
+    parser.add_argument('--scenario', '-S', action='append',
+            choices=sorted(SCENARIOS),
+            help='scenario to run (can be specified multiple times; ' +
+            'default: all)')
+    parser.add_argument('--client', '-c', action='append', choices=CLIENTS,
+            help='client(s) to benchmark (default: async)')
+    parser.add_argument('--concurrency', '-n', type=int, default=4,
+            help='submissions in flight (default 4)')
+    parser.add_argument('--count', type=int, default=200,
+            help='number of submissions per text form scenario; ' +
+            'image scenarios post a tenth of this (default 200)')
+    parser.add_argument('--latency', '-l', type=float, default=0,
+            help='seconds the stand-in server waits before answering ' +
+            'a submission (default 0)')
+    parser.add_argument('--auth', '-a', action='store_true',
+            help='stand-in server requires digest access authentication')
+    parser.add_argument('--zerocopy', action='store_true',
+            help='use AggregateClient(zerocopy=True) (sync, pooled)')
+    parser.add_argument('--server', '-s',
+            help='benchmark this server instead of the stand-in ' +
+            '(complete URL, see aggregate.py -h)')
+    parser.add_argument('--username', '-u', help='username for --server')
+    parser.add_argument('--password', '-p', help='password for --server')
+    parser.add_argument('--json', '-j',
+            help='write results to this file (to compare runs)')
+
+    args = parser.parse_args()
+    init_log(lo)
+    lo.setLevel(args.debug and DEBUG or WARNING)
+
+    server = None
+    url, user, password = args.server, args.username, args.password
+    if not url:
+        users = None
+        if args.auth:
+            user, password = 'bench', 'bench'
+            users = {user: password}
+        server = StandinServer(users=users, latency=args.latency).start()
+        url = server.url
+
+    results = []
+    try:
+        for name in args.scenario or sorted(SCENARIOS):
+            scenario = SCENARIOS[name]
+            count = args.count
+            if scenario.image_size:
+                count = max(1, count // 10)
+            for client in args.client or ['async']:
+                stats = run_scenario(scenario, url, count=count,
+                        client=client, concurrency=args.concurrency,
+                        user=user, password=password,
+                        zerocopy=args.zerocopy)
+                print(stats.report())
+                sys.stdout.flush()
+                results.append(stats.as_dict())
+    finally:
+        if server:
+            server.stop()
+
+    if args.json:
+        with io.open(args.json, 'w') as fd:
+            json.dump(results, fd, indent=2)
+
+    return any(result['errors'] for result in results) and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Benchmark scenarios and statistics
+
+Every Scenario generates its own XForm (so the benchmark does not depend
+on the forms of a particular study) and fills in a new instance for every
+submission.  run_scenario() posts the submissions with one of the clients
+of the aggregate module and returns Stats.
+"""
+
+import io, os, time, uuid, tempfile, urllib.parse, concurrent.futures
+
+from aggregate import (AggregateClient, PooledAggregateClient,
+        AsyncAggregateClient, XFormTemplate, MultipartBody, post_many)
+
+
+CLIENTS = ('sync', 'pooled', 'async')
+
+
+class Scenario:
+    """Form shape posted by the benchmark"""
+
+    def __init__(self, name, description, fields, groups=1, image_size=0):
+        """
+        Arguments:
+            - name -- used to select scenario on command line
+            - description -- shown in report
+            - fields -- number of text fields
+            - groups (optional) -- fields are distributed among this many
+              groups
+            - image_size (optional) -- size of binary attachment in bytes
+              (no attachment if 0)
+        """
+        self.name = name
+        self.description = description
+        self.fields = fields
+        self.groups = groups
+        self.image_size = image_size
+
+    def paths(self):
+        per_group = -(-self.fields // self.groups)
+        return ['group%d/field%d' % (i // per_group, i)
+                for i in range(self.fields)]
+
+    def xml(self):
+        """Returns XForm XML"""
+        formid = 'bench_' + self.name
+        instance = io.StringIO()
+        binds = io.StringIO()
+        group = None
+        for path in self.paths():
+            name, field = path.split('/')
+            if name != group:
+                if group is not None:
+                    instance.write('</%s>' % group)
+                instance.write('<%s>' % name)
+                group = name
+            instance.write('<%s/>' % field)
+            binds.write('<bind nodeset="/data/%s" type="string"/>' % path)
+        if group is not None:
+            instance.write('</%s>' % group)
+        if self.image_size:
+            instance.write('<image/>')
+            binds.write('<bind nodeset="/data/image" type="binary"/>')
+
+        return ('<?xml version="1.0"?>'
+                '<h:html xmlns="http://www.w3.org/2002/xforms" '
+                'xmlns:h="http://www.w3.org/1999/xhtml" '
+                'xmlns:jr="http://openrosa.org/javarosa">'
+                '<h:head><h:title>%s</h:title><model><instance>'
+                '<data id="%s">%s<meta><instanceID/></meta></data>'
+                '</instance>%s</model></h:head><h:body/></h:html>') % (
+                        formid, formid, instance.getvalue(), binds.getvalue())
+
+    def submissions(self, count, directory):
+        """Generates ``count`` tuples ``(key, items)``
+
+        Arguments:
+            - count -- number of submissions
+            - directory -- where the attachment is created
+        """
+        xform_template = XFormTemplate(self.xml())
+        paths = self.paths()
+        image = None
+        if self.image_size:
+            image = os.path.join(directory, 'bench_%s.jpg' % self.name)
+            with io.open(image, 'wb') as fd:
+                fd.write(os.urandom(self.image_size))
+
+        for n in range(count):
+            form = xform_template.new()
+            for i, path in enumerate(paths):
+                form[path] = 'value %d of submission %d' % (i, n)
+            form['meta/instanceID'] = 'uuid:' + str(uuid.uuid4())
+            if image:
+                form.set_file('image', image)
+            yield n, form.get_items()
+
+
+SCENARIOS = dict((scenario.name, scenario) for scenario in (
+        Scenario('small', 'small text form (8 fields)', fields=8),
+        Scenario('wide', 'wide text form (500 fields in 20 groups)',
+                fields=500, groups=20),
+        Scenario('image', 'image form (4 fields, 2 MB attachment)',
+                fields=4, image_size=2 * 1024 * 1024),
+    ))
+
+
+def percentile(values, p):
+    """Returns ``p``-th percentile of sorted ``values`` (nearest rank)"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+class Stats:
+    """Throughput and latency of a benchmark run"""
+
+    def __init__(self, name, client, concurrency):
+        self.name = name
+        self.client = client
+        self.concurrency = concurrency
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+        self.elapsed = None
+
+    def add(self, elapsed, size, error=None):
+        if error is not None:
+            self.errors += 1
+        else:
+            self.latencies.append(elapsed)
+            self.bytes += size
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        forms = len(latencies)
+        return {
+                'scenario': self.name,
+                'client': self.client,
+                'concurrency': self.concurrency,
+                'forms': forms,
+                'errors': self.errors,
+                'elapsed': self.elapsed,
+                'forms_per_sec': forms / self.elapsed,
+                'bytes_per_sec': self.bytes / self.elapsed,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+            }
+
+    def report(self):
+        """Returns a single line summary"""
+        d = self.as_dict()
+        ms = lambda value: value is None and '-' or '%.1f' % (1000 * value)
+        return ('%-6s %-6s n=%-3d %6d forms %3d errors %8.1f forms/s '
+                '%8.2f MB/s  p50=%sms p95=%sms p99=%sms') % (
+                        d['scenario'], d['client'], d['concurrency'],
+                        d['forms'], d['errors'], d['forms_per_sec'],
+                        d['bytes_per_sec'] / 1e6,
+                        ms(d['p50']), ms(d['p95']), ms(d['p99']))
+
+
+def run_scenario(scenario, url, count=100, client='async', concurrency=4,
+        user=None, password=None, zerocopy=False):
+    """Posts ``count`` submissions of ``scenario`` and returns Stats
+
+    Arguments:
+        - scenario -- Scenario instance
+        - url -- URL of server (e.g. StandinServer.url)
+        - count (optional) -- number of submissions
+        - client (optional) -- one of ``CLIENTS`` : AggregateClient
+          (sequential), PooledAggregateClient (threads) or
+          AsyncAggregateClient
+        - concurrency (optional) -- submissions in flight (ignored for
+          client 'sync')
+        - user, password (optional) -- credentials
+        - zerocopy (optional) -- see AggregateClient
+    """
+    if client not in CLIENTS:
+        raise ValueError('client must be one of ' + ', '.join(CLIENTS))
+    if client == 'sync':
+        concurrency = 1
+
+    url = urllib.parse.urlparse(url)
+    port = url.port or (url.scheme == 'https' and 443 or 80)
+    args = (url.hostname, port, url.path or '/')
+    stats = Stats(scenario.name, client, concurrency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        submissions = scenario.submissions(count, directory)
+
+        if client == 'async':
+            aggregate_client = AsyncAggregateClient(*args,
+                    scheme=url.scheme, concurrency=concurrency)
+            t0 = time.time()
+            for result in post_many(aggregate_client, submissions,
+                    user, password):
+                stats.add(result.elapsed, result.size, result.error)
+            stats.elapsed = time.time() - t0
+            return stats
+
+        if client == 'pooled':
+            aggregate_client = PooledAggregateClient(*args,
+                    scheme=url.scheme, zerocopy=zerocopy,
+                    max_connections=concurrency)
+        else:
+            aggregate_client = AggregateClient(*args,
+                    scheme=url.scheme, zerocopy=zerocopy)
+        aggregate_client.connect(user, password)
+
+        def post(items):
+            t = time.time()
+            try:
+                aggregate_client.post_multipart(items)
+            except Exception as e:
+                return time.time() - t, 0, e
+            return time.time() - t, len(MultipartBody(items)), None
+
+        t0 = time.time()
+        if client == 'pooled':
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+                for result in pool.map(post,
+                        (items for key, items in submissions)):
+                    stats.add(*result)
+        else:
+            for key, items in submissions:
+                stats.add(*post(items))
+        stats.elapsed = time.time() - t0
+        aggregate_client.close()
+
+    return stats
@@ -0,0 +1,265 @@
+"""Local stand-in for the submission API of ODK Aggregate
+
+Implements just enough of the OpenRosa form submission API for the
+clients in ``aggregate.py`` : ``HEAD`` and ``POST`` on
+``<uri>/submission``, optional digest access authentication (with
+``qop="auth"`` like Aggregate) and a configurable server side latency.
+Submissions are read and counted but not stored.  Optionally, XForms are
+listed in ``<uri>/formList`` and served with ``ETag`` validators.
+"""
+
+import http.server, threading, hashlib, uuid, re, time, socket
+
+
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately : avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+    chunk_size = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def check_path(self):
+        if self.path.split('?')[0] != self.server.submission_uri:
+            self.discard_body()
+            self.respond(404)
+            return False
+        return True
+
+    def respond_cached(self, content, content_type):
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.respond(304, headers={'ETag': etag})
+        else:
+            self.respond(200, content,
+                    {'ETag': etag, 'Content-Type': content_type})
+
+    def check_auth(self):
+        """Returns True if the request is authenticated, else sends 401"""
+        if not self.server.users:
+            return True
+
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Digest '):
+            return self.challenge()
+
+        fields = dict(re.findall(r'(\w+)="?([^",]*)"?', authorization[7:]))
+        password = self.server.users.get(fields.get('username'))
+        if password is None:
+            return self.challenge()
+        if fields.get('nonce') != self.server.nonce:
+            return self.challenge(stale=True)
+
+        HA1 = hashlib.md5(('%s:%s:%s' % (fields['username'],
+                self.server.realm, password)).encode('utf8')).hexdigest()
+        HA2 = hashlib.md5(('%s:%s' % (self.command,
+                fields.get('uri', ''))).encode('utf8')).hexdigest()
+        response = hashlib.md5(':'.join([HA1, fields['nonce'],
+                fields.get('nc', ''), fields.get('cnonce', ''),
+                fields.get('qop', ''), HA2]).encode('utf8')).hexdigest()
+        if response != fields.get('response'):
+            return self.challenge()
+        return True
+
+    def challenge(self, stale=False):
+        self.server.count('challenges')
+        self.discard_body()
+        www_authenticate = 'Digest realm="%s", qop="auth", nonce="%s"' % (
+                self.server.realm, self.server.nonce)
+        if stale:
+            www_authenticate += ', stale="true"'
+        self.respond(401, headers={'WWW-Authenticate': www_authenticate})
+        return False
+
+    def discard_body(self):
+        """Reads request body and returns its length"""
+        left = size = int(self.headers.get('Content-Length') or 0)
+        while left:
+            chunk = self.rfile.read(min(left, self.chunk_size))
+            if not chunk:
+                break
+            left -= len(chunk)
+        return size - left
+
+    def respond(self, status, body=b'', headers=None):
+        self.send_response(status)
+        self.send_header('X-OpenRosa-Version', '1.0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.server.count('heads')
+        if self.check_path() and self.check_auth():
+            headers = {}
+            if self.server.max_content_length:
+                headers['X-OpenRosa-Accept-Content-Length'] = str(
+                        self.server.max_content_length)
+            self.respond(204, headers=headers)
+
+    def do_GET(self):
+        self.server.count('gets')
+        path = self.path.split('?')[0]
+        if not path.startswith(self.server.uri + '/'):
+            self.respond(404)
+            return
+        if not self.check_auth():
+            return
+
+        if path == self.server.uri + '/formList':
+            self.respond_cached(self.server.form_list(),
+                    'text/xml; charset=utf-8')
+            return
+
+        formid = path[len(self.server.uri + '/formXml/'):]
+        if path.startswith(self.server.uri + '/formXml/') and \
+                formid in self.server.forms:
+            self.respond_cached(self.server.forms[formid].encode('utf8'),
+                    'text/xml; charset=utf-8')
+        else:
+            self.respond(404)
+
+    def do_POST(self):
+        if not self.check_path() or not self.check_auth():
+            return
+
+        content_type = self.headers.get('Content-Type', '')
+        size = self.discard_body()
+        if not content_type.startswith('multipart/form-data'):
+            self.respond(400)
+            return
+        if (self.server.max_content_length and
+                size > self.server.max_content_length):
+            self.respond(413)
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.count('submissions')
+        self.server.count('bytes_received', size)
+        self.respond(201, self.server.response,
+                {'Content-Type': 'text/xml; charset=utf-8'})
+
+
+class StandinServer(http.server.ThreadingHTTPServer):
+    """Multi-threaded stand-in Aggregate server
+
+    Every connection is handled in its own thread (keep-alive is
+    supported).  The counters ``submissions``, ``bytes_received``,
+    ``heads``, ``gets`` and ``challenges`` can be read while the server
+    runs.
+    """
+
+    daemon_threads = True
+
+    response = (b'<OpenRosaResponse xmlns="http://openrosa.org/http/response">'
+            b'<message nature="submit_success">success</message>'
+            b'</OpenRosaResponse>')
+
+    def __init__(self, address='127.0.0.1', port=0, uri='/ODKAggregate',
+            users=None, latency=0, realm='ODK Aggregate', forms=None,
+            max_content_length=None):
+        """Creates server (use start() to serve in a background thread)
+
+        Arguments:
+            - address, port (optional) -- where to listen (by default on
+              localhost on a free port, see ``.url``)
+            - uri (optional) -- where the simulated Aggregate is rooted
+            - users (optional) -- dictionary username -> password; digest
+              access authentication is only required if specified
+            - latency (optional) -- seconds every submission is delayed
+              before the server responds
+            - realm (optional) -- realm for digest access authentication
+            - forms (optional) -- dictionary form ID -> XForm XML served
+              in ``<uri>/formList`` (can be modified while running)
+            - max_content_length (optional) -- announced as
+              ``X-OpenRosa-Accept-Content-Length``; larger submissions
+              are rejected with status 413
+        """
+        super().__init__((address, port), StandinHandler)
+        self.uri = uri.rstrip('/')
+        self.submission_uri = self.uri + '/submission'
+        self.users = users or {}
+        self.latency = latency
+        self.realm = realm
+        self.forms = forms or {}
+        self.max_content_length = max_content_length
+        self.nonce = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.thread = None
+        # open client connections (closed by stop())
+        self.connections = set()
+        self.reset()
+
+    @property
+    def url(self):
+        return 'http://%s:%d%s' % (
+                self.server_address[0], self.server_address[1], self.uri)
+
+    def reset(self):
+        """Resets all counters"""
+        with self.lock:
+            self.submissions = self.bytes_received = 0
+            self.heads = self.gets = self.challenges = 0
+
+    def count(self, name, value=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def form_list(self):
+        """Returns OpenRosa formList XML of ``.forms``"""
+        xforms = ''.join(
+                '<xform><formID>%s</formID><name>%s</name>'
+                '<version></version><hash>md5:%s</hash>'
+                '<downloadUrl>%s/formXml/%s</downloadUrl></xform>' % (
+                    formid, formid,
+                    hashlib.md5(xml.encode('utf8')).hexdigest(),
+                    self.url, formid)
+                for formid, xml in sorted(self.forms.items()))
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<xforms xmlns="http://openrosa.org/xforms/xformsList">'
+                '%s</xforms>' % xforms).encode('utf8')
+
+    def renew_nonce(self):
+        """Makes the current nonce stale (as Aggregate does eventually)"""
+        self.nonce = uuid.uuid4().hex
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self.connections.discard(request)
+        super().shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        # clients closing connections are not worth a traceback
+        pass
+
+    def start(self):
+        """Serves requests in a background thread; returns self"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and drops keep-alive connections (like a server
+        that goes down)"""
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread:
+            self.thread.join()
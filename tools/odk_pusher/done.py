@@ -0,0 +1,173 @@
+"""Remembers which images were uploaded (used by xray_uploader)
+
+Two implementations with the same interface are available (see STORES) :
+
+  - SqliteDoneStore (default) keeps the file names (and optionally the
+    SHA-256 of the file contents) in an indexed SQLite database in WAL mode;
+    nothing is loaded at startup, and a crash cannot tear entries.  An existing
+    ``_done.txt`` is imported once when the database is created.
+  - TextDoneStore keeps one file name per line in ``_done.txt`` (format of
+    older versions), which is completely loaded at startup.
+
+By default, every entry is committed when it is added, so that no uploaded
+image is forgotten after a crash (with SQLite in WAL mode and
+``synchronous=NORMAL`` such a commit is cheap).  With ``batch`` larger than 1,
+entries are committed in batches : after a crash up to ``batch - 1`` of the
+most recent entries are lost (and these images would be uploaded again).
+Call flush() after every upload and close() before exiting.
+"""
+
+import os, io, time, hashlib, threading, sqlite3
+
+from log import lo
+
+
+def digest(path):
+    """Returns hex SHA-256 of the contents of file ``path``"""
+    sha = hashlib.sha256()
+    with io.open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class TextDoneStore:
+    """One file name per line in ``<directory>/_done.txt``"""
+
+    fname = '_done.txt'
+
+    def __init__(self, directory, batch=1):
+        self.path = os.path.join(directory, self.fname)
+        self.done = set()
+        if os.path.exists(self.path):
+            with io.open(self.path) as fd:
+                self.done = set(line.strip('\n\r') for line in fd)
+        self.batch = batch
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.fd = io.open(self.path, 'a')
+
+    def __contains__(self, fname):
+        return fname in self.done
+
+    def find(self, digest):
+        """Returns None (contents are not stored)"""
+        return None
+
+    def add(self, fname, digest=None):
+        with self.lock:
+            self.done.add(fname)
+            self.fd.write(fname + '\n')
+            self.pending += 1
+            if self.pending >= self.batch:
+                self.sync()
+
+    def sync(self):
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.pending = 0
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.sync()
+
+    def close(self):
+        self.flush()
+        self.fd.close()
+
+
+class SqliteDoneStore:
+    """File names and contents digests in ``<directory>/_done.sqlite``"""
+
+    fname = '_done.sqlite'
+    schema = (
+            'CREATE TABLE IF NOT EXISTS done ('
+            'fname TEXT PRIMARY KEY, digest TEXT, time REAL) WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS done_digest ON done (digest)',
+        )
+
+    def __init__(self, directory, batch=1):
+        self.path = os.path.join(directory, self.fname)
+        text_path = os.path.join(directory, TextDoneStore.fname)
+        if not os.path.exists(self.path) and os.path.exists(text_path):
+            self.migrate(text_path)
+        if os.path.exists(text_path):
+            # migrated, but not renamed before (crash)
+            os.replace(text_path, text_path + '.migrated')
+
+        self.db = self.connect(self.path)
+        self.batch = batch
+        self.pending = 0
+        # upload threads add entries, GUI and watcher threads look them up
+        self.lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, path):
+        db = sqlite3.connect(path, check_same_thread=False,
+                isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        # WAL with synchronous=NORMAL : commits survive crashes of the
+        # program (not necessarily power failures) and are much faster
+        db.execute('PRAGMA synchronous=NORMAL')
+        for statement in cls.schema:
+            db.execute(statement)
+        return db
+
+    def migrate(self, text_path):
+        """Imports ``text_path`` (once) into a new database"""
+        tmp = self.path + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        db = self.connect(tmp)
+        with io.open(text_path) as fd:
+            fnames = set(line.strip('\n\r') for line in fd)
+        fnames.discard('')
+        db.execute('BEGIN')
+        db.executemany('INSERT OR IGNORE INTO done (fname) VALUES (?)',
+                ((fname, ) for fname in fnames))
+        db.execute('COMMIT')
+        # the WAL must be merged into tmp before it is renamed
+        db.execute('PRAGMA journal_mode=DELETE')
+        db.close()
+        os.replace(tmp, self.path)
+        lo.info('imported %d uploaded images from "%s" into "%s"' % (
+                len(fnames), text_path, self.path))
+
+    def __contains__(self, fname):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM done WHERE fname = ?',
+                    (fname, )).fetchone() is not None
+
+    def find(self, digest):
+        """Returns name of a file with contents ``digest``, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT fname FROM done WHERE digest = ?',
+                    (digest, )).fetchone()
+        return row and row[0]
+
+    def add(self, fname, digest=None):
+        with self.lock:
+            if not self.pending:
+                self.db.execute('BEGIN')
+            self.db.execute('INSERT OR REPLACE INTO done (fname, digest, time) '
+                    'VALUES (?, ?, ?)', (fname, digest, time.time()))
+            self.pending += 1
+            if self.pending >= self.batch:
+                self.commit()
+
+    def commit(self):
+        self.db.execute('COMMIT')
+        self.pending = 0
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+STORES = dict(sqlite=SqliteDoneStore, text=TextDoneStore)
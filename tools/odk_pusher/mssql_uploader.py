@@ -18,15 +18,18 @@ VERSION = '1.0.0'
 
 
 import json, io, os.path, sqlite3, urllib, unittest, threading, time, datetime
+import concurrent.futures
 
 import tkinter as tk, tkinter.messagebox, tkinter.ttk
 
 import pypyodbc
 
 from log import lo, LogFrame, init_log, log_e, tic, toc
-from aggregate import XForm, XFormException
+from aggregate import XForm, XFormTemplate, XFormException
 from gui import ScrolledListbox, FieldsGui, guierror
 from aggregate import AggregateException, AggregateClient
+from aggregate import FormCache, TimingStats, Outbox, OutboxDrainer
+from aggregate import ClientOptions
 
 
 ## config {{{1
@@ -83,6 +86,10 @@ class Config:
         self.title = extract_remove(data, 'title')
         self.interval = extract_remove(data, 'interval')
         self.dryrun = extract_remove(data, 'dryrun')
+        # optional : number of forms posted in parallel
+        self.upload_workers = data.pop('upload_workers', 4)
+        if not isinstance(self.upload_workers, int) or self.upload_workers < 1:
+            raise ConfigException('upload_workers must be a positive number')
 
         # odk settings
         server = extract_remove(data, ['odk', 'server'])
@@ -96,6 +103,12 @@ class Config:
         self.odk.port = url.port or (url.scheme == 'https' and 443 or 80)
         self.odk.path = url.path
 
+        # optional : timings_file, outbox, max_size, timeouts and (in "odk")
+        # forms_dir, replicas, balance (see ClientOptions)
+        try:
+            self.client_options = ClientOptions(data, data.get('odk', {}))
+        except ValueError as e:
+            raise ConfigException(str(e))
         self.odk.username = extract_remove(data, ['odk', 'username'])
         self.odk.password = extract_remove(data, ['odk', 'password'])
 
@@ -125,6 +138,18 @@ class Config:
         self.rownames = {}
         self.rowids = {}
 
+        forms = None
+        if self.client_options.forms_dir:
+            forms = FormCache(self.client_options.forms_dir)
+            try:
+                forms.refresh(AggregateClient(self.odk.hostname,
+                        self.odk.port, self.odk.path, scheme=self.odk.scheme),
+                        self.odk.username, self.odk.password, [
+                            table['xform'] for table in data['tables'].values()
+                            if isinstance(table, dict) and 'xform' in table])
+            except AggregateException as e:
+                raise ConfigException('could not download XForms : ' + str(e))
+
         names = [name for name in data['tables'].keys()]
         for name in names:
 
@@ -134,10 +159,13 @@ class Config:
             self.rowids[name] = extract_remove(data, ['tables', name, 'rowid'])
 
             try:
-                with io.open(xform) as fd:
-                    self.xforms[name] = fd.read()
+                if forms:
+                    self.xforms[name] = forms.xml(xform)
+                else:
+                    with io.open(xform) as fd:
+                        self.xforms[name] = fd.read()
                 XForm(self.xforms[name])
-            except (XFormException, IOError) as e:
+            except (XFormException, AggregateException, IOError) as e:
                 raise ConfigException('could not load XForm "%s" : %s' % (
                         xform, str(e)))
 
@@ -185,6 +213,7 @@ class SqlTable:
             they have to be incremented when new rows are added
         :param array names: (list of) column name(s) that are used to create
             the :py:methd:`rowname`
+        :param str xform: ``.xml`` source of form to be filled with data
         """
 
         if isinstance(ids, str):
@@ -197,7 +226,7 @@ class SqlTable:
         self.names = names
         self.sql = sql
         self.conn = conn
-        self.xform = xform
+        self.xform_template = XFormTemplate(xform)
 
         # parse SQL statement
         try:
@@ -248,6 +277,16 @@ class SqlTable:
         except (pypyodbc.ProgrammingError, SyntaxError) as e:
             raise SqlTableException('cannot execute T-SQL statement : ' + str(e))
 
+        # map columns to XForm paths
+        self.colpaths = []
+        self.ignored = []
+        for i, colname in enumerate(self.colnames):
+            path = self.xform_template.find_path(colname)
+            if path is None:
+                self.ignored.append(colname)
+            else:
+                self.colpaths.append((i, colname, path))
+
         # find index of id columns
         self.ididxs = []
         self.nameidxs = []
@@ -301,24 +340,17 @@ class SqlTable:
             return value
 
     def fill_xform(self, row):
-        xform = XForm(self.xform)
-        ignored = []
-        lowerpaths = [path.lower() for path in xform.paths]
-        for i, colname in enumerate(self.colnames):
-            if colname in lowerpaths:
-                idx = lowerpaths.index(colname)
-                path = xform.paths[idx]
-                # are stored as varchar(24)...
-                if colname.endswith('_date') or colname.endswith('_time'):
-                    value = self.parse_datetime(row[i])
-                else:
-                    value = row[i]
-                xform[path] = value
+        xform = self.xform_template.new()
+        for i, colname, path in self.colpaths:
+            # are stored as varchar(24)...
+            if colname.endswith('_date') or colname.endswith('_time'):
+                value = self.parse_datetime(row[i])
             else:
-                ignored.append(colname)
-        if ignored:
+                value = row[i]
+            xform[path] = value
+        if self.ignored:
             lo.debug('created XForm : ignored %d values from db : %s' % (
-                    len(ignored), ignored))
+                    len(self.ignored), self.ignored))
         return xform
 
 
@@ -565,7 +597,12 @@ class FakeModel:
 class UploadThread(threading.Thread):
     """Background thread uploading data form the database"""
 
-    def __init__(self, client, model, interval, dryrun, username, password):
+    # new rows are read, validated and uploaded in batches of this many
+    # rows per upload worker
+    batch_rows = 25
+
+    def __init__(self, client, model, interval, dryrun, username, password,
+            timings_file=None, outbox=None, upload_workers=1):
         threading.Thread.__init__(self)
         self.daemon = False
 
@@ -575,7 +612,18 @@ class UploadThread(threading.Thread):
         self.model = model
         self.interval = interval
         self.dryrun = dryrun
+        self.timings_file = timings_file
         self.callbacks = []
+        # forms are posted from this many threads (client must be
+        # thread-safe, e.g. PooledAggregateClient)
+        self.upload_workers = upload_workers
+
+        # forms are queued in outbox (also while offline) and posted by
+        # the drainer thread
+        self.outbox = outbox
+        self.drainer = None
+        if outbox is not None and not dryrun:
+            self.drainer = OutboxDrainer(outbox, client, username, password)
 
         self.should_stop = False
 
@@ -592,9 +640,9 @@ class UploadThread(threading.Thread):
             return True
 
         try:
-            client.connect(self.username, self.password)
+            self.client.connect(self.username, self.password)
             return True
-        except AggregateException as e:
+        except (AggregateException, OSError) as e:
             lo.error('could not connect : ' + str(e))
             return False
         except Exception as e:
@@ -602,12 +650,55 @@ class UploadThread(threading.Thread):
             log_e(lo)
             return False
 
-    def try_send(self, table, row):
-        xform = table.fill_xform(row)
+    def log_timings(self):
+        timings = self.client.timings
+        if timings is None:
+            return
+        for line in timings.summary():
+            lo.info('timing : ' + line)
+        if self.timings_file:
+            try:
+                timings.dump(self.timings_file)
+            except IOError as e:
+                lo.error('could not write timings : ' + str(e))
+
+    def next_batch(self, name):
+        """Returns up to ``batch_rows * upload_workers`` new rows of table
+        ``name`` (empty list when all new rows were read)"""
+        rows = []
+        while (len(rows) < self.batch_rows * self.upload_workers and
+                not self.should_stop):
+            row = self.model.get_next_new(name)
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
+    def check(self, name, table, rows):
+        """Fills in forms and validates them against the XForm binds
+
+        Returns ``(row, xform)`` for every valid row; invalid rows are
+        logged and not uploaded (they are retried after a restart)
+        """
+        valid = []
+        for row in rows:
+            xform = table.fill_xform(row)
+            errors = xform.validate()
+            if errors:
+                lo.error('invalid form %s from table %s : %s' % (
+                        table.rowname(row), name, '; '.join(errors)))
+            else:
+                valid.append((row, xform))
+        if len(valid) < len(rows):
+            lo.warning('%d of %d new rows from table %s are invalid' % (
+                    len(rows) - len(valid), len(rows), name))
+        return valid
+
+    def try_send(self, xform):
         try:
             self.client.post_multipart(xform.get_items())
             return True
-        except AggregateException as e:
+        except (AggregateException, OSError) as e:
             lo.error('could not connect : ' + str(e))
             return False
         except Exception as e:
@@ -615,13 +706,77 @@ class UploadThread(threading.Thread):
             log_e(lo)
             return False
 
+    def send(self, name, table, forms):
+        """Posts forms in ``upload_workers`` threads; rows are marked done
+        (from this thread) as soon as their form was accepted
+
+        Returns number of forms uploaded.
+        """
+        uploaded = 0
+        with concurrent.futures.ThreadPoolExecutor(
+                self.upload_workers) as executor:
+            futures = {
+                    executor.submit(self.try_send, xform): row
+                    for row, xform in forms
+                }
+            for future in concurrent.futures.as_completed(futures):
+                if self.should_stop:
+                    # forms in flight are still marked done
+                    for pending in futures:
+                        pending.cancel()
+                if future.cancelled() or not future.result():
+                    continue
+                row = futures[future]
+                lo.info('uploaded form %s from table %s' % (
+                        table.rowname(row), name))
+                self.model.mark_done(name, row)
+                self.notify()
+                uploaded += 1
+        return uploaded
+
     def run(self):
+        if self.drainer is not None:
+            self.drainer.start()
+        try:
+            self.poll()
+        finally:
+            if self.drainer is not None:
+                self.drainer.stop()
+                self.drainer.join()
+
+    def queue(self, name, table, forms):
+        """Appends forms to outbox, marks rows done after syncing outbox"""
+        queued = []
+        for row, xform in forms:
+            if self.should_stop:
+                break
+            try:
+                # parts are posted in the order they are appended
+                for part in self.client.split_items(xform.get_items()):
+                    self.outbox.append('%s %s' % (name, table.rowname(row)),
+                            part, xform['meta/instanceID'])
+                queued.append(row)
+            except Exception as e:
+                lo.error('could not queue form %s from table %s : %s' % (
+                        table.rowname(row), name, str(e)))
+                log_e(lo)
+        self.outbox.sync()
+        for row in queued:
+            lo.info('queued form %s from table %s' % (table.rowname(row), name))
+            self.model.mark_done(name, row)
+            self.notify()
+        return len(queued)
+
+    def poll(self):
         n = 0
         while not self.should_stop:
 
+            uploaded = 0
+
             lo.debug('uploader running n=%d' % n)
 
-            if not self.dryrun and not self.try_connect():
+            if (not self.dryrun and self.drainer is None and
+                    not self.try_connect()):
                 lo.info('cannot connect; wait for 1 minute')
                 for sec in range(60):
                     time.sleep(1)
@@ -640,25 +795,28 @@ class UploadThread(threading.Thread):
                 if n == 0:
                     lo.info('sync data with MS-SQL table "%s"' % name)
 
-                row = self.model.get_next_new(name)
-                while row is not None:
+                # a large backlog is not held in memory at once : every
+                # batch is validated and sent before the next one is read
+                rows = self.next_batch(name)
+                while rows:
 
-                    if self.should_stop:
-                        break
-
-                    rowname = table.rowname(row)
-                    if self.dryrun:
-                        lo.info('would upload form %s from table %s' % (
-                                rowname, name))
-                        time.sleep(1)
+                    forms = self.check(name, table, rows)
+                    if self.drainer is not None:
+                        uploaded += self.queue(name, table, forms)
+                    elif not self.dryrun:
+                        uploaded += self.send(name, table, forms)
                     else:
-                        if self.try_send(table, row):
-                            lo.info('uploaded form %s from table %s' % (
-                                    rowname, name))
-                            self.model.mark_done(name, row)
-                            self.notify()
+                        for row, xform in forms:
+                            if self.should_stop:
+                                break
+                            lo.info('would upload form %s from table %s' % (
+                                    table.rowname(row), name))
+                            time.sleep(1)
+
+                    rows = self.next_batch(name)
 
-                    row = self.model.get_next_new(name)
+            if uploaded:
+                self.log_timings()
 
             seconds = self.interval
             while seconds > 0 and not self.should_stop:
@@ -716,15 +874,25 @@ if __name__ == '__main__':
                 'SQL Error')
 
 
-    client = AggregateClient(
-            config.odk.hostname, config.odk.port, config.odk.path,
-            scheme=config.odk.scheme)
+    outbox = None
+    if config.client_options.outbox:
+        outbox = Outbox(config.client_options.outbox)
+        outbox.requeue_failed()
+
+    timings = TimingStats(records=1000)
+    client = config.client_options.create_client(
+            config.odk.scheme, config.odk.hostname, config.odk.port,
+            config.odk.path, timings=timings,
+            max_connections=config.upload_workers)
 
     uploader = UploadThread(
             client=client,
             model=model,
             interval=config.interval, dryrun=config.dryrun,
-            username=config.odk.username, password=config.odk.password
+            username=config.odk.username, password=config.odk.password,
+            timings_file=config.client_options.timings_file,
+            outbox=outbox,
+            upload_workers=config.upload_workers
         )
     gui = MainGui(model, config, uploader)
     gui.wm_title(config.title, url=config.odk.hostname)
@@ -0,0 +1,185 @@
+"""Shrinks images and converts them to JPEG (used by xray_uploader)
+
+Images are decoded, resized and encoded in-process with Pillow_, with the
+same semantics as ImageMagick's ``convert SRC -quality Q -resize N> DST`` :
+images wider than ``N`` pixels are shrunk to a width of ``N`` pixels
+(keeping the aspect ratio), narrower images are only re-encoded.  Images
+that Pillow cannot read (or if Pillow is not installed) are converted by
+the external ``convert`` executable instead.
+
+A ResizePool keeps worker processes around, so that hundreds of images do
+not start hundreds of processes.
+
+.. _Pillow: https://python-pillow.org/
+"""
+
+import os, subprocess, warnings, concurrent.futures
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from log import lo
+
+
+class ResizeException(Exception):
+    """Raised if an image can be converted by none of the engines"""
+
+
+def target_size(size, pixels):
+    """Returns size of image with ``size`` after ``-resize pixels>``"""
+    width, height = size
+    if width <= pixels:
+        return size
+    return pixels, max(1, int(height * pixels / width + .5))
+
+
+def open_image(src):
+    """Returns decoded PIL.Image, None if Pillow cannot read ``src``
+
+    Images exceeding ``Image.MAX_IMAGE_PIXELS`` (decompression bombs) are
+    left to convert as well.
+    """
+    if Image is None:
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            image = Image.open(src)
+            image.load()
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError,
+            Image.DecompressionBombWarning) as e:
+        lo.debug('Pillow cannot read "%s" : %s' % (src, e))
+        return None
+    return image
+
+
+def to_jpeg_mode(image):
+    """Converts image to a mode that can be saved as JPEG"""
+    if image.mode in ('L', 'RGB', 'CMYK'):
+        return image
+    if image.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N'):
+        # 16 bit grayscale (common for scans) : scale instead of clipping
+        return image.convert('I').point(lambda v: v * (1 / 256.)).convert('L')
+    if image.mode in ('1', 'LA', 'F'):
+        return image.convert('L')
+    return image.convert('RGB')
+
+
+def resize_pillow(image, dst, pixels, quality=100):
+    """Writes ``image`` (PIL.Image) resized as JPEG to ``dst``"""
+    info = image.info
+    size = target_size(image.size, pixels)
+    image = to_jpeg_mode(image)
+    if size != image.size:
+        # reducing_gap : shrink by integer factor first (fast, same result)
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    options = {}
+    for key in ('exif', 'icc_profile', 'dpi'):
+        if info.get(key):
+            options[key] = info[key]
+    tmp = dst + '.tmp'
+    # like convert, chroma is not subsampled for quality >= 90
+    image.save(tmp, 'JPEG', quality=quality,
+            subsampling=quality >= 90 and 0 or 2, **options)
+    os.replace(tmp, dst)
+
+
+def resize_convert(convert_executable, src, dst, pixels, quality=100):
+    """Converts image with the external ``convert`` executable"""
+    subprocess.check_call([
+            convert_executable,
+            src,
+            '-quality', str(quality),
+            '-resize', '%d>' % pixels,
+            dst
+        ])
+
+
+def resize(src, dst, pixels, quality=100, convert_executable=None):
+    """Shrinks image ``src`` to width ``pixels`` and writes JPEG ``dst``
+
+    Returns name of engine used ('pillow' or 'convert'); raises
+    ResizeException if the image cannot be converted.
+    """
+    image = open_image(src)
+    if image is not None:
+        with image:
+            resize_pillow(image, dst, pixels, quality)
+        return 'pillow'
+
+    if not convert_executable:
+        raise ResizeException('cannot read image "%s" (and no convert '
+                'executable specified)' % src)
+    try:
+        resize_convert(convert_executable, src, dst, pixels, quality)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise ResizeException('convert failed for "%s" : %s' % (src, e))
+    return 'convert'
+
+
+class ResizePool:
+    """Resizes images in a pool of worker processes (see resize())
+
+    Worker processes are started when the first image is submitted and
+    then kept until close() is called.  With ``processes=0``, images are
+    resized in the calling thread.
+    """
+
+    def __init__(self, pixels, quality=100, convert_executable=None,
+            processes=None):
+        """
+        Arguments:
+            - pixels -- maximum width of the resized images
+            - quality (optional) -- JPEG quality (1-100)
+            - convert_executable (optional) -- path of ImageMagick's
+              ``convert`` used for images Pillow cannot read
+            - processes (optional) -- number of worker processes (default:
+              number of CPUs)
+        """
+        self.pixels = pixels
+        self.quality = quality
+        self.convert_executable = convert_executable
+        if processes is None:
+            processes = os.cpu_count() or 1
+        self.processes = processes
+        self.executor = None
+        if Image is None:
+            lo.warning('Pillow not installed : images are converted with "%s"'
+                    % convert_executable)
+            # starting convert does not need a pool
+            self.processes = 0
+        if self.processes:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.processes)
+
+    def submit(self, src, dst):
+        """Starts resizing ``src`` into ``dst``; returns Future of the
+        engine name (see resize())"""
+        args = (src, dst, self.pixels, self.quality, self.convert_executable)
+        if self.executor is not None:
+            return self.executor.submit(resize, *args)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(resize(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def resize(self, src, dst):
+        """Resizes ``src`` into ``dst``; returns engine name"""
+        engine = self.submit(src, dst).result()
+        lo.debug('resized "%s" to "%s" with %s' % (src, dst, engine))
+        return engine
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,131 @@
+"""Scans directory trees in parallel (used by xray_uploader)
+
+A TreeScanner lists all files below a directory with ``os.scandir``,
+scanning several directories at the same time in a pool of threads (which
+helps a lot on network shares, where every listing waits for the server).
+
+The result of every scan (size and modification time of every file, and
+the modification time of every directory) is stored in a JSON snapshot.
+The next scan -- also after the program was restarted -- only lists the
+directories whose modification time changed, because creating, deleting or
+renaming a file changes the modification time of its directory.
+"""
+
+import os, io, json, time, concurrent.futures
+
+from log import lo
+
+
+class TreeScanner:
+    """Lists files below ``root`` (see scan())"""
+
+    snapshot_version = 1
+    # directories modified this shortly before they were listed might be
+    # modified again without their mtime changing (coarse timestamps)
+    racy = 2.
+
+    def __init__(self, root, snapshot_path=None, workers=8, skip=None):
+        """
+        Arguments:
+            - root -- directory to scan recursively
+            - snapshot_path (optional) -- JSON file in which the snapshot is
+              kept between runs
+            - workers (optional) -- number of directories listed in parallel
+            - skip (optional) -- function returning True for the names of
+              files and directories that are ignored
+        """
+        self.root = root
+        self.snapshot_path = snapshot_path
+        self.workers = workers
+        self.skip = skip or (lambda name: False)
+        # relative path of directory -> dict(mtime, files, dirs)
+        self.snapshot = self.load()
+
+    def load(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return {}
+        try:
+            data = json.load(io.open(self.snapshot_path))
+        except (IOError, ValueError) as e:
+            lo.warning('ignoring snapshot "%s" : %s' % (self.snapshot_path, e))
+            return {}
+        if data.get('version') != self.snapshot_version:
+            return {}
+        return data['dirs']
+
+    def save(self):
+        if not self.snapshot_path:
+            return
+        tmp = self.snapshot_path + '.tmp'
+        with io.open(tmp, 'w') as fd:
+            json.dump(dict(version=self.snapshot_version, dirs=self.snapshot), fd)
+        os.replace(tmp, self.snapshot_path)
+
+    def scan_dir(self, rel, started):
+        """Returns ``(rel, entry, listed)`` for directory ``rel`` (relative to
+        root), reusing the snapshot if its mtime did not change; returns
+        None if the directory disappeared"""
+        path = os.path.join(self.root, rel)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            old = self.snapshot.get(rel)
+            if old is not None and old['mtime'] == mtime:
+                return rel, old, False
+
+            files = {}
+            dirs = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if self.skip(entry.name):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        files[entry.name] = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            lo.debug('directory "%s" disappeared while scanning' % path)
+            return None
+
+        if started - mtime / 1e9 < self.racy:
+            # list again next time
+            mtime = None
+        return rel, dict(mtime=mtime, files=files, dirs=dirs), True
+
+    def scan(self):
+        """Returns dictionary relative path -> (size, mtime) of all files
+        below root, and saves the updated snapshot"""
+        started = time.time()
+        snapshot = {}
+        listed = 0
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            pending = {executor.submit(self.scan_dir, '', started)}
+            while pending:
+                done, pending = concurrent.futures.wait(pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result is None:
+                        continue
+                    rel, entry, fresh = result
+                    snapshot[rel] = entry
+                    listed += fresh
+                    for name in entry['dirs']:
+                        pending.add(executor.submit(self.scan_dir,
+                                os.path.join(rel, name), started))
+
+        self.snapshot = snapshot
+        try:
+            self.save()
+        except IOError as e:
+            lo.error('could not save snapshot "%s" : %s' % (
+                    self.snapshot_path, str(e)))
+
+        files = {}
+        for rel, entry in snapshot.items():
+            for name, (size, mtime) in entry['files'].items():
+                files[os.path.join(rel, name)] = (size, mtime)
+        lo.debug('scanned "%s" in %.2fs : %d files in %d directories '
+                '(%d listed)' % (self.root, time.time() - started, len(files),
+                len(snapshot), listed))
+        return files
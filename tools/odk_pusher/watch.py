@@ -0,0 +1,185 @@
+"""Watches a directory for new files with Linux inotify (used by xray_uploader)
+
+A DirectoryWatcher reports files that were created, written or moved into
+a directory (and files that were deleted or moved away) as soon as they
+have settled : a file is only reported after no event was received for it
+during ``debounce`` seconds and its size and modification time did not
+change in the meantime, so that images are not picked up while they are
+still being copied.
+
+inotify is only available on Linux (see available()); on other platforms
+the directory has to be rescanned periodically.
+"""
+
+import os, sys, struct, select, threading, time, ctypes, ctypes.util
+
+from log import lo, log_e
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+MASK = (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO |
+        IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF)
+
+# struct inotify_event (followed by ``len`` bytes of name)
+EVENT = struct.Struct('iIII')
+
+libc = None
+if sys.platform.startswith('linux'):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        libc = None
+
+
+def available():
+    """Returns True if directories can be watched on this platform"""
+    return libc is not None
+
+
+class WatchException(Exception):
+    """Raised if a directory cannot be watched"""
+
+
+class DirectoryWatcher:
+    """Background thread reporting settled changes in a directory
+
+    ``callback(fname)`` is called from the watcher thread with the name of
+    every file that appeared, changed or disappeared (check whether it
+    exists); ``callback(None)`` is called if events were lost and the whole
+    directory has to be rescanned.
+    """
+
+    def __init__(self, path, callback, debounce=2.):
+        """
+        Arguments:
+            - path -- directory to watch (not recursively)
+            - callback -- see class documentation
+            - debounce (optional) -- seconds a file must stay unchanged
+              before it is reported
+        """
+        if not available():
+            raise WatchException('inotify not available on ' + sys.platform)
+        self.path = path
+        self.callback = callback
+        self.debounce = debounce
+        # fname -> (time when it is reported, (size, mtime) at last event)
+        self.pending = {}
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchException('inotify_init1 failed : ' +
+                    os.strerror(ctypes.get_errno()))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), MASK)
+        if wd < 0:
+            os.close(self.fd)
+            raise WatchException('cannot watch "%s" : %s' % (
+                    path, os.strerror(ctypes.get_errno())))
+        # stop() wakes up the watcher thread by writing into this pipe
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.thread = None
+
+    def start(self):
+        """Starts watcher thread; returns self"""
+        self.thread = threading.Thread(target=self.run_wrapped, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            return
+        os.write(self.wakeup_w, b'x')
+        self.thread.join()
+        self.thread = None
+        for fd in (self.fd, self.wakeup_r, self.wakeup_w):
+            os.close(fd)
+
+    def signature(self, fname):
+        """Returns (size, mtime) of ``fname``, None if it does not exist"""
+        try:
+            st = os.stat(os.path.join(self.path, fname))
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def read_events(self):
+        """Reads available events; returns False if watch was removed"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return True
+        now = time.monotonic()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                lo.warning('lost events watching "%s" : rescanning' % self.path)
+                self.pending.clear()
+                self.callback(None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                lo.error('stopped watching "%s" (directory removed)' % self.path)
+                return False
+            if mask & IN_ISDIR or not name:
+                continue
+
+            fname = os.fsdecode(name)
+            self.pending[fname] = (now + self.debounce, self.signature(fname))
+        return True
+
+    def report_settled(self):
+        """Reports pending files without recent changes; returns seconds
+        until the next pending file is due (None if nothing pending)"""
+        now = time.monotonic()
+        for fname, (due, signature) in list(self.pending.items()):
+            if due > now:
+                continue
+            current = self.signature(fname)
+            if current != signature:
+                # still being written (without generating events)
+                self.pending[fname] = (now + self.debounce, current)
+                continue
+            del self.pending[fname]
+            self.callback(fname)
+        if not self.pending:
+            return None
+        return max(0, min(due for due, signature in self.pending.values())
+                - time.monotonic())
+
+    def run_wrapped(self):
+        try:
+            self.run()
+        except Exception as e:
+            lo.error('unexpected error watching "%s" : %s' % (self.path, str(e)))
+            log_e(lo)
+
+    def run(self):
+        lo.info('watching "%s" for new images' % os.path.abspath(self.path))
+        timeout = None
+        while True:
+            readable, _, _ = select.select(
+                    [self.fd, self.wakeup_r], [], [], timeout)
+            if self.wakeup_r in readable:
+                return
+            if self.fd in readable and not self.read_events():
+                return
+            timeout = self.report_settled()
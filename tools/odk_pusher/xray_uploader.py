@@ -23,17 +23,52 @@ changelog
     - create two log files ('xray_uploader.log' and 'xray_uploader_debug.log')
     - by default use file 'xray_uploader.json'
     - use guierror window if error during startup
+  - version 1.1.0
+    - images are resized in-process with Pillow in a pool of worker
+      processes (``resize_processes``, ``quality``); ``convert_executable``
+      is optional and only used for images Pillow cannot read
+  - version 1.2.0
+    - images are converted while previous images are uploaded
+      (``convert_ahead``), forms can be posted by several threads
+      (``upload_workers``)
+  - version 1.3.0
+    - new images are picked up as soon as they are written (inotify, on
+      Linux); full rescans only every ``rescan_interval`` minutes
+  - version 1.4.0
+    - images can be read from subdirectories (``recursive``), scanned in
+      parallel (``scan_workers``); only directories that changed since the
+      last scan are listed again
+  - version 1.5.0
+    - uploaded images are remembered in ``_done.sqlite`` (SQLite database,
+      with contents digests) instead of ``_done.txt``, which is imported
+      once (``done_store``)
+  - version 1.5.1
+    - images with the same name in different subdirectories are converted
+      into different intermediary files; rescans also notice images that
+      were replaced by others
+    - contents digests of uploaded images are only computed with
+      ``detect_duplicates``; the done store is closed on exit
+    - resize worker processes are stopped on exit; images exceeding the
+      size limit of Pillow are converted with ``convert_executable``
+  - version 1.5.2
+    - forms are posted from the ``outbox`` until the server accepts them
+      (also after long outages); forms in ``failed`` are retried on start
+    - every uploaded image is committed to the done store at once (instead
+      of in batches of 20)
 """
 
-VERSION = '1.0.2'
+VERSION = '1.5.2'
 
 import os.path, urllib.parse, threading, time, subprocess, re, uuid, sys, io, json, glob
+import queue
+import multiprocessing
 import tkinter as tk, tkinter.font, tkinter.messagebox
 from sre_constants import error as RegularExpressionException
 
 from log import lo, LogFrame, init_log, log_e
-from aggregate import AggregateClient, AggregateException, XForm, XFormException, VERSION as AGGREGATE_VERSION
+from aggregate import AggregateClient, AggregateException, XFormTemplate, XFormException, FormCache, TimingStats, Outbox, OutboxDrainer, ClientOptions, VERSION as AGGREGATE_VERSION
 from gui import ScrolledListbox, FieldsGui
+import resize, watch, scan, done
 
 
 ### config {{{1
@@ -75,19 +110,24 @@ class Config:
         self.password = extract_key('password')
 
         self.xray_dir = extract_key('xray_dir')
-        self.convert_executable = extract_key('convert_executable')
-        try:
-            subprocess.check_call([
-                    self.convert_executable,
-                    '--version'
-                ])
-        except subprocess.CalledProcessError as e:
-            raise ConfigException('convert executable "%s" raised error : %s' % (
-                self.convert_executable, str(e)))
-        except OSError as e:
-            if '[Errno 2]' in str(e):
-                raise ConfigException('could not find executable "%s"' %
-                        self.convert_executable)
+        # optional with Pillow : only used for images Pillow cannot read
+        self.convert_executable = data.pop('convert_executable', None)
+        if resize.Image is None:
+            if not self.convert_executable:
+                raise ConfigException('convert_executable must be ' +
+                        'specified if Pillow is not installed')
+            try:
+                subprocess.check_call([
+                        self.convert_executable,
+                        '--version'
+                    ])
+            except subprocess.CalledProcessError as e:
+                raise ConfigException('convert executable "%s" raised error : %s' % (
+                    self.convert_executable, str(e)))
+            except OSError as e:
+                if '[Errno 2]' in str(e):
+                    raise ConfigException('could not find executable "%s"' %
+                            self.convert_executable)
         try:
             self.id_re = re.compile(extract_key('id_re'))
             self.manual_fields = {
@@ -98,13 +138,45 @@ class Config:
             raise ConfigException('invalid regular expression : ' + str(e))
 
         self.xform = extract_key('xform')
+        # optional : timings_file, outbox, max_size, timeouts, forms_dir,
+        # replicas, balance (see ClientOptions)
+        try:
+            self.client_options = ClientOptions(data)
+        except ValueError as e:
+            raise ConfigException(str(e))
         try:
-            XForm(io.open(self.xform).read())
-        except XFormException as e:
+            if self.client_options.forms_dir:
+                forms = FormCache(self.client_options.forms_dir)
+                forms.refresh(AggregateClient(self.hostname, self.port,
+                        self.path, scheme=self.scheme),
+                        self.username, self.password, [self.xform])
+                self.xform_template = forms.template(self.xform)
+            else:
+                self.xform_template = XFormTemplate(io.open(self.xform).read())
+        except (XFormException, AggregateException, IOError) as e:
             raise ConfigException('could not load XForm "%s" : %s' % (
                     self.xform, str(e)))
 
         self.pixels = extract_key('pixels')
+        # optional : JPEG quality and number of processes resizing images
+        self.quality = data.pop('quality', 100)
+        if not isinstance(self.quality, int) or not 1 <= self.quality <= 100:
+            raise ConfigException('quality must be a number from 1 to 100')
+        self.resize_processes = data.pop('resize_processes', None)
+        self.resizer = resize.ResizePool(self.pixels, self.quality,
+                self.convert_executable, self.resize_processes)
+        # optional : number of images converted ahead of the upload and
+        # number of threads posting forms in parallel
+        try:
+            self.convert_ahead = int(data.pop('convert_ahead',
+                    max(2, self.resizer.processes)))
+            self.upload_workers = int(data.pop('upload_workers', 1))
+        except ValueError as e:
+            raise ConfigException('cannot parse convert_ahead/upload_workers : '
+                    + str(e))
+        if self.convert_ahead < 1 or self.upload_workers < 1:
+            raise ConfigException('convert_ahead and upload_workers must be '
+                    'at least 1')
 
         self.auto = bool(extract_key('auto'))
         if self.auto and self.manual_fields:
@@ -116,6 +188,27 @@ class Config:
             self.interval = float(interval)
         except ValueError:
             raise ConfigException('cannot parse interval "%s"' % interval)
+        # optional : also upload images from subdirectories of xray_dir
+        self.recursive = bool(data.pop('recursive', False))
+        self.scan_workers = data.pop('scan_workers', 8)
+        if not isinstance(self.scan_workers, int) or self.scan_workers < 1:
+            raise ConfigException('scan_workers must be a positive number')
+        # optional : how uploaded images are remembered (see done.py)
+        self.done_store = data.pop('done_store', 'sqlite')
+        if self.done_store not in done.STORES:
+            raise ConfigException('done_store must be one of ' +
+                    ', '.join(sorted(done.STORES)))
+        # optional : warn about images uploaded before under another name
+        self.detect_duplicates = bool(data.pop('detect_duplicates', False))
+        # optional : react to new images instead of rescanning every interval
+        # (only on Linux); debounce is in seconds, rescan_interval in minutes
+        self.watch = bool(data.pop('watch', True))
+        try:
+            self.debounce = float(data.pop('debounce', 2))
+            self.rescan_interval = float(data.pop('rescan_interval', 60))
+        except ValueError as e:
+            raise ConfigException('cannot parse debounce/rescan_interval : '
+                    + str(e))
 
         for key in data:
             lo.warning('ignoring config key : ' + key)
@@ -140,13 +233,36 @@ def load_config(candidates):
 class XrayStore:
     """Directory containing Xray images and preserving state"""
 
-    done_fname = '_done.txt'
+    snapshot_fname = '_snapshot.json'
     intermediary = '_intermediary'
 
-    def __init__(self, xray_dir, id_re=re.compile('.*')):
+    def __init__(self, xray_dir, id_re=re.compile('.*'), recursive=False,
+            scan_workers=8, done_store='sqlite', detect_duplicates=False):
+        """
+        Arguments:
+            - xray_dir -- directory containing the images
+            - id_re (optional) -- regular expression images IDs must match
+            - recursive (optional) -- whether images are also searched in
+              subdirectories (then file names are relative paths)
+            - scan_workers (optional) -- number of directories scanned in
+              parallel if ``recursive``
+            - done_store (optional) -- how uploaded images are remembered
+              (see done.STORES)
+            - detect_duplicates (optional) -- whether the contents of
+              uploaded images are remembered to warn about images that
+              were uploaded before under another name (reads every image
+              once more)
+        """
 
         self.xray_dir = xray_dir
         self.id_re = id_re
+        self.detect_duplicates = detect_duplicates
+        self.done = None
+        self.scanner = None
+        if recursive:
+            self.scanner = scan.TreeScanner(xray_dir,
+                    os.path.join(xray_dir, self.snapshot_fname),
+                    scan_workers, self.ignore)
 
         if not os.path.isdir(xray_dir):
             lo.error('could not find xray directory "%s"' % xray_dir)
@@ -158,42 +274,57 @@ class XrayStore:
             lo.info('created intermediary xray directory "%s"' % intermediary_dir)
 
 
-        self.done = set()
-        self.done_path = os.path.join(xray_dir, self.done_fname)
-        if os.path.exists(self.done_path):
-            self.done = set([
-                    line.strip('\n\r')
-                    for line in io.open(self.done_path).readlines()
-                ])
+        self.done = done.STORES[done_store](xray_dir)
 
         self.ignored = set()
         self.todo = set()
+        # images are marked done from several upload threads
+        self.lock = threading.Lock()
         self.update(initial=True)
 
-    def update(self, initial=False):
+    def check(self, fname):
+        """Returns True if file ``fname`` is an image that can be uploaded"""
 
-        todo = set()
-        # get list of files
-        done_n = 0
-        for fname in os.listdir(self.xray_dir):
+        if self.ignore(os.path.basename(fname)):
+            return False
 
-            if os.path.isdir(self.path(fname)):
-                continue
+        if fname in self.ignored:
+            return False
 
-            if self.ignore(fname):
-                continue
+        if not self.image(fname):
+            lo.warning('ignoring image "%s" : %s' % (fname, self.invalid(fname)))
+            self.ignored.add(fname)
+            return False
 
-            if fname in self.ignored:
-                continue
+        if self.invalid(fname):
+            lo.info('ignoring file "%s" (unknown extension)' % fname)
+            self.ignored.add(fname)
+            return False
 
-            if not self.image(fname):
-                lo.warning('ignoring image "%s" : %s' % (fname, self.invalid(fname)))
-                self.ignored.add(fname)
-                continue
+        return True
+
+    def update(self, initial=False):
+        # watcher and upload threads change todo as well
+        with self.lock:
+            self.rescan(initial)
+
+    def listdir(self):
+        """Returns names of all files (relative paths if recursive)"""
+        if self.scanner is not None:
+            return self.scanner.scan()
+        return [
+                fname for fname in os.listdir(self.xray_dir)
+                if not os.path.isdir(self.path(fname))
+            ]
+
+    def rescan(self, initial):
 
-            if self.invalid(fname):
-                lo.info('ignoring file "%s" (unknown extension)' % fname)
-                self.ignored.add(fname)
+        todo = set()
+        # get list of files
+        done_n = 0
+        for fname in self.listdir():
+
+            if not self.check(fname):
                 continue
 
             if fname in self.done:
@@ -201,17 +332,71 @@ class XrayStore:
             else:
                 todo.add(fname)
 
-        if len(todo) != len(self.todo):
+        if todo != self.todo:
             if initial:
                 lo.info('scanned "%s" : %d files to upload (%d already done)' % (
-                    os.path.abspath(self.xray_dir), len(todo), len(self.done)))
+                    os.path.abspath(self.xray_dir), len(todo), done_n))
             else:
-                lo.info('rescanned "%s" : %d new images' % (
-                    os.path.abspath(self.xray_dir), len(todo) - len(self.todo)))
+                lo.info('rescanned "%s" : %d new images, %d removed' % (
+                    os.path.abspath(self.xray_dir), len(todo - self.todo),
+                    len(self.todo - todo)))
             self.todo = todo
 
+    def changed(self, fname):
+        """Updates ``todo`` after ``fname`` was added or removed; returns
+        True if ``todo`` changed"""
+        with self.lock:
+            if not os.path.exists(self.path(fname)):
+                if fname in self.todo:
+                    self.todo.remove(fname)
+                    lo.info('image "%s" was removed' % fname)
+                    return True
+                return False
+            if fname in self.todo or fname in self.done:
+                return False
+            if os.path.isdir(self.path(fname)) or not self.check(fname):
+                return False
+            self.todo.add(fname)
+            lo.info('new image "%s"' % fname)
+            return True
+
+    def watch(self, callback, debounce=2.):
+        """Keeps ``todo`` up to date with inotify (see watch.py)
+
+        ``callback()`` is called from the watcher thread whenever ``todo``
+        changed. Returns the started DirectoryWatcher, or None if the
+        directory cannot be watched (and has to be rescanned periodically).
+        """
+        if self.scanner is not None:
+            lo.info('not watching "%s" : subdirectories are rescanned '
+                    'instead' % self.xray_dir)
+            return None
+
+        def event(fname):
+            if fname is None:
+                self.update()
+                callback()
+            elif self.changed(fname):
+                callback()
+
+        try:
+            watcher = watch.DirectoryWatcher(self.xray_dir, event, debounce)
+        except watch.WatchException as e:
+            lo.info('cannot watch "%s" : %s' % (self.xray_dir, str(e)))
+            return None
+        watcher.start()
+        # images copied before the watch was set up
+        self.update()
+        callback()
+        return watcher
+
     def intermediary_path(self, fname):
-        return os.path.join(self.xray_dir, self.intermediary, fname)
+        """Returns path of converted image ``fname`` (a relative path if
+        recursive : subdirectories are mirrored, so that images with the
+        same name in different directories do not overwrite each other)"""
+        path = os.path.join(self.xray_dir, self.intermediary, fname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
 
     def path(self, fname):
         return os.path.join(self.xray_dir, fname)
@@ -228,7 +413,7 @@ class XrayStore:
             )
 
     def get_id(self, fname):
-        return os.path.splitext(fname)[0]
+        return os.path.splitext(os.path.basename(fname))[0]
 
     def invalid(self, fname):
         if self.id_re.match(self.get_id(fname)):
@@ -237,10 +422,30 @@ class XrayStore:
                 self.get_id(fname), self.id_re.pattern)
 
     def mark_done(self, xray):
-        assert xray in self.todo
-        self.done.add(xray)
-        self.todo.remove(xray)
-        io.open(self.done_path, 'a').write(xray + '\n')
+        contents = None
+        if self.detect_duplicates:
+            try:
+                contents = done.digest(self.path(xray))
+            except IOError as e:
+                lo.warning('could not read "%s" : %s' % (xray, str(e)))
+        if contents is not None:
+            duplicate = self.done.find(contents)
+            if duplicate is not None:
+                lo.warning('image "%s" has the same contents as "%s", which '
+                        'was uploaded before' % (xray, duplicate))
+        with self.lock:
+            assert xray in self.todo
+            self.done.add(xray, contents)
+            self.todo.remove(xray)
+
+    def flush(self):
+        """Writes images marked done to disk"""
+        self.done.flush()
+
+    def close(self):
+        if self.done is not None:
+            self.done.close()
+            self.done = None
 
 
 class XrayFormException(Exception):
@@ -257,17 +462,16 @@ class XrayForm:
 
         self.config = config
         self.fields = config.manual_fields
-        try:
-            self.xform = XForm(io.open(config.xform).read())
-        except Exception as e:
-            raise XrayFormException('could not load XForm : ' + str(e))
+        self.xform = config.xform_template.new()
 
         if store.invalid(fname):
             raise XrayFormException('invalid filename : ' + store.invalid(fname))
 
         self.store = store
         self.fname = fname
-        self.fname2= os.path.splitext(fname)[0] + self.extension
+        # in the same subdirectory (see XrayStore.intermediary_path())
+        self.fname2 = os.path.join(os.path.dirname(fname),
+                store.get_id(fname) + self.extension)
 
         for name, validator in self.fields.items():
             if not name in field_data:
@@ -287,6 +491,10 @@ class XrayForm:
                 time.localtime(store.ctime(fname)))
         self.xform.set_file('xray_image', self.path2())
 
+        errors = self.xform.validate()
+        if errors:
+            raise XrayFormException('invalid form : ' + '; '.join(errors))
+
     def path1(self):
         return self.store.path(self.fname)
     def path2(self):
@@ -296,13 +504,14 @@ class XrayForm:
         src = self.path1()
         dst = self.path2()
         lo.debug('converting "%s" to "%s"' % (src, dst))
-        subprocess.check_call([
-                self.config.convert_executable,
-                src,
-                '-quality', '100',
-                '-resize', '%d>' % self.config.pixels,
-                dst
-            ])
+        self.config.resizer.resize(src, dst)
+
+    def submit(self):
+        """Starts converting the image; returns Future (see ResizePool)"""
+        src = self.path1()
+        dst = self.path2()
+        lo.debug('converting "%s" to "%s"' % (src, dst))
+        return self.config.resizer.submit(src, dst)
 
     def get_items(self):
         return self.xform.get_items()
@@ -313,12 +522,14 @@ class XrayForm:
 class UploadThread:
     """Background thread uploading XrayForm associated data"""
     
-    def __init__(self, config, client, store, xrays, data):
+    def __init__(self, config, client, store, xrays, data, outbox=None):
         self.config = config
         self.client = client
         self.store = store
         self.xrays = list(xrays)
         self.data = data
+        # forms are queued in outbox (also while offline) instead of posted
+        self.outbox = outbox
         self.cancel = False
 
     def start(self, callback=None, fake=False):
@@ -334,6 +545,7 @@ class UploadThread:
             lo.info('would have uploaded ' + self.xrays[0])
             self.store.mark_done(self.xrays[0])
             del self.xrays[0]
+        self.store.flush()
         if self.cancel:
             lo.info('upload canceled')
         callback()
@@ -345,10 +557,97 @@ class UploadThread:
         except Exception as e:
             lo.error('unexpected error : ' + str(e))
             log_e(lo)
+            # images uploaded before the error
+            self.store.flush()
             callback()
 
+    def convert(self, forms):
+        """Builds XrayForm of selected images and starts their conversion
+
+        ``(xray, form, future)`` are put into the bounded queue ``forms`` in
+        the order of the selection, so that conversion runs at most
+        ``convert_ahead`` images ahead of the upload; one ``None`` per upload
+        worker is put at the end.
+        """
+        while not self.cancel and self.xrays:
+            xray = self.xrays[0]
+            data = self.data[self.xrays[0]]
+            del self.xrays[0]
+            try:
+                form = XrayForm(self.config, self.store, xray, data)
+                future = form.submit()
+            except Exception as e:
+                lo.error('could not convert image "%s" : %s' % (xray, str(e)))
+                log_e(lo)
+                continue
+            forms.put((xray, form, future))
+
+    def pipeline(self, upload, workers):
+        """Converts images in ``self.xrays`` and calls ``upload(xray, form)``
+        in ``workers`` threads as soon as an image is converted
+
+        Returns after all images are uploaded (or the upload is canceled).
+        """
+        forms = queue.Queue(self.config.convert_ahead)
+
+        def uploader():
+            while True:
+                item = forms.get()
+                if item is None:
+                    return
+                xray, form, future = item
+                if self.cancel:
+                    # not uploaded : not marked done
+                    future.cancel()
+                    continue
+                try:
+                    future.result()
+                    upload(xray, form)
+                except Exception as e:
+                    lo.error('could not upload image "%s" : %s' % (xray, str(e)))
+                    log_e(lo)
+
+        threads = [threading.Thread(target=uploader) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            self.convert(forms)
+        finally:
+            for thread in threads:
+                forms.put(None)
+            for thread in threads:
+                thread.join()
+
+    def run_queue(self, callback):
+        queued = []
+
+        def upload(xray, form):
+            # parts are posted in the order they are appended
+            for part in self.client.split_items(form.get_items()):
+                self.outbox.append(xray, part,
+                        form.xform['meta/instanceID'])
+            queued.append(xray)
+
+        # single thread : forms are appended in the order of the selection
+        self.pipeline(upload, 1)
+
+        # images are only marked done when their forms are on disk
+        self.outbox.sync()
+        for xray in queued:
+            self.store.mark_done(xray)
+            lo.info('queued image "%s" (%d waiting)' % (xray, len(self.outbox)))
+        self.store.flush()
+
+        if self.cancel:
+            lo.info('upload canceled')
+        callback()
+
     def run(self, callback):
 
+        if self.outbox is not None:
+            self.run_queue(callback)
+            return
+
         try:
             self.client.connect(self.config.username, self.config.password)
         except AggregateException as e:
@@ -361,28 +660,35 @@ class UploadThread:
             callback()
             return
 
-        while not self.cancel and self.xrays:
-            xray = self.xrays[0]
-            data = self.data[self.xrays[0]]
-            del self.xrays[0]
-            try:
-                form = XrayForm(self.config, self.store, xray, data)
-                form.process()
-                self.client.post_multipart(form.get_items())
+        def upload(xray, form):
+            self.client.post_multipart(form.get_items())
 
-                self.store.mark_done(xray)
-                lo.info('uploaded image "%s" (%.2f kb)' % (
-                    form.fname2, os.path.getsize(form.path2())/1024))
+            # only marked done after the server accepted the form
+            self.store.mark_done(xray)
+            lo.info('uploaded image "%s" (%.2f kb)' % (
+                form.fname2, os.path.getsize(form.path2())/1024))
 
-            except Exception as e:
-                lo.error('could not upload image "%s" : %s' % (xray, str(e)))
-                log_e(lo)
+        self.pipeline(upload, self.config.upload_workers)
+        self.store.flush()
 
         if self.cancel:
             lo.info('upload canceled')
 
+        self.log_timings()
         callback()
 
+    def log_timings(self):
+        timings = self.client.timings
+        if timings is None:
+            return
+        for line in timings.summary():
+            lo.info('timing : ' + line)
+        if self.config.client_options.timings_file:
+            try:
+                timings.dump(self.config.client_options.timings_file)
+            except IOError as e:
+                lo.error('could not write timings : ' + str(e))
+
 
 def after(f):
     """Decorator that calls function with 1ms delay from GUI thread"""
@@ -429,6 +735,10 @@ class MainGui:
 
         self.uploading = False
         self.upload_thread = None
+        self.outbox = None
+        self.watcher = None
+        # images arrived during upload
+        self.changed_while_uploading = False
 
         self.win.bind('<Return>', self.button_cb)
         def select_all(x=None):
@@ -462,16 +772,46 @@ class MainGui:
         lo.debug('using aggregate version ' + str(AGGREGATE_VERSION))
         self.wm_title(client.url)
 
+    def set_watcher(self, watcher, rescan_interval):
+        """New images are reported by ``watcher``; full rescans are only
+        done every ``rescan_interval`` minutes"""
+        self.watcher = watcher
+        self.interval.set(rescan_interval)
+        self.update_auto()
+
+    @after
+    def store_changed(self):
+        if self.uploading:
+            self.changed_while_uploading = True
+            return
+        self.rebuild_list()
+        if self.auto.get() and self.store.todo:
+            lo.info('starting automatic upload')
+            self.xray_list.listbox.selection_set(0, 'end')
+            self.button_cb()
+
+    def set_outbox(self, outbox, drainer):
+        self.outbox = outbox
+        drainer.start()
+
     def confirm_exit(self):
         if self.uploading:
             tkinter.messagebox.showinfo('Upload in progress',
                     'Please stop upload before quitting program')
         else:
+            if self.watcher is not None:
+                self.watcher.stop()
+            # writes images marked done, stops the worker processes
+            if self.store is not None:
+                self.store.close()
+            self.config.resizer.close()
             sys.exit(0)
 
     def rebuild_list(self):
         self.xray_list.listbox.delete(0, 'end')
-        for xray in sorted(self.store.todo):
+        with self.store.lock:
+            todo = sorted(self.store.todo)
+        for xray in todo:
             self.xray_list.listbox.insert('end', xray)
 
     def button_cb(self, x=None):
@@ -498,7 +838,8 @@ class MainGui:
 
     def start_upload(self, xrays, data):
         self.uploading = True
-        self.upload_thread = UploadThread(self.config, self.client, self.store, xrays, data)
+        self.upload_thread = UploadThread(self.config, self.client, self.store,
+                xrays, data, self.outbox)
         self.upload_thread.start(self.upload_done)
 
     @after
@@ -510,10 +851,13 @@ class MainGui:
         self.xray_list.listbox['state'] = 'normal'
         self.rebuild_list()
         self.set_next_interval()
+        if self.changed_while_uploading:
+            self.changed_while_uploading = False
+            self.store_changed()
 
     def set_next_interval(self):
         interval = self.interval.get()
-        elf.interval_id = self.win.after(
+        self.interval_id = self.win.after(
                 int(60 * 1000 * interval), self.interval_cb)
 
     def update_auto(self, *args):
@@ -521,7 +865,9 @@ class MainGui:
             self.win.after_cancel(self.interval_id)
             self.interval_id = None
 
-        if self.auto.get():
+        if self.auto.get() and self.watcher is not None:
+            self.auto_label['text'] = 'auto upload of new images'
+        elif self.auto.get():
             interval = self.interval.get()
             self.auto_label['text'] = 'auto upload every %d min' % interval
         else:
@@ -543,6 +889,9 @@ class MainGui:
 
 if __name__ == '__main__':
 
+    # worker processes of ResizePool in frozen executable (py2exe)
+    multiprocessing.freeze_support()
+
     lo.handlers = [] # for use with iPython
     init_log(lo, filename='xray_uploader.log', debug_filename='xray_uploader_debug.log')
 
@@ -558,14 +907,26 @@ if __name__ == '__main__':
 
     win = MainGui()
 
-    win.set_store(XrayStore(config.xray_dir, config.id_re))
+    store = XrayStore(config.xray_dir, config.id_re, config.recursive,
+            config.scan_workers, config.done_store, config.detect_duplicates)
+    win.set_store(store)
     win.set_config(config)
-
-    client = AggregateClient(
-            config.hostname, config.port, config.path,
-            scheme=config.scheme)
+    if config.watch:
+        watcher = store.watch(win.store_changed, config.debounce)
+        if watcher is not None:
+            win.set_watcher(watcher, config.rescan_interval)
+
+    timings = TimingStats(records=1000)
+    client = config.client_options.create_client(config.scheme, config.hostname,
+            config.port, config.path, timings=timings)
     win.set_client(client)
 
+    if config.client_options.outbox:
+        outbox = Outbox(config.client_options.outbox)
+        outbox.requeue_failed()
+        win.set_outbox(outbox, OutboxDrainer(outbox, client,
+                config.username, config.password))
+
     tk.mainloop()
 
 # vim: fdm=marker